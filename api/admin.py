@@ -1,7 +1,11 @@
 from django.contrib import admin
-from .models import OutputVideo, VideoData, FaceImage
+from .models import OutputVideo, VideoData, FaceImage, JobMetrics, VideoRendition, JobBatch, WorkerStatus
 
 # Register your models here.
 admin.site.register(VideoData)
 admin.site.register(FaceImage)
-admin.site.register(OutputVideo)
\ No newline at end of file
+admin.site.register(OutputVideo)
+admin.site.register(JobMetrics)
+admin.site.register(VideoRendition)
+admin.site.register(JobBatch)
+admin.site.register(WorkerStatus)
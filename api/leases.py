@@ -0,0 +1,148 @@
+import os
+import uuid
+import socket
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import OutputVideo
+
+DEFAULT_LEASE_OPTIONS = {
+    # a claimed job belongs to its worker until this many seconds after the last heartbeat
+    "lease_seconds": 90,
+    "heartbeat_seconds": 20,
+    # starts (claims) after which an expired job is failed instead of requeued
+    "max_attempts": 3,
+    # requeued jobs wait retry_backoff_seconds * 2^(attempts - 1) before they can run again
+    "retry_backoff_seconds": 30,
+}
+
+
+def lease_options():
+    options = dict(DEFAULT_LEASE_OPTIONS)
+    options.update(getattr(settings, "JOB_LEASE_OPTIONS", {}))
+    return options
+
+
+def worker_identity():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def lease_expiry(now=None, options=None):
+    options = options or lease_options()
+    return (now or timezone.now()) + timedelta(seconds=options["lease_seconds"])
+
+
+def renew_lease(job_id, worker_id, options=None):
+    """
+    Push the lease of a job this worker holds forward. False means the lease is gone.
+    """
+    return bool(
+        OutputVideo.objects.filter(
+            pk=job_id, status="processing", worker_id=worker_id
+        ).update(lease_expires_at=lease_expiry(options=options))
+    )
+
+
+def release_lease(job_id, worker_id):
+    """
+    Drop this worker's lease once the job is finished, unless it already lost it.
+    """
+    OutputVideo.objects.filter(pk=job_id, worker_id=worker_id).update(
+        worker_id=None, lease_expires_at=None
+    )
+
+
+def reap_expired_jobs(now=None):
+    """
+    Requeue processing jobs whose lease expired (their worker died or hung) with an
+    exponential backoff, or fail them once they used up max_attempts. Processing jobs
+    without a lease are reaped too: every claim sets one, so they were started before
+    leases existed or lost theirs to a worker that didn't finish them.
+    Returns (requeued, failed) counts.
+    """
+    options = lease_options()
+    now = now or timezone.now()
+    requeued = failed = 0
+    lapsed = Q(lease_expires_at__lt=now) | Q(lease_expires_at__isnull=True)
+
+    expired = OutputVideo.objects.filter(lapsed, status="processing").only("id", "attempts")
+    for job in expired:
+        # conditional on the lease still being expired, a late heartbeat wins the race
+        still_expired = OutputVideo.objects.filter(lapsed, pk=job.pk, status="processing")
+        if job.attempts >= options["max_attempts"]:
+            failed += still_expired.update(
+                status="failed", worker_id=None, lease_expires_at=None
+            )
+        else:
+            backoff = options["retry_backoff_seconds"] * 2 ** max(job.attempts - 1, 0)
+            requeued += still_expired.update(
+                status="queued",
+                worker_id=None,
+                lease_expires_at=None,
+                retry_at=now + timedelta(seconds=backoff),
+            )
+    return requeued, failed
+
+
+def claim_job(job_id, worker_id, now=None, options=None):
+    """
+    Conditional queued -> processing update that gives worker_id the lease.
+    """
+    now = now or timezone.now()
+    return bool(
+        OutputVideo.objects.filter(pk=job_id, status="queued").update(
+            status="processing",
+            progress=0,
+            started_at=now,
+            worker_id=worker_id,
+            lease_expires_at=lease_expiry(now, options),
+            attempts=F("attempts") + 1,
+        )
+    )
+
+
+class LeaseHeartbeat:
+    """
+    Renews a job's lease from a background thread while the worker renders it.
+    lost is set once a renewal fails, the job was reaped and may already belong to
+    another worker, so the render should stop writing to it.
+    """
+
+    def __init__(self, job_id, worker_id, options=None):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.options = options or lease_options()
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"lease-heartbeat-{job_id}", daemon=True
+        )
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.options["heartbeat_seconds"]):
+                close_old_connections()
+                try:
+                    renewed = renew_lease(self.job_id, self.worker_id, self.options)
+                except Exception:
+                    # a database hiccup isn't a lost lease, the next beat retries
+                    continue
+                if not renewed:
+                    self.lost.set()
+                    return
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        return False
@@ -1,12 +1,32 @@
 import os
 import time
+import shutil
 import traceback
+from contextlib import ExitStack
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from django.core.files import File
-from api.models import OutputVideo
+from django.db import close_old_connections
+from django.utils import timezone
+from api.models import OutputVideo, VideoData, VideoRendition
+from api.services import record_job_metrics
+from api.leases import LeaseHeartbeat, reap_expired_jobs, release_lease, worker_identity
+from api.workers import (
+    ProgressWriter,
+    WorkerHeartbeat,
+    reap_stale_workers,
+    register_worker,
+    remove_ready_file,
+    set_worker_state,
+    write_ready_file,
+)
+from api.storage import checkpoint_path, collect_garbage, remove_files, storage_options
+from api.scheduler import claim_shared_jobs, estimate_job_cost, pick_next_job
 from helpers.yt_downloader import download_youtube
-from helpers.composite import FaceSwapBackgroundEngine
+from helpers.composite import FaceSwapBackgroundEngine, RenderCancelled
+from helpers.profiling import GroupTimers, reset_peak_rss
+from helpers.memory import MemoryBudgetExceeded
+from helpers.matting import load_matting_benchmark
 
 import uuid
 from helpers.cloudflare_CRUD import upload_file
@@ -19,140 +39,465 @@ class Command(BaseCommand):
     help = "process face swap background jobs in the queue"
 
     def handle(self, *args, **options):
+        self.load_settings()
+        self.worker_id = worker_identity()
+        warmup = getattr(settings, "WORKER_WARMUP", {})
+        ready_file = getattr(settings, "WORKER_READY_FILE", None)
+
+        register_worker(self.worker_id)
+        with WorkerHeartbeat(self.worker_id):
+            try:
+                self.start_engine(warmup)
+                if ready_file:
+                    write_ready_file(
+                        str(ready_file), self.worker_id, warmup_seconds=self.warmup_seconds
+                    )
+                self.stdout.write("Worker is running, we can start sending video requests :D")
+                self.work()
+            finally:
+                if ready_file:
+                    remove_ready_file(str(ready_file))
+                self.report_state("stopped")
+
+    def load_settings(self):
         project_root = getattr(settings, "BASE_DIR", os.getcwd())
-        model_path = getattr(
+        self.model_path = getattr(
             settings,
             "SWAPPER_MODEL_PATH",
             os.path.join(project_root, "helpers", "models", "inswapper_128.onnx"),
         )
 
-        self.stdout.write("Worker is running, we can start sending video requests :D")
+        self.session_options = getattr(settings, "ONNX_SESSION_OPTIONS", None)
+        self.precision = getattr(settings, "MODEL_PRECISION", "fp32")
+        self.quantized_model_dir = getattr(settings, "QUANTIZED_MODEL_DIR", None)
+        self.static_frame_threshold = getattr(settings, "STATIC_FRAME_THRESHOLD", None)
+        self.rendition_specs = getattr(settings, "VIDEO_RENDITIONS", [])
+        self.preview_options = getattr(
+            settings,
+            "PREVIEW_OPTIONS",
+            {"max_seconds": 5, "frame_step": 2, "max_height": 360},
+        )
 
-        while True:
-            pending_jobs = OutputVideo.objects.filter(status="queued").order_by(
-                "created_at"
+        self.segment_frames = getattr(settings, "CHECKPOINT_SEGMENT_FRAMES", 250)
+        self.memory_budget_mb = getattr(settings, "WORKER_MEMORY_BUDGET_MB", None)
+        self.allow_downscale = getattr(settings, "MEMORY_BUDGET_DOWNSCALE", True)
+        self.max_shared_variants = getattr(settings, "SHARED_RENDER_MAX_VARIANTS", 4)
+        self.progress_seconds = getattr(settings, "WORKER_PROGRESS_SECONDS", 2)
+        face_index_dir = getattr(settings, "FACE_INDEX_DIR", None)
+        self.face_index_dir = str(face_index_dir) if face_index_dir else None
+        self.face_index_max_mb = getattr(settings, "FACE_INDEX_MAX_MB", None)
+        self.matting_tier = getattr(settings, "MATTING_TIER", "quality")
+        self.matting_auto_options = getattr(settings, "MATTING_AUTO_OPTIONS", None)
+        self.matting_benchmark = load_matting_benchmark(
+            getattr(settings, "MATTING_BENCHMARK_FILE", None)
+        )
+
+    def report_state(self, state, **fields):
+        set_worker_state(self.worker_id, state, **fields)
+
+    def build_engine(self):
+        return FaceSwapBackgroundEngine(
+            swapper_model_path=str(self.model_path),
+            providers=("CUDAExecutionProvider",),
+            session_options=self.session_options,
+            precision=self.precision,
+            quantized_model_dir=self.quantized_model_dir,
+            static_frame_threshold=self.static_frame_threshold,
+            memory_budget_mb=self.memory_budget_mb,
+            allow_downscale=self.allow_downscale,
+            face_index_dir=self.face_index_dir,
+            face_index_max_mb=self.face_index_max_mb,
+            matting_tier=self.matting_tier,
+            matting_benchmark=self.matting_benchmark,
+            matting_auto_options=self.matting_auto_options,
+        )
+
+    def start_engine(self, warmup):
+        """
+        Load the models once for every job this worker runs and, unless disabled, warm
+        them up so the first job doesn't pay for ONNX Runtime's lazy allocations. The
+        worker reports ready (WorkerStatus, WORKER_READY_FILE) only after this.
+        """
+        start = time.perf_counter()
+        self.engine = self.build_engine()
+        load_seconds = time.perf_counter() - start
+
+        self.warmup_seconds = None
+        if warmup.get("enabled", True):
+            self.warmup_seconds = self.engine.warm_up(
+                frame_size=tuple(warmup.get("frame_size", (1280, 720))),
+                runs=warmup.get("runs", 2),
+                matting=warmup.get("matting", True),
             )
+        self.report_state(
+            "ready",
+            load_seconds=load_seconds,
+            warmup_seconds=self.warmup_seconds,
+            ready_at=timezone.now(),
+        )
+        self.stdout.write(
+            f"Models loaded in {load_seconds:.1f}s, warm-up took {self.warmup_seconds or 0:.1f}s"
+        )
+
+    def work(self):
+        self.last_gc = float("-inf")
+        while True:
+            # connections persist (CONN_MAX_AGE) and there is no request cycle to recycle
+            # them in a worker, drop the ones past their age or broken before each poll
+            close_old_connections()
+            # jobs of workers that died (no heartbeat) go back to the queue or fail
+            requeued, failed = reap_expired_jobs()
+            if requeued or failed:
+                self.stdout.write(
+                    f"Reaped expired leases: {requeued} requeued, {failed} failed"
+                )
+            reap_stale_workers()
 
-            if not pending_jobs.exists():
+            # shortest estimated job first with aging, priority and per client quotas
+            job = pick_next_job(self.worker_id)
+            if job is None:
+                self.collect_garbage()
                 time.sleep(3)
                 continue
 
-            for job in pending_jobs:
-                try:
-                    job.status = "processing"
-                    job.progress = 0
-                    job.save(update_fields=["status", "progress"])
+            # other jobs rendering the same input ride along on this job's decode
+            jobs = claim_shared_jobs(job, self.worker_id, self.max_shared_variants)
+            self.report_state("busy")
+            try:
+                self.run_jobs(jobs)
+            finally:
+                self.report_state("ready")
 
-                    video_data = job.video_data
+    def collect_garbage(self):
+        """
+        Storage lifecycle pass (api/storage.py) when idle, every gc_interval_seconds.
+        """
+        options = storage_options()
+        if time.monotonic() - self.last_gc < options["gc_interval_seconds"]:
+            return
+        self.last_gc = time.monotonic()
+        try:
+            results = collect_garbage(options)
+        except Exception:
+            traceback.print_exc()
+            return
+        reclaimed = sum(result["mb"] for result in results.values())
+        if reclaimed:
+            self.stdout.write(f"Reclaimed {reclaimed:.1f} MB: {results}")
 
-                    if video_data.video_url and not video_data.video_file:
-                        try:
-                            downloaded_path = download_youtube(
-                                video_data.video_url,
-                                output_path=os.path.join(
-                                    settings.MEDIA_ROOT, "downloads"
-                                ),
-                            )
-                            if downloaded_path and os.path.exists(downloaded_path):
-                                with open(downloaded_path, "rb") as f:
-                                    video_data.video_file.save(
-                                        os.path.basename(downloaded_path),
-                                        File(f),
-                                        save=True,
-                                    )
-                        except Exception as e:
-                            job.status = "failed"
-                            job.progress = 0
-                            job.save(update_fields=["status", "progress"])
-                            self.stderr.write(f"Download failed for job {job.id}: {e}")
-                            continue
-
-                    if not video_data.video_file or not os.path.exists(
-                        video_data.video_file.path
-                    ):
-                        job.status = "failed"
-                        job.save(update_fields=["status"])
-                        self.stderr.write(f"Missing input video for job {job.id}")
-                        continue
+    def fail_job(self, job, message):
+        job.status = "failed"
+        job.progress = 0
+        job.save(update_fields=["status", "progress"])
+        self.stderr.write(message)
 
-                    face_paths = [
-                        face.image_file.path for face in video_data.face_images.all()
-                    ]
-                    if not face_paths:
-                        job.status = "failed"
-                        job.save(update_fields=["status"])
-                        self.stderr.write(f"No face images for job {job.id}")
-                        continue
+    def prepare_input(self, jobs, timer):
+        """
+        Local path of the input video the jobs share, downloading it for the first job if
+        needed. Returns None (and fails the jobs) when there is no usable input.
+        """
+        job = jobs[0]
+        video_data = job.video_data
 
-                    #baackground is optional
-                    background_path = None
-                    if video_data.background_image:
-                        try:
-                            bg_path = video_data.background_image.path
-                            if os.path.exists(bg_path):
-                                background_path = bg_path
-                            else:
-                                self.stderr.write(
-                                    f"Background file missing for job {job.id}; continuing without background"
-                                )
-                        except Exception:
-                            self.stderr.write(
-                                f"Unable to access background for job {job.id}; continuing without background"
+        if video_data.video_url and not video_data.video_file and job.batch_id:
+            # variants of a batch share the input, reuse a sibling's download
+            sibling = (
+                VideoData.objects.filter(
+                    output_videos__batch_id=job.batch_id,
+                    video_url=video_data.video_url,
+                )
+                .exclude(video_file="")
+                .exclude(video_file__isnull=True)
+                .first()
+            )
+            if sibling is not None and os.path.exists(sibling.video_file.path):
+                video_data.video_file.name = sibling.video_file.name
+                video_data.save(update_fields=["video_file"])
+                job.estimated_cost = estimate_job_cost(video_data, job.job_type)
+                job.save(update_fields=["estimated_cost"])
+
+        if video_data.video_url and not video_data.video_file:
+            try:
+                with timer.stage("download"):
+                    downloaded_path = download_youtube(
+                        video_data.video_url,
+                        output_path=os.path.join(
+                            settings.MEDIA_ROOT, "downloads"
+                        ),
+                    )
+                    if downloaded_path and os.path.exists(downloaded_path):
+                        with open(downloaded_path, "rb") as f:
+                            video_data.video_file.save(
+                                os.path.basename(downloaded_path),
+                                File(f),
+                                save=True,
                             )
+                        # videos/ has its own copy now
+                        remove_files([downloaded_path])
+                        # the estimate was a placeholder until the file was here
+                        job.estimated_cost = estimate_job_cost(video_data, job.job_type)
+                        job.save(update_fields=["estimated_cost"])
+            except Exception as e:
+                for failed in jobs:
+                    self.fail_job(failed, f"Download failed for job {failed.id}: {e}")
+                return None
+
+        if not video_data.video_file or not os.path.exists(
+            video_data.video_file.path
+        ):
+            for failed in jobs:
+                self.fail_job(failed, f"Missing input video for job {failed.id}")
+            return None
+
+        # jobs grouped by url render the first job's download
+        for other in jobs[1:]:
+            if not other.video_data.video_file:
+                other.video_data.video_file.name = video_data.video_file.name
+                other.video_data.save(update_fields=["video_file"])
+                other.estimated_cost = job.estimated_cost
+                other.save(update_fields=["estimated_cost"])
 
-                    processing_root = os.path.join(settings.MEDIA_ROOT, "processing")
-                    os.makedirs(processing_root, exist_ok=True)
+        return video_data.video_file.path
 
-                    output_name = f"processed_{video_data.id}_{int(time.time())}.mp4"
-                    temp_video_path = os.path.join(
-                        processing_root, f"temp_noaudio_{job.id}.mp4"
+    def prepare_variant(self, engine, job, name, processing_root):
+        """
+        RenderVariant of one job (its faces, optional background and output files), or
+        None when the job can't be rendered, which fails it.
+        """
+        video_data = job.video_data
+        face_paths = [
+            face.image_file.path for face in video_data.face_images.all()
+        ]
+        if not face_paths:
+            self.fail_job(job, f"No face images for job {job.id}")
+            return None
+
+        #baackground is optional
+        background_path = None
+        if video_data.background_image:
+            try:
+                bg_path = video_data.background_image.path
+                if os.path.exists(bg_path):
+                    background_path = bg_path
+                else:
+                    self.stderr.write(
+                        f"Background file missing for job {job.id}; continuing without background"
                     )
-                    final_video_path = os.path.join(processing_root, output_name)
+            except Exception:
+                self.stderr.write(
+                    f"Unable to access background for job {job.id}; continuing without background"
+                )
+
+        is_preview = job.job_type == "preview"
+        prefix = "preview" if is_preview else "processed"
+        output_name = f"{prefix}_{video_data.id}_{job.id}_{int(time.time())}.mp4"
+        renditions = [
+            {
+                **spec,
+                "path": os.path.join(
+                    processing_root,
+                    f"processed_{video_data.id}_{job.id}_{spec['name']}.mp4",
+                ),
+            }
+            for spec in ([] if is_preview else self.rendition_specs)
+        ]
+
+        try:
+            return engine.load_variant(
+                name,
+                face_paths,
+                os.path.join(processing_root, output_name),
+                background_path=background_path,
+                renditions=renditions,
+            )
+        except RuntimeError as e:
+            self.fail_job(job, f"Unable to prepare job {job.id}: {e}")
+            return None
+
+    def run_jobs(self, jobs):
+        """
+        Render jobs that share their input video (one job, or several claimed together):
+        decoding, face detection and matting run once and feed every job's swap, blend
+        and encoders. Each job keeps its own lease, status, outputs and metrics; the
+        render's stages are recorded on the first job only (GroupTimers), the others get
+        their own uploads.
+        """
+        timers = GroupTimers()
+        timer = timers.group
+        reset_peak_rss()
+        with ExitStack() as stack:
+            heartbeats = {
+                job.id: stack.enter_context(LeaseHeartbeat(job.id, self.worker_id))
+                for job in jobs
+            }
 
-                    engine = FaceSwapBackgroundEngine(
-                        swapper_model_path=str(model_path),
-                        bg_image_path=background_path,
-                        providers=("CUDAExecutionProvider",),
+            def owned(job):
+                # a reaped job may be running elsewhere already, stop touching it
+                return not heartbeats[job.id].lost.is_set()
+
+            def check_lease():
+                if not any(owned(job) for job in rendering):
+                    raise RenderCancelled(
+                        f"Leases on jobs {[job.id for job in rendering]} lost"
                     )
 
-                    engine.load_source_faces(face_paths)
+            rendering = []
+            variants = {}
+            try:
+                input_path = self.prepare_input(jobs, timer)
+                if input_path is None:
+                    return
+
+                processing_root = os.path.join(settings.MEDIA_ROOT, "processing")
+                os.makedirs(processing_root, exist_ok=True)
+
+                # the engine's models are loaded at start, this is the source faces (and a
+                # matting model the first time a job needs one that isn't loaded yet)
+                engine = self.engine
+                with timer.stage("model_load"):
+                    for job in jobs:
+                        name = None if len(jobs) == 1 else f"job{job.id}"
+                        variant = self.prepare_variant(engine, job, name, processing_root)
+                        if variant is not None:
+                            # segments committed here survive a crash and are picked up by
+                            # the job's next attempt, alone or grouped with other jobs
+                            variant.checkpoint_dir = checkpoint_path(job.id)
+                            variants[job.id] = variant
+                            rendering.append(job)
+                if not rendering:
+                    return
+
+                render_options = (
+                    dict(self.preview_options) if rendering[0].job_type == "preview" else {}
+                )
 
-                    def update_progress(percent, frame_index, total_frames):
-                        job.progress = max(0, min(100, percent))
-                        job.save(update_fields=["progress"])
+                progress = ProgressWriter(self.progress_seconds)
 
-                    engine.process_video(
-                        input_video=video_data.video_file.path,
-                        output_video=final_video_path,
-                        temp_video=temp_video_path,
+                def update_progress(percent, frame_index, total_frames):
+                    check_lease()
+                    progress.update([job.id for job in rendering if owned(job)], percent)
+
+                jobs_by_variant = {id(variants[job.id]): job for job in rendering}
+
+                def save_manifest(variant, manifest):
+                    check_lease()
+                    job = jobs_by_variant[id(variant)]
+                    if owned(job):
+                        OutputVideo.objects.filter(pk=job.id).update(render_manifest=manifest)
+
+                if len(rendering) > 1:
+                    self.stdout.write(
+                        f"Rendering jobs {[job.id for job in rendering]} from one decode"
+                    )
+                try:
+                    engine.process_variants(
+                        input_path,
+                        [variants[job.id] for job in rendering],
                         progress_callback=update_progress,
+                        timer=timer,
+                        checkpoint_dir=processing_root,
+                        segment_frames=self.segment_frames,
+                        segment_callback=save_manifest,
+                        **render_options,
                     )
+                finally:
+                    # the last percentage the interval held back, written before the jobs
+                    # are completed, failed or left to their new owner
+                    progress.flush([job.id for job in rendering if owned(job)])
 
-                    if os.path.exists(final_video_path):
-                        with open(final_video_path, "rb") as f:
-                            job.final_video.save(output_name, File(f), save=True)
-
-                        job_uuid = str(uuid.uuid4())
-                        cloudflare_object_name = f"{job_uuid}/{job_uuid}.mp4"
-                        cloudflare_url = upload_file(
-                            final_video_path,
-                            os.getenv("CLOUDFLARE_BUCKET_NAME"),
-                            cloudflare_object_name
-                        )
-                        job.final_video_url = cloudflare_url
-                        job.save(update_fields=["final_video_url"])
-
-                    job.status = "completed"
-                    job.progress = 100
-                    job.save(update_fields=["status", "progress"])
-                    self.stdout.write(f"Completed job {job.id}")
-
-                except Exception:
+                for job in rendering:
+                    if not owned(job):
+                        self.stderr.write(f"Lease on job {job.id} lost, leaving it to its new owner")
+                        continue
                     try:
+                        self.finish_job(job, variants[job.id], timers.job(job.id))
+                    except Exception:
                         job.status = "failed"
                         job.save(update_fields=["status"])
+                        traceback.print_exc()
+                    shutil.rmtree(variants[job.id].checkpoint_dir, ignore_errors=True)
+
+            except RenderCancelled as e:
+                self.stderr.write(f"{e}, leaving the jobs to their new owners")
+
+            except MemoryBudgetExceeded as e:
+                for job in rendering:
+                    if owned(job):
+                        self.fail_job(job, f"Refused job {job.id}: {e}")
+
+            except Exception:
+                for job in rendering:
+                    if owned(job):
+                        try:
+                            job.status = "failed"
+                            job.save(update_fields=["status"])
+                        except Exception:
+                            pass
+                traceback.print_exc()
+
+            finally:
+                # outputs were copied into their FileFields, the checkpoint (if the render
+                # didn't finish) is what a retry resumes from
+                for variant in variants.values():
+                    remove_files(
+                        [variant.output_video, variant.temp_video]
+                        + [rendition["path"] for rendition in variant.renditions]
+                    )
+                for job in jobs:
+                    try:
+                        release_lease(job.id, self.worker_id)
+                        record_job_metrics(job, timers.report(job.id))
                     except Exception:
-                        pass
-                    traceback.print_exc()
+                        traceback.print_exc()
 
-            time.sleep(1)
\ No newline at end of file
+    def finish_job(self, job, variant, timer):
+        job_uuid = str(uuid.uuid4())
+        final_video_path = variant.output_video
+        if os.path.exists(final_video_path):
+            with timer.stage("upload"):
+                with open(final_video_path, "rb") as f:
+                    job.final_video.save(os.path.basename(final_video_path), File(f), save=True)
+
+                cloudflare_object_name = f"{job_uuid}/{job_uuid}.mp4"
+                cloudflare_url = upload_file(
+                    final_video_path,
+                    os.getenv("CLOUDFLARE_BUCKET_NAME"),
+                    cloudflare_object_name
+                )
+            job.final_video_url = cloudflare_url
+            job.save(update_fields=["final_video_url"])
+
+        with timer.stage("upload"):
+            self.store_renditions(job, variant.renditions, job_uuid)
+
+        job.status = "completed"
+        job.progress = 100
+        job.save(update_fields=["status", "progress"])
+        self.stdout.write(f"Completed job {job.id}")
+
+    def store_renditions(self, job, renditions, job_uuid):
+        for rendition in renditions:
+            if not os.path.exists(rendition["path"]):
+                self.stderr.write(
+                    f"Rendition {rendition['name']} missing for job {job.id}"
+                )
+                continue
+
+            width, height = rendition.get("size", (None, None))
+            record = VideoRendition(
+                output_video=job,
+                name=rendition["name"],
+                width=width,
+                height=height,
+                bitrate=rendition.get("bitrate"),
+            )
+            with open(rendition["path"], "rb") as f:
+                record.video_file.save(
+                    os.path.basename(rendition["path"]), File(f), save=False
+                )
+            record.video_url = upload_file(
+                rendition["path"],
+                os.getenv("CLOUDFLARE_BUCKET_NAME"),
+                f"{job_uuid}/{job_uuid}_{rendition['name']}.mp4",
+            )
+            record.save()
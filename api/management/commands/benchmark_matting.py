@@ -0,0 +1,120 @@
+import json
+import os
+import time
+import platform
+import tempfile
+import itertools
+import numpy as np
+from PIL import Image
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from helpers.benchmark import StubMattingSession, build_stub_conv_model, run_spawned
+from helpers.matting import MATTING_TIERS
+from helpers.onnx_session import load_rembg_session, resolve_session_config
+from .benchmark_pipeline import current_commit, parse_resolution
+
+
+def run_matting_case(case, options):
+    """
+    Times the matting model of one tier on synthetic frames of one resolution, the same
+    predict() call and mask conversion the engine's matte() runs.
+    """
+    providers = ("CPUExecutionProvider",)
+    tier = MATTING_TIERS[case["tier"]]
+    if options["models"] == "real":
+        session = load_rembg_session(
+            tier["model"], providers, resolve_session_config(options.get("session_options"))
+        )
+    else:
+        stub_dir = os.path.join(options["workdir"], "stub_models")
+        os.makedirs(stub_dir, exist_ok=True)
+        size = tier["input_size"]
+        session = StubMattingSession(
+            build_stub_conv_model(os.path.join(stub_dir, f"matte_stub_{size}.onnx"), size, seed=2),
+            providers,
+            input_size=size,
+        )
+
+    rng = np.random.default_rng(0)
+    frames = [
+        rng.integers(0, 256, (case["height"], case["width"], 3), dtype=np.uint8)
+        for _ in range(min(case["frames"], 4))
+    ]
+
+    def matte(frame):
+        return np.asarray(session.predict(Image.fromarray(frame))[0])
+
+    matte(frames[0])
+    start = time.perf_counter()
+    for index in range(case["frames"]):
+        matte(frames[index % len(frames)])
+    elapsed = time.perf_counter() - start
+    return {
+        **case,
+        "model": tier["model"],
+        "models": options["models"],
+        "fps": round(case["frames"] / elapsed, 2),
+        "ms_per_frame": round(elapsed / case["frames"] * 1000, 1),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "CPU fps of every matting tier at a few resolutions, the numbers MATTING_TIER "
+        "auto picks tiers from"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tiers", nargs="+", default=list(MATTING_TIERS))
+        parser.add_argument(
+            "--resolutions", nargs="+", default=["640x360", "1280x720", "1920x1080"]
+        )
+        parser.add_argument("--frames", type=int, default=20)
+        parser.add_argument(
+            "--models",
+            choices=["real", "stub"],
+            default="real",
+            help="real downloads the rembg models, stub only checks the plumbing",
+        )
+        parser.add_argument("--workdir", default=None)
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="write the json report here, MATTING_BENCHMARK_FILE is where auto reads it",
+        )
+
+    def handle(self, *args, **options):
+        workdir = options["workdir"] or tempfile.mkdtemp(prefix="matting_bench_")
+        run_options = {
+            "models": options["models"],
+            "workdir": workdir,
+            "session_options": getattr(settings, "ONNX_SESSION_OPTIONS", None),
+        }
+
+        results = []
+        for tier, resolution in itertools.product(options["tiers"], options["resolutions"]):
+            width, height = parse_resolution(resolution)
+            case = {"tier": tier, "width": width, "height": height, "frames": options["frames"]}
+            # one process per case so models of earlier cases don't share its memory
+            result = run_spawned(run_matting_case, case, run_options)
+            results.append(result)
+            self.stderr.write(
+                f"{tier} ({result['model']}) {width}x{height}: {result['fps']} fps, "
+                f"peak {result['peak_rss_mb']} MB"
+            )
+
+        report = {
+            "commit": current_commit(),
+            "machine": {
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+            },
+            "models": options["models"],
+            "results": results,
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
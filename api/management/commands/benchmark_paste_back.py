@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import tempfile
+import numpy as np
+from insightface.app.common import Face
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from helpers.benchmark import build_stub_swapper_model, stub_kps
+from helpers.onnx_session import load_insightface_model, resolve_session_config
+from helpers.roi_paste import swap_face_roi
+from .benchmark_pipeline import parse_resolution
+
+
+def run_paste_back_case(face_swapper, width, height, face_count, repeats=5, seed=0):
+    """
+    Times full-frame paste back (INSwapper.get) against the ROI paste back on one random
+    frame with face_count faces, and reports the max pixel difference between the two.
+    """
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    source_face = Face(embedding=rng.standard_normal(512).astype(np.float32))
+
+    face_h = max(32, height // 5)
+    face_w = int(face_h * 0.8)
+    faces = []
+    for face_index in range(face_count):
+        cx = width * (face_index + 0.5) / face_count
+        cy = height * 0.4
+        bbox = np.array(
+            [cx - face_w / 2, cy - face_h / 2, cx + face_w / 2, cy + face_h / 2],
+            dtype=np.float32,
+        )
+        faces.append(Face(bbox=bbox, kps=stub_kps(bbox)))
+
+    def full_frame():
+        output = frame.copy()
+        for face in faces:
+            output = face_swapper.get(output, face, source_face, paste_back=True)
+        return output
+
+    def roi():
+        output = frame.copy()
+        for face in faces:
+            output = swap_face_roi(face_swapper, output, face, source_face)
+        return output
+
+    result = {"width": width, "height": height, "faces": face_count}
+    outputs = {}
+    for name, fn in (("full_frame", full_frame), ("roi", roi)):
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            outputs[name] = fn()
+            timings.append(time.perf_counter() - start)
+        result[f"{name}_ms"] = round(float(np.median(timings)) * 1000, 2)
+
+    result["speedup"] = round(result["full_frame_ms"] / max(result["roi_ms"], 1e-6), 2)
+    result["max_pixel_diff"] = int(
+        np.abs(outputs["full_frame"].astype(np.int16) - outputs["roi"]).max()
+    )
+    return result
+
+
+class Command(BaseCommand):
+    help = "compare full-frame and ROI paste back of swapped faces across resolutions"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--resolutions",
+            nargs="+",
+            default=["1280x720", "1920x1080", "1080x1920", "3840x2160"],
+        )
+        parser.add_argument("--faces", nargs="+", type=int, default=[1, 2, 4])
+        parser.add_argument("--repeats", type=int, default=5)
+        parser.add_argument(
+            "--stub", action="store_true", help="use a stub swapper even if the real one exists"
+        )
+        parser.add_argument("--output", default=None, help="write the json report here")
+
+    def handle(self, *args, **options):
+        providers = ["CPUExecutionProvider"]
+        model_path = str(settings.SWAPPER_MODEL_PATH)
+        if options["stub"] or not os.path.exists(model_path):
+            model_path = build_stub_swapper_model(
+                os.path.join(tempfile.mkdtemp(prefix="paste_bench_"), "inswapper_stub.onnx")
+            )
+        face_swapper = load_insightface_model(
+            model_path, providers, resolve_session_config(None)
+        )
+
+        results = []
+        for resolution in options["resolutions"]:
+            width, height = parse_resolution(resolution)
+            for faces in options["faces"]:
+                result = run_paste_back_case(
+                    face_swapper, width, height, faces, repeats=options["repeats"]
+                )
+                results.append(result)
+                self.stderr.write(
+                    f"{resolution} x{faces}: {result['full_frame_ms']} ms -> "
+                    f"{result['roi_ms']} ms ({result['speedup']}x)"
+                )
+
+        output = json.dumps({"swapper": model_path, "cases": results}, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
@@ -0,0 +1,202 @@
+import json
+import os
+import time
+import logging
+import platform
+import subprocess
+import tempfile
+import itertools
+import cv2
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from helpers.benchmark import (
+    FRAME_STAGES,
+    build_engine,
+    make_background_image,
+    make_stub_face_image,
+    make_synthetic_video,
+    real_models_available,
+    run_spawned,
+)
+from helpers.profiling import StageTimer
+
+log = logging.getLogger("Benchmark")
+
+
+def parse_resolution(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_case(case, options):
+    """
+    Renders one synthetic clip and returns its per stage timings and fps.
+    """
+    workdir = os.path.join(options["workdir"], case["name"])
+    os.makedirs(workdir, exist_ok=True)
+
+    face_image = None
+    if options["models"] == "real":
+        face_image_path = options["face_image"]
+        face_image = cv2.imread(face_image_path)
+    else:
+        face_image_path = make_stub_face_image(os.path.join(workdir, "face.png"))
+
+    input_path = make_synthetic_video(
+        os.path.join(workdir, "input.mp4"),
+        case["width"],
+        case["height"],
+        case["seconds"],
+        fps=case["fps"],
+        face_count=case["faces"],
+        face_image=face_image,
+    )
+    background_path = (
+        make_background_image(os.path.join(workdir, "background.png"))
+        if case["background"]
+        else None
+    )
+
+    load_start = time.perf_counter()
+    engine = build_engine(options, workdir, background_path)
+    engine.load_source_faces([face_image_path])
+    load_s = time.perf_counter() - load_start
+
+    timer = StageTimer()
+    audio_merged = True
+    start = time.perf_counter()
+    try:
+        engine.process_video(
+            input_video=input_path,
+            output_video=os.path.join(workdir, "output.mp4"),
+            temp_video=os.path.join(workdir, "temp_noaudio.mp4"),
+            timer=timer,
+        )
+    except (FileNotFoundError, subprocess.CalledProcessError) as e:
+        # ffmpeg missing or failing only affects the audio merge at the very end
+        log.warning("Audio merge skipped: %s", e)
+        audio_merged = False
+    wall_s = time.perf_counter() - start
+
+    frames = timer.counters.get("frames", 0)
+    stages = timer.summary()
+    for name in FRAME_STAGES:
+        if name in stages and stages[name]["total_s"] > 0:
+            stages[name]["fps"] = round(frames / stages[name]["total_s"], 2)
+
+    return {
+        **case,
+        "models": options["models"],
+        "frames": frames,
+        "model_load_s": round(load_s, 3),
+        "wall_s": round(wall_s, 3),
+        "fps": round(frames / wall_s, 2) if wall_s > 0 else None,
+        "audio_merged": audio_merged,
+        "frame_paths": {
+            name[len("frames_"):]: count
+            for name, count in timer.counters.items()
+            if name.startswith("frames_")
+        },
+        "stages": stages,
+    }
+
+
+class Command(BaseCommand):
+    help = "offline per stage benchmark of the render pipeline on synthetic videos"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--resolutions", nargs="+", default=["640x360", "1280x720", "1920x1080"]
+        )
+        parser.add_argument("--seconds", nargs="+", type=float, default=[3])
+        parser.add_argument("--faces", nargs="+", type=int, default=[1, 3])
+        parser.add_argument(
+            "--background", choices=["on", "off", "both"], default="both"
+        )
+        parser.add_argument("--fps", type=int, default=25)
+        parser.add_argument(
+            "--models",
+            choices=["auto", "stub", "real"],
+            default="auto",
+            help="real needs the model weights and --face-image, auto falls back to stubs",
+        )
+        parser.add_argument("--face-image", default=None)
+        parser.add_argument("--workdir", default=None)
+        parser.add_argument("--output", default=None, help="write the json report here")
+
+    def handle(self, *args, **options):
+        models = options["models"]
+        if models == "auto":
+            has_weights = real_models_available(settings.SWAPPER_MODEL_PATH)
+            models = "real" if has_weights and options["face_image"] else "stub"
+        if models == "real" and not options["face_image"]:
+            raise CommandError("--face-image is needed to benchmark the real models")
+
+        backgrounds = {"on": [True], "off": [False], "both": [False, True]}[
+            options["background"]
+        ]
+        workdir = options["workdir"] or tempfile.mkdtemp(prefix="pipeline_bench_")
+
+        run_options = {
+            "models": models,
+            "workdir": workdir,
+            "face_image": options["face_image"],
+            "swapper_model_path": str(settings.SWAPPER_MODEL_PATH),
+            "session_options": getattr(settings, "ONNX_SESSION_OPTIONS", None),
+            "static_frame_threshold": getattr(settings, "STATIC_FRAME_THRESHOLD", None),
+        }
+
+        cases = []
+        for resolution, seconds, faces, background in itertools.product(
+            options["resolutions"], options["seconds"], options["faces"], backgrounds
+        ):
+            width, height = parse_resolution(resolution)
+            cases.append(
+                {
+                    "name": f"{width}x{height}_{seconds:g}s_{faces}f_{'bg' if background else 'nobg'}",
+                    "width": width,
+                    "height": height,
+                    "seconds": seconds,
+                    "fps": options["fps"],
+                    "faces": faces,
+                    "background": background,
+                }
+            )
+
+        # every case gets its own process so peak RSS is not shared between cases
+        results = []
+        for case in cases:
+            result = run_spawned(run_case, case, run_options)
+            results.append(result)
+            self.stderr.write(
+                f"{case['name']}: {result['fps']} fps, peak {result['peak_rss_mb']} MB"
+            )
+
+        report = {
+            "commit": current_commit(),
+            "machine": {
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+            },
+            "models": models,
+            "cases": results,
+        }
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
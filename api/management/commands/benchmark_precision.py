@@ -0,0 +1,108 @@
+import json
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from helpers.composite import FaceSwapBackgroundEngine
+from helpers.onnx_session import PRECISION_TIERS, precision_variant_path
+from helpers.quantization import (
+    cosine_similarity,
+    latency_summary,
+    psnr,
+    record_engine_sessions,
+    sample_frames,
+    swap_frame,
+)
+from .quantize_models import default_clips
+
+
+class Command(BaseCommand):
+    help = "compare latency and output similarity of precision tiers against fp32"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--faces", nargs="+", required=True, help="source face images")
+        parser.add_argument("--clips", nargs="*", default=None)
+        parser.add_argument(
+            "--tiers", nargs="+", default=list(PRECISION_TIERS), choices=PRECISION_TIERS
+        )
+        parser.add_argument("--every-n", type=int, default=10)
+        parser.add_argument("--max-frames", type=int, default=30, help="per clip")
+        parser.add_argument("--output", default=None, help="write the json report here")
+
+    def build_engine(self, precision):
+        engine = FaceSwapBackgroundEngine(
+            swapper_model_path=str(settings.SWAPPER_MODEL_PATH),
+            providers=("CPUExecutionProvider",),
+            session_options=getattr(settings, "ONNX_SESSION_OPTIONS", None),
+            precision=precision,
+            quantized_model_dir=getattr(settings, "QUANTIZED_MODEL_DIR", None),
+        )
+        engine.load_source_faces(self.faces)
+        return engine
+
+    def handle(self, *args, **options):
+        clips = options["clips"] or default_clips()
+        if not clips:
+            raise CommandError("No benchmark clips found")
+        self.faces = options["faces"]
+
+        frames = list(
+            sample_frames(
+                clips, every_n=options["every_n"], max_frames=options["max_frames"]
+            )
+        )
+
+        reference = self.build_engine("fp32")
+        reference_outputs = [swap_frame(reference, frame)[0] for _, _, frame in frames]
+        source_embeddings = [face.normed_embedding for face in reference.source_faces]
+
+        report = {"clips": clips, "frames": len(frames), "tiers": {}}
+
+        for tier in options["tiers"]:
+            variant = precision_variant_path(
+                settings.SWAPPER_MODEL_PATH,
+                tier,
+                getattr(settings, "QUANTIZED_MODEL_DIR", None),
+            )
+            if tier != "fp32" and variant == str(settings.SWAPPER_MODEL_PATH):
+                report["tiers"][tier] = {"available": False}
+                continue
+
+            engine = self.build_engine(tier)
+            recorders = record_engine_sessions(engine)
+
+            identity = []
+            visual = []
+            for (_, _, frame), reference_output in zip(frames, reference_outputs):
+                output, _ = swap_frame(engine, frame)
+                visual.append(psnr(reference_output, output))
+
+                # identity is judged by the fp32 recognizer so tiers are comparable
+                for face in reference.face_app.get(output):
+                    identity.append(
+                        max(
+                            cosine_similarity(face.normed_embedding, source)
+                            for source in source_embeddings
+                        )
+                    )
+
+            finite_psnr = [value for value in visual if np.isfinite(value)]
+            report["tiers"][tier] = {
+                "available": True,
+                "latency": {
+                    name: latency_summary(recorder.timings)
+                    for name, recorder in recorders.items()
+                },
+                "identity_similarity": (
+                    round(float(np.mean(identity)), 4) if identity else None
+                ),
+                "psnr_vs_fp32": (
+                    round(float(np.mean(finite_psnr)), 2) if finite_psnr else None
+                ),
+            }
+            self.stderr.write(f"Finished tier {tier}")
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
@@ -0,0 +1,196 @@
+import json
+import time
+import queue
+import multiprocessing
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from helpers.frame_transport import SharedFrameRing
+
+# rows at the bottom of the frame the inference stage rewrites in place, the stand in for
+# a swap or blend touching part of the frame
+INFERENCE_ROWS = 16
+
+
+def stamp(frame, index):
+    frame.reshape(-1)[:8].view(np.int64)[0] = index
+
+
+def read_stamp(frame):
+    return int(frame.reshape(-1)[:8].view(np.int64)[0])
+
+
+def decode_stage(ring, outbox, shape, frames, barrier):
+    """
+    Fills frames with a decoded-like image and its index: in place into a free ring slot,
+    or into a new array per frame (what capture.read returns) that the queue pickles.
+    """
+    source = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+    barrier.wait()
+    for index in range(frames):
+        if ring is None:
+            frame = source.copy()
+            stamp(frame, index)
+            outbox.put((frame, index))
+        else:
+            slot = ring.acquire()
+            frame = ring.frame(slot)
+            np.copyto(frame, source)
+            stamp(frame, index)
+            outbox.put((slot, index))
+    outbox.put(None)
+
+
+def inference_stage(ring, inbox, outbox, barrier):
+    barrier.wait()
+    while True:
+        item = inbox.get()
+        if item is None:
+            outbox.put(None)
+            return
+        handle, index = item
+        frame = handle if ring is None else ring.frame(handle)
+        band = frame[-INFERENCE_ROWS:]
+        np.bitwise_not(band, out=band)
+        outbox.put(item)
+
+
+def encode_stage(ring, inbox, results, barrier):
+    """
+    Consumes frames in order, checking each carries the index it should (a slot reused
+    before it was released would show up here), and reports its frames per second.
+    """
+    barrier.wait()
+    start = time.perf_counter()
+    received, mismatched, checksum = 0, 0, 0
+    while True:
+        item = inbox.get()
+        if item is None:
+            break
+        handle, index = item
+        frame = handle if ring is None else ring.frame(handle)
+        if index != received or read_stamp(frame) != index:
+            mismatched += 1
+        checksum += int(frame[-1, -1, 0])
+        received += 1
+        if ring is not None:
+            ring.release(handle)
+    results.put(
+        {
+            "frames": received,
+            "mismatched": mismatched,
+            "seconds": time.perf_counter() - start,
+            "checksum": checksum,
+        }
+    )
+
+
+def run_transport_case(transport, width, height, frames, slots, timeout=600):
+    """
+    decoder -> inference -> encoder as three spawned processes, frames handed over through
+    a SharedFrameRing ("shared") or pickled through multiprocessing queues ("queue"), both
+    bounded to `slots` frames in flight between two stages.
+    """
+    context = multiprocessing.get_context("spawn")
+    shape = (height, width, 3)
+    ring = SharedFrameRing(shape, slots, context=context) if transport == "shared" else None
+    decoded, inferred = context.Queue(slots), context.Queue(slots)
+    results = context.Queue()
+    barrier = context.Barrier(3)
+    processes = [
+        context.Process(target=decode_stage, args=(ring, decoded, shape, frames, barrier)),
+        context.Process(target=inference_stage, args=(ring, decoded, inferred, barrier)),
+        context.Process(target=encode_stage, args=(ring, inferred, results, barrier)),
+    ]
+    try:
+        for process in processes:
+            process.start()
+        try:
+            result = results.get(timeout=timeout)
+        except queue.Empty:
+            raise RuntimeError(f"{transport} {width}x{height} didn't finish in {timeout} s")
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        if ring is not None:
+            ring.close()
+
+    frame_mb = width * height * 3 / (1024 * 1024)
+    fps = result["frames"] / result["seconds"]
+    return {
+        "transport": transport,
+        "resolution": f"{width}x{height}",
+        "frames": result["frames"],
+        "mismatched": result["mismatched"],
+        "fps": round(fps, 1),
+        "mb_per_s": round(fps * frame_mb, 1),
+        "frame_ms": round(1000 / fps, 3),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "frames per second through a decoder -> inference -> encoder chain of processes, "
+        "frames pickled through multiprocessing queues vs handed over by slot index in a "
+        "shared memory ring (helpers/frame_transport.py)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--resolutions", nargs="+", default=["1280x720", "1920x1080", "3840x2160"]
+        )
+        parser.add_argument("--frames", type=int, default=500)
+        parser.add_argument(
+            "--slots", type=int, default=8, help="frames in flight between two stages"
+        )
+        parser.add_argument("--transports", nargs="+", default=["queue", "shared"])
+        parser.add_argument("--output", default=None, help="write the json report here")
+
+    def handle(self, *args, **options):
+        from .benchmark_pipeline import current_commit, parse_resolution
+
+        unknown = set(options["transports"]) - {"queue", "shared"}
+        if unknown:
+            raise CommandError(f"Unknown transports: {sorted(unknown)}")
+
+        cases = []
+        for resolution in options["resolutions"]:
+            width, height = parse_resolution(resolution)
+            by_transport = {}
+            for transport in options["transports"]:
+                result = run_transport_case(
+                    transport, width, height, options["frames"], options["slots"]
+                )
+                if result["mismatched"]:
+                    raise CommandError(
+                        f"{transport} {resolution}: {result['mismatched']} frames arrived "
+                        "out of order or overwritten"
+                    )
+                by_transport[transport] = result
+                cases.append(result)
+                self.stderr.write(
+                    f"{resolution} {transport:<6} {result['fps']:>8} fps  "
+                    f"{result['mb_per_s']:>8} MB/s  {result['frame_ms']} ms/frame"
+                )
+            if {"queue", "shared"} <= set(by_transport):
+                speedup = round(by_transport["shared"]["fps"] / by_transport["queue"]["fps"], 2)
+                by_transport["shared"]["speedup"] = speedup
+                self.stderr.write(f"{resolution} shared memory {speedup}x the queue")
+
+        output = json.dumps(
+            {
+                "commit": current_commit(),
+                "frames": options["frames"],
+                "slots": options["slots"],
+                "cases": cases,
+            },
+            indent=2,
+        )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
@@ -0,0 +1,177 @@
+import json
+import os
+import time
+import tempfile
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from helpers.benchmark import (
+    build_engine,
+    compare_videos,
+    make_background_image,
+    make_stub_face_image,
+    make_synthetic_video,
+    real_models_available,
+    run_spawned,
+)
+from helpers.profiling import StageTimer
+from .benchmark_pipeline import current_commit, parse_resolution
+
+
+def run_variants_case(case, options):
+    """
+    Render case["variants"] face/background variants of one input either one after the
+    other with process_video ("separate", like one job per variant) or together with
+    process_variants ("shared"), using stub or real models. Returns wall time, output
+    frames per second summed over variants and the output paths.
+    """
+    workdir = os.path.join(options["workdir"], case["mode"])
+    os.makedirs(workdir, exist_ok=True)
+    background_path = case.get("background")
+
+    load_start = time.perf_counter()
+    engine = build_engine(options, workdir, background_path)
+    load_s = time.perf_counter() - load_start
+
+    outputs = [
+        os.path.join(workdir, f"variant_{index}.mp4") for index in range(case["variants"])
+    ]
+    timer = StageTimer()
+    start = time.perf_counter()
+    if case["mode"] == "shared":
+        variants = [
+            engine.load_variant(f"v{index}", [case["face_image"]], output, background_path)
+            for index, output in enumerate(outputs)
+        ]
+        engine.process_variants(case["input"], variants, timer=timer)
+    else:
+        engine.load_source_faces([case["face_image"]])
+        for output in outputs:
+            engine.process_video(
+                input_video=case["input"],
+                output_video=output,
+                temp_video=f"{output}.noaudio.mp4",
+                timer=timer,
+            )
+    wall_s = time.perf_counter() - start
+
+    frames = timer.counters.get("frames", 0)
+    if case["mode"] == "shared":
+        frames *= case["variants"]
+    return {
+        **case,
+        "models": options["models"],
+        "output_frames": frames,
+        "model_load_s": round(load_s, 3),
+        "wall_s": round(wall_s, 3),
+        "fps": round(frames / wall_s, 2) if wall_s > 0 else None,
+        "stages": timer.summary(),
+        "outputs": outputs,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "compare rendering N face variants of one video as N separate jobs against one "
+        "shared render (decode, detection and matting once)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--resolution", default="1280x720")
+        parser.add_argument("--seconds", type=float, default=4)
+        parser.add_argument("--fps", type=int, default=25)
+        parser.add_argument("--variants", nargs="+", type=int, default=[1, 2, 4])
+        parser.add_argument("--background", action="store_true")
+        parser.add_argument(
+            "--models",
+            choices=["auto", "stub", "real"],
+            default="auto",
+            help="real needs the model weights and --face-image, auto falls back to stubs",
+        )
+        parser.add_argument("--face-image", default=None)
+        parser.add_argument("--workdir", default=None)
+        parser.add_argument("--output", default=None, help="write the json report here")
+
+    def handle(self, *args, **options):
+        models = options["models"]
+        if models == "auto":
+            has_weights = real_models_available(settings.SWAPPER_MODEL_PATH)
+            models = "real" if has_weights and options["face_image"] else "stub"
+        if models == "real" and not options["face_image"]:
+            raise CommandError("--face-image is needed to benchmark the real models")
+
+        width, height = parse_resolution(options["resolution"])
+        workdir = options["workdir"] or tempfile.mkdtemp(prefix="variants_bench_")
+        os.makedirs(workdir, exist_ok=True)
+        input_path = make_synthetic_video(
+            os.path.join(workdir, "input.mp4"), width, height, options["seconds"], fps=options["fps"]
+        )
+        face_image = options["face_image"] or make_stub_face_image(
+            os.path.join(workdir, "face.png")
+        )
+        background = (
+            make_background_image(os.path.join(workdir, "background.png"))
+            if options["background"]
+            else None
+        )
+
+        run_options = {
+            "models": models,
+            "swapper_model_path": str(settings.SWAPPER_MODEL_PATH),
+            "session_options": getattr(settings, "ONNX_SESSION_OPTIONS", None),
+            "static_frame_threshold": getattr(settings, "STATIC_FRAME_THRESHOLD", None),
+        }
+
+        results = []
+        for count in options["variants"]:
+            runs = {}
+            for mode in ("separate", "shared"):
+                case = {
+                    "mode": mode,
+                    "variants": count,
+                    "input": input_path,
+                    "face_image": face_image,
+                    "background": background,
+                }
+                case_options = {
+                    **run_options,
+                    "workdir": os.path.join(workdir, f"{count}_variants"),
+                }
+                # one process per mode so peak RSS belongs to the mode
+                runs[mode] = run_spawned(run_variants_case, case, case_options)
+
+            # same faces in every variant, so shared and separate outputs must match
+            difference = max(
+                compare_videos(shared, separate)["max_diff"]
+                for shared, separate in zip(
+                    runs["shared"]["outputs"], runs["separate"]["outputs"]
+                )
+            )
+            speedup = runs["separate"]["wall_s"] / runs["shared"]["wall_s"]
+            results.append(
+                {
+                    "variants": count,
+                    "separate": runs["separate"],
+                    "shared": runs["shared"],
+                    "speedup": round(speedup, 2),
+                    "max_diff": difference,
+                }
+            )
+            self.stderr.write(
+                f"{count} variants: separate {runs['separate']['wall_s']}s, "
+                f"shared {runs['shared']['wall_s']}s ({speedup:.2f}x), "
+                f"peak {runs['separate']['peak_rss_mb']} / {runs['shared']['peak_rss_mb']} MB"
+            )
+
+        report = {
+            "commit": current_commit(),
+            "models": models,
+            "resolution": [width, height],
+            "seconds": options["seconds"],
+            "background": bool(background),
+            "results": results,
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
@@ -0,0 +1,167 @@
+import json
+import os
+import time
+import tempfile
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from helpers.benchmark import (
+    FRAME_STAGES,
+    build_engine,
+    make_background_image,
+    make_stub_face_image,
+    make_synthetic_video,
+    real_models_available,
+    run_spawned,
+)
+from helpers.profiling import StageTimer
+from .benchmark_pipeline import current_commit, parse_resolution
+
+
+def run_warmup_case(case, options):
+    """
+    First job latency of a fresh worker: load the models, warm them up when case["mode"]
+    is "warm", then render case["input"] twice like two jobs in a row. Returns the job
+    times and each frame stage's first call against its median, the gap warm-up closes.
+    """
+    workdir = os.path.join(options["workdir"], case["mode"])
+    os.makedirs(workdir, exist_ok=True)
+    background_path = case.get("background")
+
+    load_start = time.perf_counter()
+    engine = build_engine(options, workdir, background_path)
+    load_s = time.perf_counter() - load_start
+
+    warmup_s = None
+    if case["mode"] == "warm":
+        warmup = case.get("warmup", {})
+        warmup_s = engine.warm_up(
+            frame_size=tuple(warmup.get("frame_size", (1280, 720))),
+            runs=warmup.get("runs", 2),
+            # the jobs only matte with a background, like a worker without one
+            matting=background_path is not None,
+        )
+
+    jobs = []
+    first_calls = {}
+    for index in range(2):
+        output = os.path.join(workdir, f"job_{index}.mp4")
+        timer = StageTimer()
+        start = time.perf_counter()
+        variant = engine.load_variant(None, [case["face_image"]], output, background_path)
+        engine.process_variants(case["input"], [variant], timer=timer)
+        jobs.append(round(time.perf_counter() - start, 3))
+
+        if index == 0:
+            for name in FRAME_STAGES:
+                samples = timer.samples.get(name)
+                if samples:
+                    first_calls[name] = {
+                        "first_ms": round(samples[0] * 1000, 2),
+                        "median_ms": round(float(np.median(samples)) * 1000, 2),
+                    }
+
+    return {
+        **case,
+        "models": options["models"],
+        "model_load_s": round(load_s, 3),
+        "warmup_s": round(warmup_s, 3) if warmup_s is not None else None,
+        "first_job_s": jobs[0],
+        "second_job_s": jobs[1],
+        "first_frame_stages": first_calls,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "first job latency of a freshly started worker with and without the model "
+        "warm-up (WORKER_WARMUP), each in a new process"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--resolution", default="1280x720")
+        parser.add_argument("--seconds", type=float, default=2)
+        parser.add_argument("--fps", type=int, default=25)
+        parser.add_argument("--background", action="store_true")
+        parser.add_argument(
+            "--models",
+            choices=["auto", "stub", "real"],
+            default="auto",
+            help="real needs the model weights and --face-image, auto falls back to stubs",
+        )
+        parser.add_argument("--face-image", default=None)
+        parser.add_argument("--workdir", default=None)
+        parser.add_argument("--output", default=None, help="write the json report here")
+
+    def handle(self, *args, **options):
+        models = options["models"]
+        if models == "auto":
+            has_weights = real_models_available(settings.SWAPPER_MODEL_PATH)
+            models = "real" if has_weights and options["face_image"] else "stub"
+        if models == "real" and not options["face_image"]:
+            raise CommandError("--face-image is needed to benchmark the real models")
+
+        width, height = parse_resolution(options["resolution"])
+        workdir = options["workdir"] or tempfile.mkdtemp(prefix="warmup_bench_")
+        os.makedirs(workdir, exist_ok=True)
+        input_path = make_synthetic_video(
+            os.path.join(workdir, "input.mp4"), width, height, options["seconds"], fps=options["fps"]
+        )
+        face_image = options["face_image"] or make_stub_face_image(
+            os.path.join(workdir, "face.png")
+        )
+        background = (
+            make_background_image(os.path.join(workdir, "background.png"))
+            if options["background"]
+            else None
+        )
+
+        run_options = {
+            "models": models,
+            "workdir": workdir,
+            "swapper_model_path": str(settings.SWAPPER_MODEL_PATH),
+            "session_options": getattr(settings, "ONNX_SESSION_OPTIONS", None),
+            "static_frame_threshold": getattr(settings, "STATIC_FRAME_THRESHOLD", None),
+        }
+        warmup = {
+            **getattr(settings, "WORKER_WARMUP", {}),
+            # warm up at the benchmark's resolution like a worker configured for it
+            "frame_size": [width, height],
+        }
+
+        runs = {}
+        for mode in ("cold", "warm"):
+            case = {
+                "mode": mode,
+                "input": input_path,
+                "face_image": face_image,
+                "background": background,
+                "warmup": warmup,
+            }
+            # one process per mode so no ONNX Runtime state carries over
+            runs[mode] = run_spawned(run_warmup_case, case, run_options)
+            result = runs[mode]
+            self.stderr.write(
+                f"{mode}: load {result['model_load_s']}s, warm-up {result['warmup_s'] or 0}s, "
+                f"first job {result['first_job_s']}s, second job {result['second_job_s']}s"
+            )
+            for stage, calls in result["first_frame_stages"].items():
+                self.stderr.write(
+                    f"  {stage}: first frame {calls['first_ms']} ms, median {calls['median_ms']} ms"
+                )
+
+        report = {
+            "commit": current_commit(),
+            "models": models,
+            "resolution": [width, height],
+            "seconds": options["seconds"],
+            "background": bool(background),
+            "cold": runs["cold"],
+            "warm": runs["warm"],
+            "first_job_saved_s": round(runs["cold"]["first_job_s"] - runs["warm"]["first_job_s"], 3),
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
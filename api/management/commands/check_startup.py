@@ -0,0 +1,111 @@
+import os
+import sys
+import subprocess
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+# imports a target's modules in a fresh interpreter, the way its process starts
+IMPORT_SCRIPT = """
+import os, sys, importlib
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", {settings_module!r})
+import django
+django.setup()
+for name in {modules!r}:
+    importlib.import_module(name)
+"""
+
+
+def parse_importtime(output):
+    """
+    {module: (self us, cumulative us)} and the total import time in us from the stderr
+    of python -X importtime. Top level imports (no indent) add up to the total.
+    """
+    modules = {}
+    total = 0
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        try:
+            self_us, cumulative_us = int(self_us), int(cumulative_us)
+        except ValueError:
+            # the header line
+            continue
+        stripped = name.lstrip()
+        modules[stripped] = (self_us, cumulative_us)
+        if len(name) - len(stripped) == 1:
+            total += cumulative_us
+    return modules, total
+
+
+def measure_startup(target, runs=3):
+    """
+    Best of runs import time (us) and the imported modules of one STARTUP_BUDGETS target.
+    """
+    script = IMPORT_SCRIPT.format(
+        settings_module=os.environ.get("DJANGO_SETTINGS_MODULE", "magic_roll_backend.settings"),
+        modules=list(target["modules"]),
+    )
+    best = None
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", script],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+        modules, total = parse_importtime(result.stderr)
+        if best is None or total < best[1]:
+            best = (modules, total)
+    return best
+
+
+def startup_problems(name, target, modules, total):
+    """
+    What's wrong with a target's measured startup: over budget_ms, forbidden modules
+    imported. Empty when it's within STARTUP_BUDGETS (api.tests.StartupBudgetTests).
+    """
+    problems = []
+    total_ms = total / 1000
+    if total_ms > target["budget_ms"]:
+        problems.append(f"{name} imports in {total_ms:.0f} ms, budget {target['budget_ms']} ms")
+    loaded = [module for module in target.get("forbidden", ()) if module in modules]
+    if loaded:
+        problems.append(f"{name} imports {', '.join(loaded)} at startup")
+    return problems
+
+
+class Command(BaseCommand):
+    help = (
+        "Import time of the API and worker processes (python -X importtime) against "
+        "STARTUP_BUDGETS, with their slowest imports. The test suite enforces the budgets"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--targets", nargs="+", default=None)
+        parser.add_argument("--runs", type=int, default=3)
+        parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+
+    def handle(self, *args, **options):
+        budgets = getattr(settings, "STARTUP_BUDGETS", {})
+        names = options["targets"] or list(budgets)
+
+        for name in names:
+            if name not in budgets:
+                raise CommandError(f"Unknown target {name}, expected one of {list(budgets)}")
+            target = budgets[name]
+            modules, total = measure_startup(target, runs=options["runs"])
+            total_ms = total / 1000
+
+            self.stdout.write(f"{name}: {total_ms:.0f} ms (budget {target['budget_ms']} ms)")
+            slowest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)
+            for module, (self_us, cumulative_us) in slowest[: options["top"]]:
+                self.stdout.write(
+                    f"  {module:<50} self {self_us / 1000:7.1f} ms  "
+                    f"cumulative {cumulative_us / 1000:7.1f} ms"
+                )
+
+            for problem in startup_problems(name, target, modules, total):
+                self.stdout.write(self.style.WARNING(f"  {problem}"))
@@ -0,0 +1,363 @@
+import os
+import json
+import time
+import random
+import tempfile
+import multiprocessing
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+# sqlite settings before the WAL / busy timeout / IMMEDIATE configuration, Django's defaults
+DEFAULT_SQLITE = {"CONN_MAX_AGE": 0, "OPTIONS": {}}
+
+
+def setup_django(database):
+    """
+    Django in a spawned load test process, on the case's own database file.
+    """
+    import django
+
+    django.setup()
+    from django.db import connections
+
+    connections["default"].close()
+    connections["default"].settings_dict.update(database)
+
+
+def seed_database(database, writers, variants, completed_jobs):
+    """
+    Migrate a fresh database and create the jobs: completed ones for the list calls and
+    `variants` processing jobs leased to each simulated worker. Returns their ids.
+    """
+    setup_django(database)
+    from django.core.management import call_command
+    from django.utils import timezone
+    from api.leases import lease_expiry
+    from api.models import OutputVideo, VideoData
+
+    call_command("migrate", verbosity=0)
+    video = VideoData.objects.create(video_url="https://example.com/watch?v=load")
+    OutputVideo.objects.bulk_create(
+        [
+            OutputVideo(video_data=video, status="completed", progress=100)
+            for _ in range(completed_jobs)
+        ]
+    )
+    worker_jobs = []
+    for index in range(writers):
+        jobs = OutputVideo.objects.bulk_create(
+            [
+                OutputVideo(
+                    video_data=video,
+                    status="processing",
+                    worker_id=f"load-worker-{index}",
+                    started_at=timezone.now(),
+                    lease_expires_at=lease_expiry(),
+                )
+                for _ in range(variants)
+            ]
+        )
+        worker_jobs.append([job.id for job in jobs])
+    status_ids = list(OutputVideo.objects.values_list("id", flat=True)[:200])
+    return worker_jobs, status_ids
+
+
+def timed(stats, name, operation):
+    """
+    Run operation and record its seconds under name, or the OperationalError it raised
+    ("database is locked").
+    """
+    from django.db import OperationalError
+
+    start = time.perf_counter()
+    try:
+        operation()
+    except OperationalError as e:
+        stats["errors"][name] = stats["errors"].get(name, 0) + 1
+        stats["messages"][str(e)] = stats["messages"].get(str(e), 0) + 1
+        return
+    stats["samples"].setdefault(name, []).append(time.perf_counter() - start)
+
+
+def new_stats():
+    return {"samples": {}, "errors": {}, "messages": {}}
+
+
+def run_writer(database, index, job_ids, case, start_at):
+    """
+    A rendering worker: a progress callback every callback_seconds (written on every call,
+    or through ProgressWriter when batched), lease renewals and a WorkerStatus heartbeat
+    every heartbeat_seconds.
+    """
+    setup_django(database)
+    from django.utils import timezone
+    from api.leases import renew_lease
+    from api.models import OutputVideo, WorkerStatus
+    from api.workers import ProgressWriter
+
+    worker_id = f"load-worker-{index}"
+    WorkerStatus.objects.get_or_create(worker_id=worker_id, defaults={"hostname": "load"})
+    stats = new_stats()
+    writer = ProgressWriter(case["progress_seconds"])
+    last_beat = 0
+    percent = 0
+
+    time.sleep(max(0, start_at - time.time()))
+    deadline = time.monotonic() + case["seconds"]
+    while time.monotonic() < deadline:
+        percent = (percent + 1) % 101
+        if case["batched"]:
+            before = writer.writes + writer.errors
+            start = time.perf_counter()
+            writer.update(job_ids, percent)
+            if writer.writes + writer.errors > before:
+                stats["samples"].setdefault("progress", []).append(
+                    time.perf_counter() - start
+                )
+        else:
+            timed(
+                stats,
+                "progress",
+                lambda: OutputVideo.objects.filter(pk__in=job_ids).update(progress=percent),
+            )
+
+        if time.monotonic() - last_beat >= case["heartbeat_seconds"]:
+            last_beat = time.monotonic()
+            for job_id in job_ids:
+                timed(stats, "lease", lambda: renew_lease(job_id, worker_id))
+            timed(
+                stats,
+                "heartbeat",
+                lambda: WorkerStatus.objects.filter(worker_id=worker_id).update(
+                    heartbeat_at=timezone.now()
+                ),
+            )
+        time.sleep(case["callback_seconds"])
+
+    if writer.errors:
+        stats["errors"]["progress"] = stats["errors"].get("progress", 0) + writer.errors
+    return stats
+
+
+def run_reader(database, index, status_ids, case, start_at):
+    """
+    An API process answering clients back to back: status polls, list calls and uploads
+    (a VideoData and its jobs) in the case's mix. Connections are recycled after every
+    call the way Django's request cycle does, so CONN_MAX_AGE applies.
+    """
+    setup_django(database)
+    from django.db import close_old_connections, transaction
+    from api.models import OutputVideo, VideoData
+    from api.services import create_jobs
+
+    rng = random.Random(index)
+    stats = new_stats()
+    operations, weights = zip(*case["mix"].items())
+
+    def status_poll():
+        ids = rng.sample(status_ids, min(20, len(status_ids)))
+        list(
+            OutputVideo.objects.filter(pk__in=ids).values(
+                "id", "status", "progress", "job_type", "final_video_url", "created_at"
+            )
+        )
+
+    def list_videos():
+        list(OutputVideo.objects.prefetch_related("renditions").order_by("-created_at")[:100])
+
+    def upload():
+        with transaction.atomic():
+            video = VideoData.objects.create(video_url="https://example.com/watch?v=upload")
+            create_jobs(video, preview=rng.random() < 0.5)
+
+    calls = {"status": status_poll, "list": list_videos, "upload": upload}
+    time.sleep(max(0, start_at - time.time()))
+    deadline = time.monotonic() + case["seconds"]
+    while time.monotonic() < deadline:
+        name = rng.choices(operations, weights)[0]
+        timed(stats, name, calls[name])
+        close_old_connections()
+        if case["think_seconds"]:
+            time.sleep(case["think_seconds"])
+    return stats
+
+
+def summarize(results, seconds):
+    import numpy as np
+
+    merged, errors, messages = {}, {}, {}
+    for result in results:
+        for name, values in result["samples"].items():
+            merged.setdefault(name, []).extend(values)
+        for name, count in result["errors"].items():
+            errors[name] = errors.get(name, 0) + count
+        for message, count in result["messages"].items():
+            messages[message] = messages.get(message, 0) + count
+
+    summary = {}
+    for name in sorted(set(merged) | set(errors)):
+        values_ms = np.array(merged.get(name, [])) * 1000
+        summary[name] = {
+            "ok": int(values_ms.size),
+            "errors": errors.get(name, 0),
+            "per_s": round(values_ms.size / seconds, 1),
+            **(
+                {
+                    "p50_ms": round(float(np.percentile(values_ms, 50)), 2),
+                    "p95_ms": round(float(np.percentile(values_ms, 95)), 2),
+                    "p99_ms": round(float(np.percentile(values_ms, 99)), 2),
+                    "max_ms": round(float(values_ms.max()), 2),
+                }
+                if values_ms.size
+                else {}
+            ),
+        }
+    return summary, messages
+
+
+class Command(BaseCommand):
+    help = (
+        "concurrent read/write load on a scratch sqlite database: worker processes writing "
+        "progress, leases and heartbeats while API processes poll, list and upload, with "
+        "Django's default sqlite settings and with DATABASES' (WAL, busy timeout, "
+        "IMMEDIATE transactions, CONN_MAX_AGE), progress written per callback or batched"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=10)
+        parser.add_argument("--workers", type=int, default=4, help="simulated rendering workers")
+        parser.add_argument("--readers", type=int, default=4, help="simulated API processes")
+        parser.add_argument("--variants", type=int, default=2, help="jobs each worker renders")
+        parser.add_argument("--completed-jobs", type=int, default=300)
+        parser.add_argument(
+            "--callback-seconds",
+            type=float,
+            default=0.02,
+            help="seconds between a worker's progress callbacks",
+        )
+        parser.add_argument("--heartbeat-seconds", type=float, default=1.0)
+        parser.add_argument("--think-seconds", type=float, default=0.0)
+        parser.add_argument(
+            "--mix",
+            default="status=70,list=20,upload=10",
+            help="weights of the API calls",
+        )
+        parser.add_argument(
+            "--profiles",
+            default="default,tuned",
+            help="default (Django's sqlite settings) and/or tuned (DATABASES')",
+        )
+        parser.add_argument("--progress", default="each,batched")
+        parser.add_argument("--workdir", default=None)
+        parser.add_argument("--output", default=None, help="write the json report here")
+
+    def handle(self, *args, **options):
+        # imported here, the spawned processes import this module and only need the above
+        from .benchmark_pipeline import current_commit
+
+        configured = settings.DATABASES["default"]
+        if "sqlite" not in configured["ENGINE"]:
+            raise CommandError(
+                "db_load_test compares sqlite configurations, unset POSTGRES_DB to run it"
+            )
+        profiles = {
+            "default": DEFAULT_SQLITE,
+            "tuned": {
+                "CONN_MAX_AGE": configured.get("CONN_MAX_AGE", 0),
+                "OPTIONS": dict(configured.get("OPTIONS", {})),
+            },
+        }
+        try:
+            mix = {
+                name: float(weight)
+                for name, weight in (part.split("=") for part in options["mix"].split(","))
+            }
+        except ValueError:
+            raise CommandError("--mix looks like status=70,list=20,upload=10")
+        unknown = set(mix) - {"status", "list", "upload"}
+        if unknown:
+            raise CommandError(f"Unknown calls in --mix: {sorted(unknown)}")
+
+        workdir = options["workdir"] or tempfile.mkdtemp(prefix="db_load_")
+        os.makedirs(workdir, exist_ok=True)
+        context = multiprocessing.get_context("spawn")
+        cases = []
+
+        for profile in options["profiles"].split(","):
+            if profile not in profiles:
+                raise CommandError(f"Unknown profile {profile}")
+            for progress in options["progress"].split(","):
+                if progress not in ("each", "batched"):
+                    raise CommandError(f"Unknown progress mode {progress}")
+                name = f"{profile}/{progress}"
+                database = {
+                    **profiles[profile],
+                    "NAME": os.path.join(workdir, f"{profile}_{progress}.sqlite3"),
+                }
+                case = {
+                    "seconds": options["seconds"],
+                    "batched": progress == "batched",
+                    "progress_seconds": getattr(settings, "WORKER_PROGRESS_SECONDS", 2),
+                    "callback_seconds": options["callback_seconds"],
+                    "heartbeat_seconds": options["heartbeat_seconds"],
+                    "think_seconds": options["think_seconds"],
+                    "mix": mix,
+                }
+                with context.Pool(processes=1) as pool:
+                    worker_jobs, status_ids = pool.apply(
+                        seed_database,
+                        (
+                            database,
+                            options["workers"],
+                            options["variants"],
+                            options["completed_jobs"],
+                        ),
+                    )
+
+                with context.Pool(processes=options["workers"] + options["readers"]) as pool:
+                    # every process starts its clock at the same moment, after django setup
+                    start_at = time.time() + 3
+                    writers = [
+                        pool.apply_async(run_writer, (database, index, job_ids, case, start_at))
+                        for index, job_ids in enumerate(worker_jobs)
+                    ]
+                    readers = [
+                        pool.apply_async(run_reader, (database, index, status_ids, case, start_at))
+                        for index in range(options["readers"])
+                    ]
+                    writer_results = [result.get() for result in writers]
+                    reader_results = [result.get() for result in readers]
+
+                writes, write_messages = summarize(writer_results, options["seconds"])
+                reads, read_messages = summarize(reader_results, options["seconds"])
+                cases.append(
+                    {
+                        "case": name,
+                        "worker": writes,
+                        "api": reads,
+                        "error_messages": {**write_messages, **read_messages},
+                    }
+                )
+                self.stderr.write(name)
+                for side, summary in (("worker", writes), ("api", reads)):
+                    for call, stats in summary.items():
+                        self.stderr.write(
+                            f"  {side} {call:<9} {stats['per_s']:>8}/s  errors {stats['errors']:<5} "
+                            f"p50 {stats.get('p50_ms', '-')} ms  p95 {stats.get('p95_ms', '-')} ms  "
+                            f"p99 {stats.get('p99_ms', '-')} ms"
+                        )
+
+        report = {
+            "commit": current_commit(),
+            "seconds": options["seconds"],
+            "workers": options["workers"],
+            "readers": options["readers"],
+            "callback_seconds": options["callback_seconds"],
+            "mix": mix,
+            "cases": cases,
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import signal
+import tempfile
+import multiprocessing
+from django.core.management.base import BaseCommand, CommandError
+from helpers.benchmark import (
+    build_engine,
+    compare_videos,
+    make_stub_face_image,
+    make_synthetic_video,
+    run_spawned,
+)
+from helpers.checkpoint import MANIFEST_NAME
+from helpers.profiling import StageTimer
+from .benchmark_pipeline import parse_resolution
+
+
+def committed_segments(checkpoint_dir):
+    try:
+        with open(os.path.join(checkpoint_dir, MANIFEST_NAME)) as f:
+            return len(json.load(f)["segments"])
+    except (OSError, ValueError, KeyError):
+        return 0
+
+
+def run_checkpoint_render(case, options):
+    """
+    Render case["input"] with checkpoints in case["checkpoint_dir"] using stub models and
+    return this run's frame stats. A later call with the same directory resumes the
+    render from its last committed segment, wherever the process running it was killed.
+    """
+    engine = build_engine(options, case["workdir"], case.get("background"))
+    engine.load_source_faces([case["face_image"]])
+    renditions = [dict(rendition) for rendition in case.get("renditions", [])]
+    if not case.get("join", True):
+        # without ffmpeg the committed segments are left unjoined
+        engine.join_segments = lambda input_video, variant: None
+
+    # with kill_after_segments the process SIGKILLs itself in the middle of the next
+    # segment, leaving its partial files behind like a worker dying mid-render
+    committed = []
+
+    def segment_callback(variant, manifest):
+        committed.append(manifest["segments"][-1]["index"])
+
+    def progress_callback(percent, frame_index, total_frames):
+        if case.get("kill_after_segments") and len(committed) >= case["kill_after_segments"]:
+            os.kill(os.getpid(), signal.SIGKILL)
+
+    timer = StageTimer()
+    frame_stats = engine.process_video(
+        input_video=case["input"],
+        output_video=case["output"],
+        timer=timer,
+        renditions=renditions,
+        progress_callback=progress_callback,
+        checkpoint_dir=case["checkpoint_dir"],
+        segment_frames=case["segment_frames"],
+        segment_callback=segment_callback,
+    )
+    return {"frame_stats": frame_stats, "stages": timer.summary()}
+
+
+class Command(BaseCommand):
+    help = (
+        "kill a checkpointed render mid-job, resume it in a fresh process and check the "
+        "result matches an uninterrupted render"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--resolution", default="640x360")
+        parser.add_argument("--seconds", type=float, default=12)
+        parser.add_argument("--fps", type=int, default=25)
+        parser.add_argument("--segment-frames", type=int, default=50)
+        parser.add_argument(
+            "--kill-after",
+            nargs="+",
+            type=int,
+            default=[2, 4],
+            help="kill the worker once this many segments are committed, once per value",
+        )
+        parser.add_argument(
+            "--kill-delay",
+            type=float,
+            default=0.2,
+            help="seconds to wait after the commit so the kill lands mid-segment",
+        )
+        parser.add_argument("--rendition-height", type=int, default=240)
+        parser.add_argument("--workdir", default=None)
+
+    def handle(self, *args, **options):
+        width, height = parse_resolution(options["resolution"])
+        workdir = options["workdir"] or tempfile.mkdtemp(prefix="fault_inject_")
+        os.makedirs(workdir, exist_ok=True)
+
+        input_path = make_synthetic_video(
+            os.path.join(workdir, "input.mp4"), width, height, options["seconds"], fps=options["fps"]
+        )
+        run_options = {"models": "stub", "workdir": workdir}
+
+        def case(name):
+            return {
+                "workdir": workdir,
+                "input": input_path,
+                "face_image": make_stub_face_image(os.path.join(workdir, "face.png")),
+                "output": os.path.join(workdir, f"{name}.mp4"),
+                "checkpoint_dir": os.path.join(workdir, f"{name}_segments"),
+                "segment_frames": options["segment_frames"],
+                "renditions": [
+                    {
+                        "name": "small",
+                        "path": os.path.join(workdir, f"{name}_small.mp4"),
+                        "height": options["rendition_height"],
+                        "bitrate": "300k",
+                    }
+                ],
+            }
+
+        context = multiprocessing.get_context("spawn")
+
+        reference = case("reference")
+        run_spawned(run_checkpoint_render, reference, run_options)
+
+        interrupted = case("interrupted")
+        kills = []
+        for segments in options["kill_after"]:
+            process = context.Process(
+                target=run_checkpoint_render, args=(interrupted, run_options)
+            )
+            process.start()
+            while process.is_alive() and committed_segments(interrupted["checkpoint_dir"]) < segments:
+                time.sleep(0.05)
+            time.sleep(options["kill_delay"])
+            finished = not process.is_alive()
+            process.kill()
+            process.join()
+            kills.append(
+                {
+                    "after_segments": segments,
+                    "committed": committed_segments(interrupted["checkpoint_dir"]),
+                    "finished_before_kill": finished,
+                }
+            )
+            self.stderr.write(f"killed worker with {kills[-1]['committed']} segments committed")
+
+        resumed = run_spawned(run_checkpoint_render, interrupted, run_options)
+
+        report = {
+            "workdir": workdir,
+            "kills": kills,
+            "resumed_run": resumed["frame_stats"],
+            "main": compare_videos(interrupted["output"], reference["output"]),
+            "rendition": compare_videos(
+                interrupted["renditions"][0]["path"], reference["renditions"][0]["path"]
+            ),
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+
+        for output in ("main", "rendition"):
+            result = report[output]
+            if result["frames"] != result["other_frames"] or result["max_diff"]:
+                raise CommandError(f"resumed {output} output differs from the reference render")
+        if any(kill["finished_before_kill"] for kill in kills):
+            raise CommandError("the render finished before it could be killed, lower --kill-after")
+        self.stderr.write("resumed render matches the uninterrupted one")
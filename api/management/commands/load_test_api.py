@@ -0,0 +1,436 @@
+import os
+import json
+import time
+import random
+import socket
+import logging
+import tempfile
+import threading
+import multiprocessing
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+from .db_load_test import setup_django
+
+ENDPOINTS = ("upload", "detail", "status", "list")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed_database(database, media_root, jobs):
+    """
+    Migrate a fresh database and add `jobs` finished jobs (with renditions) so list calls
+    start from a populated table. Returns their ids.
+    """
+    setup_django(database)
+    from django.core.management import call_command
+    from api.models import OutputVideo, VideoData, VideoRendition
+
+    settings.MEDIA_ROOT = media_root
+    call_command("migrate", verbosity=0)
+    video = VideoData.objects.create(video_url="https://example.com/watch?v=seed")
+    seeded = OutputVideo.objects.bulk_create(
+        [
+            OutputVideo(
+                video_data=video,
+                status="completed",
+                progress=100,
+                final_video_url=f"https://cdn.example.com/seed/{index}.mp4",
+            )
+            for index in range(jobs)
+        ]
+    )
+    VideoRendition.objects.bulk_create(
+        [
+            VideoRendition(
+                output_video=job,
+                name=spec["name"],
+                height=spec.get("height"),
+                bitrate=spec.get("bitrate"),
+                video_url=f"https://cdn.example.com/seed/{job.id}_{spec['name']}.mp4",
+            )
+            for job in seeded
+            for spec in getattr(settings, "VIDEO_RENDITIONS", [])
+        ]
+    )
+    return [job.id for job in seeded]
+
+
+def run_server(database, media_root, port):
+    """
+    The API on Django's threaded WSGI server (what runserver uses), on the scratch
+    database and media root, with the query count headers on.
+    """
+    setup_django(database)
+    from django.core.servers.basehttp import run
+    from django.core.wsgi import get_wsgi_application
+
+    settings.MEDIA_ROOT = media_root
+    settings.QUERY_COUNT_HEADER = True
+    application = get_wsgi_application()
+    # after get_wsgi_application, its django.setup() configures logging again
+    logging.getLogger("django.server").setLevel(logging.ERROR)
+    run("127.0.0.1", port, application, threading=True)
+
+
+def run_stub_worker(database, index, options, stop_at):
+    """
+    A worker that renders nothing: it claims jobs through the real scheduler and leases,
+    moves their progress from 0 to 100 over render_seconds (written like a real render,
+    through ProgressWriter) and completes them with a made up url.
+    """
+    setup_django(database)
+    from api.leases import reap_expired_jobs, release_lease
+    from api.models import OutputVideo
+    from api.scheduler import pick_next_job
+    from api.workers import ProgressWriter, register_worker, set_worker_state
+
+    worker_id = f"stub-worker-{index}"
+    register_worker(worker_id)
+    set_worker_state(worker_id, "ready")
+    completed = 0
+    while time.time() < stop_at:
+        reap_expired_jobs()
+        job = pick_next_job(worker_id)
+        if job is None:
+            time.sleep(options["poll_seconds"])
+            continue
+
+        set_worker_state(worker_id, "busy")
+        progress = ProgressWriter(options["progress_seconds"])
+        start = time.monotonic()
+        while time.time() < stop_at:
+            elapsed = time.monotonic() - start
+            if elapsed >= options["render_seconds"]:
+                break
+            progress.update([job.id], 100 * elapsed / options["render_seconds"])
+            time.sleep(options["callback_seconds"])
+        completed += OutputVideo.objects.filter(
+            pk=job.id, status="processing", worker_id=worker_id
+        ).update(
+            status="completed",
+            progress=100,
+            final_video_url=f"https://cdn.example.com/stub/{job.id}.mp4",
+        )
+        release_lease(job.id, worker_id)
+        set_worker_state(worker_id, "ready")
+    set_worker_state(worker_id, "stopped")
+    return completed
+
+
+class VirtualClient:
+    """
+    One user of the app in a closed loop: pick a call by the mix weights, wait a think
+    time (exponential around think_seconds), repeat. Uploads add a job the client then
+    polls (details of one job, or the status of all of its jobs at once) and list calls
+    fetch every video like the results tab.
+    """
+
+    def __init__(self, index, base_url, mix, payload, seed_ids, think_seconds, seed):
+        import requests
+
+        self.index = index
+        self.base_url = base_url
+        self.mix = mix
+        self.payload = payload
+        self.seed_ids = seed_ids
+        self.think_seconds = think_seconds
+        self.rng = random.Random(seed * 1000 + index)
+        self.session = requests.Session()
+        self.session.headers["X-Client-Id"] = f"load-client-{index}"
+        self.job_ids = []
+        self.samples = []
+
+    def request(self, endpoint, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=60, **kwargs)
+        except Exception as e:
+            self.samples.append((endpoint, time.perf_counter() - start, None, None, None, str(e)))
+            return None
+        seconds = time.perf_counter() - start
+        queries = response.headers.get("X-DB-Queries")
+        db_ms = response.headers.get("X-DB-Time-Ms")
+        self.samples.append(
+            (
+                endpoint,
+                seconds,
+                response.status_code,
+                int(queries) if queries is not None else None,
+                float(db_ms) if db_ms is not None else None,
+                None,
+            )
+        )
+        return response
+
+    def call(self, endpoint):
+        if endpoint == "upload":
+            video, face = self.payload
+            response = self.request(
+                "upload",
+                "POST",
+                "/api/videos/",
+                data={"preview": "true" if self.rng.random() < 0.3 else "false"},
+                files={
+                    "video_file": ("clip.mp4", video, "video/mp4"),
+                    "face_images": ("face.png", face, "image/png"),
+                },
+            )
+            if response is not None and response.status_code == 201:
+                self.job_ids.extend(job["id"] for job in response.json()["output_videos"])
+        elif endpoint == "detail":
+            job_id = self.rng.choice(self.job_ids or self.seed_ids)
+            self.request("detail", "GET", f"/api/videos/details/{job_id}/")
+        elif endpoint == "status":
+            ids = self.job_ids[-20:] or self.rng.sample(self.seed_ids, min(20, len(self.seed_ids)))
+            self.request(
+                "status", "GET", "/api/videos/status/", params={"ids": ",".join(map(str, ids))}
+            )
+        else:
+            self.request("list", "GET", "/api/videos/list/")
+
+    def run(self, start_at, record_from, stop_at):
+        endpoints, weights = zip(*self.mix.items())
+        time.sleep(max(0, start_at - time.time()))
+        while time.time() < stop_at:
+            recorded = len(self.samples)
+            self.call(self.rng.choices(endpoints, weights)[0])
+            if time.time() < record_from:
+                # warm-up calls fill caches and pools, they aren't reported
+                del self.samples[recorded:]
+            if self.think_seconds:
+                time.sleep(self.rng.expovariate(1 / self.think_seconds))
+        self.session.close()
+
+
+def percentile_summary(samples, seconds):
+    import numpy as np
+
+    report = {}
+    for endpoint in ENDPOINTS:
+        calls = [sample for sample in samples if sample[0] == endpoint]
+        if not calls:
+            continue
+        ok = [sample for sample in calls if sample[2] is not None and sample[2] < 400]
+        latencies_ms = np.array([sample[1] for sample in ok]) * 1000
+        queries = [sample[3] for sample in ok if sample[3] is not None]
+        db_ms = [sample[4] for sample in ok if sample[4] is not None]
+        errors = {}
+        for sample in calls:
+            if sample[2] is None or sample[2] >= 400:
+                key = str(sample[2]) if sample[2] is not None else sample[5][:80]
+                errors[key] = errors.get(key, 0) + 1
+        report[endpoint] = {
+            "requests": len(calls),
+            "errors": errors,
+            "per_s": round(len(ok) / seconds, 1),
+            **(
+                {
+                    "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+                    "p95_ms": round(float(np.percentile(latencies_ms, 95)), 2),
+                    "p99_ms": round(float(np.percentile(latencies_ms, 99)), 2),
+                    "max_ms": round(float(latencies_ms.max()), 2),
+                }
+                if latencies_ms.size
+                else {}
+            ),
+            "queries_mean": round(sum(queries) / len(queries), 1) if queries else None,
+            "queries_max": max(queries) if queries else None,
+            "db_ms_mean": round(sum(db_ms) / len(db_ms), 2) if db_ms else None,
+        }
+    return report
+
+
+class Command(BaseCommand):
+    help = (
+        "replay a mix of uploads, job polls and list calls from concurrent clients against "
+        "the API (a local server on a scratch database with stub workers, or --url) and "
+        "report throughput, p50/p95/p99 latency and db queries per endpoint"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=20)
+        parser.add_argument("--warmup-seconds", type=float, default=2)
+        parser.add_argument("--clients", type=int, default=10)
+        parser.add_argument(
+            "--mix",
+            default="upload=1,detail=6,status=2,list=1",
+            help="weights of the calls each client makes",
+        )
+        parser.add_argument(
+            "--think-seconds",
+            type=float,
+            default=0.2,
+            help="mean pause between a client's calls, 0 for back to back",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="same seed, same call sequence")
+        parser.add_argument("--seed-jobs", type=int, default=200, help="finished jobs to start with")
+        parser.add_argument("--workers", type=int, default=2, help="stub workers")
+        parser.add_argument("--render-seconds", type=float, default=5)
+        parser.add_argument(
+            "--url", default=None, help="load an already running server instead (no stub workers)"
+        )
+        parser.add_argument("--workdir", default=None)
+        parser.add_argument("--output", default=None, help="write the json report here")
+
+    def handle(self, *args, **options):
+        from helpers.benchmark import make_stub_face_image, make_synthetic_video
+        from .benchmark_pipeline import current_commit
+
+        try:
+            mix = {
+                name: float(weight)
+                for name, weight in (part.split("=") for part in options["mix"].split(","))
+            }
+        except ValueError:
+            raise CommandError("--mix looks like upload=1,detail=6,status=2,list=1")
+        unknown = set(mix) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError(f"Unknown calls in --mix: {sorted(unknown)}")
+
+        workdir = options["workdir"] or tempfile.mkdtemp(prefix="api_load_")
+        os.makedirs(workdir, exist_ok=True)
+        # a short clip and a face like the app uploads, probed by the upload endpoint
+        video_path = make_synthetic_video(os.path.join(workdir, "clip.mp4"), 320, 240, 2, fps=10)
+        face_path = make_stub_face_image(os.path.join(workdir, "face.png"), 128)
+        with open(video_path, "rb") as video, open(face_path, "rb") as face:
+            payload = (video.read(), face.read())
+
+        context = multiprocessing.get_context("spawn")
+        processes = []
+        stub_results = []
+        pool = None
+        try:
+            if options["url"]:
+                base_url = options["url"].rstrip("/")
+                seed_ids = self.fetch_ids(base_url)
+            else:
+                configured = settings.DATABASES["default"]
+                if "sqlite" not in configured["ENGINE"]:
+                    raise CommandError(
+                        "the local server runs on a scratch sqlite database, unset "
+                        "POSTGRES_DB or pass --url"
+                    )
+                database = {
+                    "CONN_MAX_AGE": configured.get("CONN_MAX_AGE", 0),
+                    "OPTIONS": dict(configured.get("OPTIONS", {})),
+                    "NAME": os.path.join(workdir, "load.sqlite3"),
+                }
+                media_root = os.path.join(workdir, "media")
+                with context.Pool(processes=1) as seed_pool:
+                    seed_ids = seed_pool.apply(
+                        seed_database, (database, media_root, options["seed_jobs"])
+                    )
+
+                port = free_port()
+                server = context.Process(
+                    target=run_server, args=(database, media_root, port), daemon=True
+                )
+                server.start()
+                processes.append(server)
+                base_url = f"http://127.0.0.1:{port}"
+                self.wait_for_server(base_url)
+
+            start_at = time.time() + 1
+            record_from = start_at + options["warmup_seconds"]
+            stop_at = record_from + options["seconds"]
+
+            if not options["url"] and options["workers"]:
+                pool = context.Pool(processes=options["workers"])
+                worker_options = {
+                    "render_seconds": options["render_seconds"],
+                    "progress_seconds": getattr(settings, "WORKER_PROGRESS_SECONDS", 2),
+                    "callback_seconds": 0.4,
+                    "poll_seconds": 1,
+                }
+                stub_results = [
+                    pool.apply_async(run_stub_worker, (database, index, worker_options, stop_at))
+                    for index in range(options["workers"])
+                ]
+
+            clients = [
+                VirtualClient(
+                    index,
+                    base_url,
+                    mix,
+                    payload,
+                    seed_ids,
+                    options["think_seconds"],
+                    options["seed"],
+                )
+                for index in range(options["clients"])
+            ]
+            threads = [
+                threading.Thread(target=client.run, args=(start_at, record_from, stop_at))
+                for client in clients
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            completed = sum(result.get() for result in stub_results)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            for process in processes:
+                process.terminate()
+                process.join()
+
+        samples = [sample for client in clients for sample in client.samples]
+        endpoints = percentile_summary(samples, options["seconds"])
+        ok = sum(endpoint["per_s"] for endpoint in endpoints.values())
+        for name, stats in endpoints.items():
+            self.stderr.write(
+                f"{name:<7} {stats['per_s']:>7}/s  p50 {stats.get('p50_ms', '-')} ms  "
+                f"p95 {stats.get('p95_ms', '-')} ms  p99 {stats.get('p99_ms', '-')} ms  "
+                f"queries {stats['queries_mean']} (max {stats['queries_max']})  "
+                f"errors {sum(stats['errors'].values())}"
+            )
+        self.stderr.write(f"total {ok:.1f} requests/s, stub workers completed {completed} jobs")
+
+        report = {
+            "commit": current_commit(),
+            "url": options["url"],
+            "seconds": options["seconds"],
+            "clients": options["clients"],
+            "think_seconds": options["think_seconds"],
+            "mix": mix,
+            "seed": options["seed"],
+            "seed_jobs": options["seed_jobs"],
+            "workers": 0 if options["url"] else options["workers"],
+            "throughput_per_s": round(ok, 1),
+            "jobs_completed": completed,
+            "endpoints": endpoints,
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
+
+    def wait_for_server(self, base_url, timeout=30):
+        import requests
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                requests.get(base_url + "/api/workers/", timeout=1)
+                return
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise CommandError(f"The load test server didn't start on {base_url}")
+
+    def fetch_ids(self, base_url):
+        import requests
+
+        response = requests.get(base_url + "/api/videos/list/", timeout=30)
+        response.raise_for_status()
+        ids = [job["id"] for job in response.json()]
+        if not ids:
+            raise CommandError("The server has no jobs to poll, upload something first")
+        return ids
@@ -0,0 +1,303 @@
+import os
+import re
+import uuid
+import hashlib
+import mimetypes
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+from django.core.management.base import BaseCommand
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+PART_RE = re.compile(r"<PartNumber>(\d+)</PartNumber>")
+
+
+def error_xml(code, message):
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code>'
+        f"<Message>{escape(message)}</Message></Error>"
+    ).encode()
+
+
+def decode_aws_chunked(body):
+    """
+    Payload of an aws-chunked body ("<hex size>[;chunk-signature=...]\\r\\n<data>\\r\\n"
+    chunks, a zero size one and optional checksum trailers), what boto3 sends uploads as.
+    """
+    data = bytearray()
+    position = 0
+    while True:
+        line_end = body.index(b"\r\n", position)
+        size = int(body[position:line_end].split(b";", 1)[0], 16)
+        position = line_end + 2
+        if size == 0:
+            return bytes(data)
+        data += body[position : position + size]
+        position += size + 2
+
+
+class ObjectStoreHandler(BaseHTTPRequestHandler):
+    """
+    Path style S3 (/<bucket>/<key>) over files under server.root: object PUT, GET (single
+    ranges), HEAD and DELETE, multipart uploads, bucket creation and list-type=2 listings.
+    Signatures, presigned or not, are not checked.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def parse(self):
+        parts = urlsplit(self.path)
+        bucket, _, key = unquote(parts.path).lstrip("/").partition("/")
+        query = {name: values[0] for name, values in parse_qs(parts.query, True).items()}
+        return bucket, key, query
+
+    def object_path(self, bucket, key):
+        root = os.path.abspath(self.server.root)
+        path = os.path.abspath(os.path.join(root, bucket, *key.split("/")))
+        if not bucket or not path.startswith(root + os.sep) or ".uploads" in key.split("/"):
+            return None
+        return path
+
+    def read_body(self):
+        if "chunked" in self.headers.get("Transfer-Encoding", ""):
+            body = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b";", 1)[0], 16)
+                if size == 0:
+                    # trailers up to the empty line
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                body += self.rfile.read(size)
+                self.rfile.readline()
+            body = bytes(body)
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if "aws-chunked" in self.headers.get("Content-Encoding", "") or self.headers.get(
+            "x-amz-decoded-content-length"
+        ):
+            body = decode_aws_chunked(body)
+        return body
+
+    def reply(self, status, body=b"", headers=None, content_type="application/xml"):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body or status >= 400 or content_type == "application/xml":
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def write_object(self, path, body):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(body)
+        os.replace(temp_path, path)
+        return f'"{hashlib.md5(body).hexdigest()}"'
+
+    def uploads_dir(self, bucket, upload_id):
+        if not re.fullmatch(r"[0-9a-f]{32}", upload_id or ""):
+            return None
+        return os.path.join(self.server.root, bucket, ".uploads", upload_id)
+
+    def do_PUT(self):
+        bucket, key, query = self.parse()
+        body = self.read_body()
+        if not key:
+            os.makedirs(os.path.join(self.server.root, bucket), exist_ok=True)
+            return self.reply(200)
+        path = self.object_path(bucket, key)
+        if path is None:
+            return self.reply(400, error_xml("InvalidArgument", "Bad key"))
+
+        if "uploadId" in query:
+            upload_dir = self.uploads_dir(bucket, query["uploadId"])
+            if upload_dir is None or not os.path.isdir(upload_dir):
+                return self.reply(404, error_xml("NoSuchUpload", query["uploadId"]))
+            etag = self.write_object(
+                os.path.join(upload_dir, f"{int(query['partNumber']):05d}"), body
+            )
+            return self.reply(200, headers={"ETag": etag})
+
+        return self.reply(200, headers={"ETag": self.write_object(path, body)})
+
+    def do_POST(self):
+        bucket, key, query = self.parse()
+        body = self.read_body()
+        path = self.object_path(bucket, key)
+        if path is None:
+            return self.reply(400, error_xml("InvalidArgument", "Bad key"))
+
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            os.makedirs(self.uploads_dir(bucket, upload_id))
+            return self.reply(
+                200,
+                (
+                    '<?xml version="1.0" encoding="UTF-8"?><InitiateMultipartUploadResult>'
+                    f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>"
+                    f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+                ).encode(),
+            )
+
+        if "uploadId" in query:
+            upload_dir = self.uploads_dir(bucket, query["uploadId"])
+            if upload_dir is None or not os.path.isdir(upload_dir):
+                return self.reply(404, error_xml("NoSuchUpload", query["uploadId"]))
+            data = bytearray()
+            for number in PART_RE.findall(body.decode()):
+                with open(os.path.join(upload_dir, f"{int(number):05d}"), "rb") as f:
+                    data += f.read()
+            etag = self.write_object(path, bytes(data))
+            for name in os.listdir(upload_dir):
+                os.remove(os.path.join(upload_dir, name))
+            os.rmdir(upload_dir)
+            return self.reply(
+                200,
+                (
+                    '<?xml version="1.0" encoding="UTF-8"?><CompleteMultipartUploadResult>'
+                    f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>"
+                    f"<ETag>{escape(etag)}</ETag></CompleteMultipartUploadResult>"
+                ).encode(),
+            )
+
+        return self.reply(400, error_xml("InvalidRequest", "Unsupported POST"))
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        bucket, key, query = self.parse()
+        if not key:
+            return self.list_objects(bucket, query)
+
+        path = self.object_path(bucket, key)
+        if path is None or not os.path.isfile(path):
+            return self.reply(404, error_xml("NoSuchKey", key))
+
+        stat = os.stat(path)
+        size = stat.st_size
+        headers = {
+            "ETag": f'"{int(stat.st_mtime_ns):x}-{size:x}"',
+            "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+            "Accept-Ranges": "bytes",
+        }
+        start, end, status = 0, size - 1, 200
+        match = RANGE_RE.match(self.headers.get("Range", ""))
+        if match and any(match.groups()):
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(int(last), size - 1) if last else size - 1
+            else:
+                start, end = max(size - int(last), 0), size - 1
+            if start >= size:
+                headers["Content-Range"] = f"bytes */{size}"
+                return self.reply(416, error_xml("InvalidRange", self.headers["Range"]), headers)
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            status = 206
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header(
+            "Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream"
+        )
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def list_objects(self, bucket, query):
+        bucket_dir = os.path.join(self.server.root, bucket)
+        if not bucket or not os.path.isdir(bucket_dir):
+            return self.reply(404, error_xml("NoSuchBucket", bucket))
+        prefix = query.get("prefix", "")
+        contents = []
+        for root, dirs, names in os.walk(bucket_dir):
+            dirs[:] = [name for name in dirs if name != ".uploads"]
+            for name in names:
+                path = os.path.join(root, name)
+                key = os.path.relpath(path, bucket_dir).replace(os.sep, "/")
+                if not key.startswith(prefix) or name.endswith(".tmp"):
+                    continue
+                stat = os.stat(path)
+                contents.append(
+                    f"<Contents><Key>{escape(key)}</Key><Size>{stat.st_size}</Size>"
+                    f"<LastModified>{formatdate(stat.st_mtime, usegmt=True)}</LastModified>"
+                    "</Contents>"
+                )
+        contents.sort()
+        return self.reply(
+            200,
+            (
+                '<?xml version="1.0" encoding="UTF-8"?><ListBucketResult>'
+                f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>"
+                f"<KeyCount>{len(contents)}</KeyCount><IsTruncated>false</IsTruncated>"
+                + "".join(contents)
+                + "</ListBucketResult>"
+            ).encode(),
+        )
+
+    def do_DELETE(self):
+        bucket, key, query = self.parse()
+        if "uploadId" in query:
+            upload_dir = self.uploads_dir(bucket, query["uploadId"])
+            if upload_dir and os.path.isdir(upload_dir):
+                for name in os.listdir(upload_dir):
+                    os.remove(os.path.join(upload_dir, name))
+                os.rmdir(upload_dir)
+            return self.reply(204, content_type="")
+        path = self.object_path(bucket, key)
+        if path is not None and os.path.isfile(path):
+            os.remove(path)
+        return self.reply(204, content_type="")
+
+
+class Command(BaseCommand):
+    help = (
+        "serve a local S3 compatible object store (path style, files under --root) to try "
+        "remote workers on one box: point S3_ENDPOINT_URL at it"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--root", default="object_store")
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=9000)
+        parser.add_argument("--bucket", action="append", default=[], help="create this bucket")
+        parser.add_argument("--verbose", action="store_true")
+
+    def handle(self, *args, **options):
+        for bucket in options["bucket"] + [os.getenv("CLOUDFLARE_BUCKET_NAME") or ""]:
+            if bucket:
+                os.makedirs(os.path.join(options["root"], bucket), exist_ok=True)
+
+        server = ThreadingHTTPServer((options["host"], options["port"]), ObjectStoreHandler)
+        server.root = options["root"]
+        server.verbose = options["verbose"]
+        self.stdout.write(
+            f"Object store on http://{options['host']}:{options['port']} serving {options['root']}"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,83 @@
+import os
+import glob
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from helpers.composite import FaceSwapBackgroundEngine
+from helpers.quantization import (
+    engine_models,
+    quantize_model,
+    record_engine_sessions,
+    sample_frames,
+    swap_frame,
+)
+
+QUANTIZABLE_TIERS = ("fp16", "int8-dynamic", "int8-static")
+
+
+def default_clips():
+    return sorted(glob.glob(os.path.join(settings.BASE_DIR, "helpers", "downloads", "*.mp4")))
+
+
+class Command(BaseCommand):
+    help = "produce fp16 / int8 variants of the swapper and buffalo_l models"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--faces", nargs="+", required=True, help="source face images")
+        parser.add_argument("--clips", nargs="*", default=None, help="calibration clips")
+        parser.add_argument(
+            "--tiers",
+            nargs="+",
+            default=["int8-dynamic", "int8-static"],
+            choices=QUANTIZABLE_TIERS,
+        )
+        parser.add_argument("--every-n", type=int, default=15, help="sample every Nth frame")
+        parser.add_argument("--calibration-frames", type=int, default=64)
+        parser.add_argument("--output-dir", default=None)
+
+    def handle(self, *args, **options):
+        clips = options["clips"] or default_clips()
+        if not clips:
+            raise CommandError("No calibration clips found")
+
+        output_dir = str(
+            options["output_dir"]
+            or getattr(
+                settings,
+                "QUANTIZED_MODEL_DIR",
+                os.path.join(settings.BASE_DIR, "helpers", "models", "quantized"),
+            )
+        )
+
+        engine = FaceSwapBackgroundEngine(
+            swapper_model_path=str(settings.SWAPPER_MODEL_PATH),
+            providers=("CPUExecutionProvider",),
+            session_options=getattr(settings, "ONNX_SESSION_OPTIONS", None),
+        )
+        engine.load_source_faces(options["faces"])
+
+        recorders = {}
+        if "int8-static" in options["tiers"]:
+            recorders = record_engine_sessions(
+                engine, max_samples=options["calibration_frames"]
+            )
+            frames = 0
+            for _, _, frame in sample_frames(
+                clips,
+                every_n=options["every_n"],
+                max_frames=options["calibration_frames"],
+            ):
+                swap_frame(engine, frame)
+                frames += 1
+            self.stdout.write(f"Recorded calibration data from {frames} frames")
+
+        for name, model in engine_models(engine).items():
+            stem = os.path.splitext(os.path.basename(model.model_file))[0]
+            for tier in options["tiers"]:
+                samples = recorders[name].samples if name in recorders else None
+                output_path = os.path.join(output_dir, f"{stem}.{tier}.onnx")
+                try:
+                    quantize_model(model.model_file, output_path, tier, samples)
+                except Exception as e:
+                    self.stderr.write(f"{tier} failed for {name}: {e}")
+                    continue
+                self.stdout.write(f"{name}: {tier} -> {output_path}")
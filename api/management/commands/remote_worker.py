@@ -0,0 +1,389 @@
+import os
+import time
+import shutil
+import socket
+import tempfile
+import traceback
+from contextlib import ExitStack
+
+import requests
+from django.core.management.base import CommandError
+from django.conf import settings
+
+from api.leases import worker_identity
+from api.storage import remove_path, storage_options, sweep_directory
+from helpers.api_client import ApiError, RemoteLeaseHeartbeat, WorkerApiClient
+from helpers.composite import RenderCancelled
+from helpers.memory import MB
+from helpers.profiling import GroupTimers, job_metrics, reset_peak_rss
+from helpers.yt_downloader import download_youtube
+
+from .background_queue import Command as QueueCommand
+
+
+class Command(QueueCommand):
+    help = (
+        "render jobs claimed through the backend's worker API, on any machine: inputs are "
+        "fetched and outputs pushed through presigned object storage urls, nothing touches "
+        "the database or MEDIA_ROOT"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--api-url", default=os.getenv("BACKEND_URL", "http://localhost:8000")
+        )
+        parser.add_argument(
+            "--token",
+            default=os.getenv("WORKER_API_TOKEN"),
+            help="one of the backend's WORKER_API_TOKENS",
+        )
+        parser.add_argument(
+            "--workdir",
+            default=os.path.join(tempfile.gettempdir(), "magic_roll_worker"),
+            help="input cache and render files",
+        )
+        parser.add_argument(
+            "--cache-mb",
+            type=float,
+            default=5 * 1024,
+            help="cached inputs beyond this are deleted least recently used first",
+        )
+        parser.add_argument(
+            "--models",
+            choices=("real", "stub"),
+            default="real",
+            help="stub renders with the tiny benchmark models, to try a deployment on one box",
+        )
+        parser.add_argument("--poll-seconds", type=float, default=3)
+        parser.add_argument(
+            "--max-jobs", type=int, default=None, help="exit after this many jobs"
+        )
+
+    def handle(self, *args, **options):
+        if not options["token"]:
+            raise CommandError("A worker token is required (--token or WORKER_API_TOKEN)")
+
+        self.load_settings()
+        self.models = options["models"]
+        self.workdir = options["workdir"]
+        self.cache_dir = os.path.join(self.workdir, "cache")
+        self.checkpoint_root = os.path.join(self.workdir, "checkpoints")
+        self.cache_mb = options["cache_mb"]
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.client = WorkerApiClient(options["api_url"], options["token"])
+        self.worker_id = worker_identity()
+        self.report_state("warming", hostname=socket.gethostname())
+        try:
+            self.start_engine(getattr(settings, "WORKER_WARMUP", {}))
+            self.stdout.write(
+                f"Remote worker {self.worker_id} is claiming jobs from {options['api_url']}"
+            )
+            self.work(options["poll_seconds"], options["max_jobs"])
+        finally:
+            self.report_state("stopped")
+            self.client.close()
+
+    def report_state(self, state, **fields):
+        """
+        WorkerStatus updates are informational, a failed one is logged and the worker goes
+        on (the next one catches up), except for a token the backend refuses.
+        """
+        # the backend stamps ready_at itself
+        fields.pop("ready_at", None)
+        try:
+            self.client.report_state(
+                self.worker_id,
+                state,
+                **{name: value for name, value in fields.items() if value is not None},
+            )
+        except ApiError as e:
+            if e.status_code in (401, 403):
+                raise CommandError(f"The backend refused the worker token: {e.detail}")
+            self.stderr.write(f"Reporting state {state} failed: {e.status_code}")
+        except requests.RequestException as e:
+            self.stderr.write(f"Reporting state {state} failed: {e}")
+
+    def build_engine(self):
+        if self.models == "real":
+            return super().build_engine()
+
+        from helpers.benchmark import build_engine, make_background_image
+
+        # the stub matting session is only built for an engine with a background
+        stub_dir = os.path.join(self.workdir, "stub")
+        os.makedirs(stub_dir, exist_ok=True)
+        background = make_background_image(os.path.join(stub_dir, "background.jpg"))
+        return build_engine({"models": "stub"}, stub_dir, background)
+
+    def work(self, poll_seconds=3, max_jobs=None):
+        done = 0
+        while max_jobs is None or done < max_jobs:
+            try:
+                claim = self.client.claim(self.worker_id, self.max_shared_variants)
+            except (ApiError, requests.RequestException) as e:
+                self.stderr.write(f"Claim failed: {e}")
+                time.sleep(poll_seconds)
+                continue
+
+            jobs = claim["jobs"]
+            if not jobs:
+                time.sleep(poll_seconds)
+                continue
+
+            self.report_state("busy")
+            try:
+                self.run_remote_jobs(jobs, claim["heartbeat_seconds"])
+            finally:
+                self.report_state("ready")
+                self.evict_cache()
+                # checkpoints of jobs that ended up on other workers
+                sweep_directory(
+                    self.checkpoint_root, storage_options()["processing_ttl_hours"]
+                )
+            done += len(jobs)
+
+    def fetch(self, source):
+        """
+        Local path of a staged object ({"key", "url"}), from the cache when this worker
+        fetched it before. Keys are storage names, the same input reused by later jobs or
+        the variants of a batch is only downloaded once.
+        """
+        path = os.path.join(self.cache_dir, *source["key"].split("/"))
+        if not os.path.abspath(path).startswith(os.path.abspath(self.cache_dir) + os.sep):
+            raise ValueError(f"Bad object key {source['key']}")
+        if os.path.exists(path):
+            # mtime is the last use, evict_cache goes by it
+            os.utime(path)
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return self.client.download(source["url"], path)
+
+    def fetch_input(self, source):
+        if source.get("key"):
+            return self.fetch(source)
+        if not source.get("video_url"):
+            raise ValueError("Job has no input video")
+        path = download_youtube(
+            source["video_url"], output_path=os.path.join(self.cache_dir, "downloads")
+        )
+        if not path or not os.path.exists(path):
+            raise ValueError(f"Download of {source['video_url']} failed")
+        return path
+
+    def evict_cache(self):
+        """
+        Delete cached inputs least recently used first while the cache is over cache_mb.
+        """
+        entries = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    entries.append((os.path.getmtime(path), path, os.path.getsize(path)))
+                except OSError:
+                    pass
+        total = sum(size for _, _, size in entries)
+        for _, path, size in sorted(entries):
+            if total <= self.cache_mb * MB:
+                break
+            total -= remove_path(path)
+
+    def fail_remote(self, payload, timer, message):
+        self.stderr.write(message)
+        try:
+            self.client.fail(payload["id"], self.worker_id, message, job_metrics(timer))
+        except (ApiError, requests.RequestException) as e:
+            # the lease expires and the backend requeues the job
+            self.stderr.write(f"Could not report job {payload['id']} as failed: {e}")
+
+    def run_remote_jobs(self, payloads, heartbeat_seconds):
+        """
+        run_jobs of a remote worker: the payloads (api.remote.job_payload) share their
+        input video and render from one decode, like jobs a local worker claims together.
+        Progress goes through each job's RemoteLeaseHeartbeat. Every job checkpoints to
+        its own dir under workdir/checkpoints, kept while the worker holds its lease: when
+        this process dies mid-render and the requeued job comes back to this machine (alone
+        or with other jobs) it resumes, elsewhere it renders from the start. A job that
+        finishes, fails or loses its lease drops its checkpoint. The render's stages are
+        reported with the first job only (GroupTimers), the others with their own uploads.
+        """
+        timers = GroupTimers()
+        timer = timers.group
+        reset_peak_rss()
+        render_dir = os.path.join(
+            self.workdir, "jobs", "_".join(str(payload["id"]) for payload in payloads)
+        )
+        os.makedirs(render_dir, exist_ok=True)
+
+        with ExitStack() as stack:
+            heartbeats = {
+                payload["id"]: stack.enter_context(
+                    RemoteLeaseHeartbeat(
+                        self.client,
+                        payload["id"],
+                        self.worker_id,
+                        heartbeat_seconds,
+                        self.progress_seconds,
+                    )
+                )
+                for payload in payloads
+            }
+
+            def owned(payload):
+                return not heartbeats[payload["id"]].lost.is_set()
+
+            def check_lease():
+                if not any(owned(payload) for payload in rendering):
+                    raise RenderCancelled(
+                        f"Leases on jobs {[payload['id'] for payload in rendering]} lost"
+                    )
+
+            rendering = []
+            variants = {}
+            try:
+                try:
+                    with timer.stage("download"):
+                        input_path = self.fetch_input(payloads[0]["input"])
+                except Exception as e:
+                    for payload in payloads:
+                        self.fail_remote(
+                            payload,
+                            timers.report(payload["id"]),
+                            f"Input unavailable for job {payload['id']}: {e}",
+                        )
+                    return
+
+                engine = self.engine
+                unprepared = []
+                with timer.stage("model_load"):
+                    for payload in payloads:
+                        try:
+                            variant = self.prepare_remote_variant(engine, payload, render_dir)
+                            variant.checkpoint_dir = self.remote_checkpoint_dir(payload)
+                            variants[payload["id"]] = variant
+                            rendering.append(payload)
+                        except Exception as e:
+                            unprepared.append((payload, e))
+                for payload, e in unprepared:
+                    # the group's stages go with a job that renders, if any does
+                    self.fail_remote(
+                        payload,
+                        timers.job(payload["id"]) if rendering else timers.report(payload["id"]),
+                        f"Unable to prepare job {payload['id']}: {e}",
+                    )
+                if not rendering:
+                    return
+
+                def update_progress(percent, frame_index, total_frames):
+                    check_lease()
+                    for payload in rendering:
+                        heartbeats[payload["id"]].progress = max(0, min(100, percent))
+
+                engine.process_variants(
+                    input_path,
+                    [variants[payload["id"]] for payload in rendering],
+                    progress_callback=update_progress,
+                    timer=timer,
+                    checkpoint_dir=self.checkpoint_root,
+                    segment_frames=self.segment_frames,
+                    **rendering[0]["render_options"],
+                )
+
+                for payload in rendering:
+                    if not owned(payload):
+                        self.stderr.write(
+                            f"Lease on job {payload['id']} lost, leaving it to its new owner"
+                        )
+                        continue
+                    try:
+                        self.finish_remote_job(payload, variants[payload["id"]], timers)
+                    except Exception as e:
+                        traceback.print_exc()
+                        self.fail_remote(
+                            payload,
+                            timers.report(payload["id"]),
+                            f"Finishing job {payload['id']} failed: {e}",
+                        )
+
+            except RenderCancelled as e:
+                self.stderr.write(f"{e}, leaving the jobs to their new owners")
+
+            except Exception as e:
+                traceback.print_exc()
+                for payload in rendering:
+                    if owned(payload):
+                        self.fail_remote(
+                            payload,
+                            timers.report(payload["id"]),
+                            f"Render of job {payload['id']} failed: {e}",
+                        )
+
+            finally:
+                # outputs are uploaded (or the job is over for this worker), only the
+                # checkpoint of a render that died with the process is worth keeping
+                shutil.rmtree(render_dir, ignore_errors=True)
+                for payload in payloads:
+                    shutil.rmtree(self.remote_checkpoint_dir(payload), ignore_errors=True)
+
+    def remote_checkpoint_dir(self, payload):
+        return os.path.join(self.checkpoint_root, f"job_{payload['id']}")
+
+    def prepare_remote_variant(self, engine, payload, render_dir):
+        face_paths = [self.fetch(face) for face in payload["faces"]]
+        if not face_paths:
+            raise ValueError("No face images")
+        background_path = self.fetch(payload["background"]) if payload["background"] else None
+        renditions = [
+            {**spec, "path": os.path.join(render_dir, f"{payload['id']}_{spec['name']}.mp4")}
+            for spec in payload["renditions"]
+        ]
+        return engine.load_variant(
+            payload["name"],
+            face_paths,
+            os.path.join(render_dir, f"{payload['id']}.mp4"),
+            background_path=background_path,
+            renditions=renditions,
+        )
+
+    def finish_remote_job(self, payload, variant, timers):
+        if not os.path.exists(variant.output_video):
+            raise ValueError("Render produced no output")
+
+        outputs = payload["outputs"]
+        renditions = []
+        with timers.job(payload["id"]).stage("upload"):
+            self.client.upload(outputs["main"]["url"], variant.output_video)
+            for rendition in variant.renditions:
+                target = outputs.get(rendition["name"])
+                if target is None or not os.path.exists(rendition["path"]):
+                    self.stderr.write(
+                        f"Rendition {rendition['name']} missing for job {payload['id']}"
+                    )
+                    continue
+                self.client.upload(target["url"], rendition["path"])
+                width, height = rendition.get("size", (None, None))
+                renditions.append(
+                    {
+                        "name": rendition["name"],
+                        "key": target["key"],
+                        "width": width,
+                        "height": height,
+                        "bitrate": rendition.get("bitrate"),
+                    }
+                )
+
+        try:
+            self.client.complete(
+                payload["id"],
+                self.worker_id,
+                outputs["main"]["key"],
+                renditions,
+                job_metrics(timers.report(payload["id"])),
+            )
+        except ApiError as e:
+            if e.status_code != 409:
+                raise
+            self.stderr.write(f"Lease on job {payload['id']} lost before it completed")
+            return
+        self.stdout.write(f"Completed job {payload['id']}")
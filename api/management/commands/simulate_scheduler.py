@@ -0,0 +1,101 @@
+import json
+import random
+from django.core.management.base import BaseCommand
+from api.scheduler import SimulatedJob, scheduler_options, simulate, wait_summary
+
+
+def build_workload(jobs, light_clients, heavy_share, long_share, mean_gap, seed):
+    """
+    Poisson arrivals of mostly short clips with a few long videos. One heavy client sends
+    heavy_share of the jobs, the rest is spread over light_clients.
+    Costs are render seconds: ~15s clips take about a minute, 20 minute videos over an hour.
+    """
+    rng = random.Random(seed)
+    workload = []
+    arrival = 0.0
+    for job_id in range(jobs):
+        arrival += rng.expovariate(1 / mean_gap)
+        if rng.random() < heavy_share:
+            client_id = "heavy"
+        else:
+            client_id = f"light-{rng.randrange(light_clients)}"
+        if rng.random() < long_share:
+            cost = rng.uniform(3600, 5400)
+        else:
+            cost = rng.uniform(40, 90)
+        workload.append(SimulatedJob(job_id, arrival, cost, client_id))
+    return workload
+
+
+class Command(BaseCommand):
+    help = "simulate fifo against the cost-aware scheduler on a synthetic workload"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--jobs", type=int, default=400)
+        parser.add_argument("--workers", type=int, default=1)
+        parser.add_argument("--light-clients", type=int, default=8)
+        parser.add_argument("--heavy-share", type=float, default=0.5)
+        parser.add_argument("--long-share", type=float, default=0.05)
+        parser.add_argument(
+            "--mean-gap", type=float, default=360, help="mean seconds between arrivals"
+        )
+        parser.add_argument(
+            "--estimate-noise",
+            type=float,
+            default=0.2,
+            help="relative error of the cost estimate the scheduler sees",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", default=None, help="write the json report here")
+
+    def handle(self, *args, **options):
+        scheduler = scheduler_options()
+
+        report = {"options": scheduler, "policies": {}}
+        for policy in ("fifo", "scheduler"):
+            workload = build_workload(
+                options["jobs"],
+                options["light_clients"],
+                options["heavy_share"],
+                options["long_share"],
+                options["mean_gap"],
+                options["seed"],
+            )
+            long_ids = {job.id for job in workload if job.estimated_cost >= 3600}
+            waits = simulate(
+                workload,
+                options["workers"],
+                policy,
+                scheduler,
+                estimate_noise=options["estimate_noise"],
+                seed=options["seed"],
+            )
+            light_waits = {
+                client: values for client, values in waits.items() if client != "heavy"
+            }
+            by_length = {"short": [], "long": []}
+            for job in workload:
+                length = "long" if job.id in long_ids else "short"
+                by_length[length].append(job.started - job.arrival)
+            report["policies"][policy] = {
+                "all": wait_summary(waits),
+                "short_jobs": wait_summary({"short": by_length["short"]}),
+                "long_jobs": wait_summary({"long": by_length["long"]}),
+                "heavy": wait_summary({"heavy": waits.get("heavy", [])}),
+                "light": wait_summary(light_waits),
+                "per_client": {
+                    client: wait_summary({client: values})
+                    for client, values in sorted(waits.items())
+                },
+            }
+            summary = report["policies"][policy]["short_jobs"]
+            self.stderr.write(
+                f"{policy}: short jobs wait mean {summary['mean_wait_s']}s, "
+                f"p95 {summary['p95_wait_s']}s"
+            )
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
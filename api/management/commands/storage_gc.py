@@ -0,0 +1,46 @@
+import json
+from django.core.management.base import BaseCommand
+from api.storage import collect_garbage, storage_options, storage_report
+
+
+class Command(BaseCommand):
+    help = (
+        "report media disk usage and reclaim it: stale processing files and downloads, "
+        "uploaded local copies past retention, least recently used inputs over budget"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--report", action="store_true", help="only report usage, delete nothing"
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="report what would be reclaimed"
+        )
+        parser.add_argument("--inputs-budget-mb", type=float, default=None)
+        parser.add_argument("--min-free-mb", type=float, default=None)
+        parser.add_argument("--retention-hours", type=float, default=None)
+
+    def handle(self, *args, **options):
+        before = storage_report()
+        result = {"before": before}
+
+        if not options["report"]:
+            gc_options = storage_options()
+            if options["inputs_budget_mb"] is not None:
+                gc_options["inputs_budget_mb"] = options["inputs_budget_mb"]
+            if options["min_free_mb"] is not None:
+                gc_options["min_free_mb"] = options["min_free_mb"]
+            if options["retention_hours"] is not None:
+                gc_options["local_copy_retention_hours"] = options["retention_hours"]
+
+            reclaimed = collect_garbage(gc_options, dry_run=options["dry_run"])
+            result["reclaimed"] = reclaimed
+            result["dry_run"] = options["dry_run"]
+            if not options["dry_run"]:
+                result["after"] = storage_report()
+            self.stderr.write(
+                f"{'Would reclaim' if options['dry_run'] else 'Reclaimed'} "
+                f"{sum(entry['mb'] for entry in reclaimed.values()):.1f} MB"
+            )
+
+        self.stdout.write(json.dumps(result, indent=2))
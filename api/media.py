@@ -0,0 +1,168 @@
+import os
+import re
+import mimetypes
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class FileRange:
+    """
+    File-like over length bytes of file from start. read() stops at the end of the range,
+    fileno() lets gunicorn sendfile() it (it sends Content-Length bytes from the current
+    offset), so a range is served by the kernel instead of a Python read loop.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b""
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive of a single "bytes=" range, None for a header to ignore (the
+    whole file is sent) and "unsatisfiable" when no byte of the range is in the file.
+    Multi-range requests get the whole file, players only ask for one.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # the last n bytes
+        length = int(last)
+        if length == 0:
+            return "unsatisfiable"
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        return "unsatisfiable"
+    if end < start:
+        return None
+    return start, end
+
+
+def file_etag(stat):
+    return f'"{int(stat.st_mtime_ns):x}-{stat.st_size:x}"'
+
+
+def range_applies(request, etag, last_modified):
+    """
+    If-Range: the range only holds if the client's copy (by strong etag or date) is current.
+    """
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    date = parse_http_date_safe(if_range)
+    return date is not None and int(last_modified) <= date
+
+
+def public_media_path(path):
+    """
+    Absolute path of a servable media file, Http404 for anything outside
+    MEDIA_PUBLIC_DIRS (work directories, face indexes, downloads) or missing.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("Not found")
+    # checked on the resolved path, "output_videos/../processing/..." is not public
+    top_dir = os.path.relpath(full_path, settings.MEDIA_ROOT).split(os.sep, 1)[0]
+    public_dirs = getattr(settings, "MEDIA_PUBLIC_DIRS", None)
+    if public_dirs is not None and top_dir not in public_dirs:
+        raise Http404("Not found")
+    if not os.path.isfile(full_path):
+        raise Http404("Not found")
+    return full_path
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Media files with byte ranges (206 / 416), ETag and Last-Modified validators (304 /
+    412) and a Cache-Control max-age, so players seek without downloading the whole video.
+    With MEDIA_SENDFILE set the response is handed to the front proxy instead
+    ("x-accel-redirect" for nginx under MEDIA_ACCEL_PREFIX, "x-sendfile" for apache or
+    lighttpd), which then serves ranges itself and no Python worker is held for the
+    download.
+    """
+    full_path = public_media_path(path)
+    stat = os.stat(full_path)
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or "application/octet-stream"
+    max_age = getattr(settings, "MEDIA_MAX_AGE", 3600)
+
+    sendfile = getattr(settings, "MEDIA_SENDFILE", None)
+    if sendfile:
+        response = HttpResponse(content_type=content_type)
+        if sendfile == "x-accel-redirect":
+            prefix = getattr(settings, "MEDIA_ACCEL_PREFIX", "/protected-media/")
+            # nginx decodes the uri, a raw space, "?" or non ascii name would break it
+            response["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + quote(path)
+        else:
+            response["X-Sendfile"] = full_path
+        response["Cache-Control"] = f"public, max-age={max_age}"
+        return response
+
+    etag = file_etag(stat)
+    last_modified = stat.st_mtime
+    conditional = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if conditional is not None:
+        conditional["Accept-Ranges"] = "bytes"
+        return conditional
+
+    size = stat.st_size
+    byte_range = None
+    if "Range" in request.headers and range_applies(request, etag, last_modified):
+        byte_range = parse_range(request.headers["Range"], size)
+
+    if byte_range == "unsatisfiable":
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+    else:
+        start, end = byte_range or (0, size - 1)
+        length = max(end - start + 1, 0)
+        response = FileResponse(
+            FileRange(open(full_path, "rb"), start, length), content_type=content_type
+        )
+        response["Content-Length"] = str(length)
+        if byte_range:
+            response.status_code = 206
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    if encoding:
+        response["Content-Encoding"] = encoding
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = f"public, max-age={max_age}"
+    return response
@@ -0,0 +1,138 @@
+from django.db.models import Count
+
+from helpers.profiling import COUNT_BUCKETS, STAGE_BUCKETS
+from .models import MetricsRollup, OutputVideo, WorkerStatus
+from .workers import live_workers
+
+PEAK_RSS_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384)
+ROLLUP_NAME = "jobs"
+
+
+def _format_bound(bound):
+    return f"{bound:g}"
+
+
+def _merge_histogram(total, hist, bucket_count, sign=1):
+    if not hist or len(hist.get("buckets", ())) != bucket_count:
+        return
+    for index, value in enumerate(hist["buckets"]):
+        total["buckets"][index] += sign * value
+    total["sum"] += sign * hist["sum"]
+    total["count"] += sign * hist["count"]
+
+
+def _empty_histogram(buckets):
+    return {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+
+
+def empty_totals():
+    return {
+        "stages": {},
+        "faces_per_frame": _empty_histogram(COUNT_BUCKETS),
+        "peak_rss_mb": _empty_histogram(PEAK_RSS_BUCKETS),
+        "frames_processed": 0,
+        "frame_paths": {},
+    }
+
+
+def add_job_metrics(totals, metrics, sign=1):
+    """
+    Add one job's JobMetrics fields to totals (empty_totals()), or take them back out with
+    sign=-1 when the job's row is replaced.
+    """
+    for stage, hist in (metrics.get("stage_histograms") or {}).items():
+        total = totals["stages"].setdefault(stage, _empty_histogram(STAGE_BUCKETS))
+        _merge_histogram(total, hist, len(STAGE_BUCKETS), sign)
+    _merge_histogram(
+        totals["faces_per_frame"], metrics.get("faces_per_frame"), len(COUNT_BUCKETS), sign
+    )
+    totals["frames_processed"] += sign * (metrics.get("frames_processed") or 0)
+    for path, count in (metrics.get("frame_paths") or {}).items():
+        totals["frame_paths"][path] = totals["frame_paths"].get(path, 0) + sign * count
+    rss = metrics.get("peak_rss_mb")
+    if rss is not None:
+        peak_rss = totals["peak_rss_mb"]
+        for index, bound in enumerate(PEAK_RSS_BUCKETS):
+            if rss <= bound:
+                peak_rss["buckets"][index] += sign
+        peak_rss["sum"] += sign * rss
+        peak_rss["count"] += sign
+    return totals
+
+
+def _histogram_lines(name, hist, buckets, labels=""):
+    prefix = f"{labels}," if labels else ""
+    lines = []
+    for bound, value in zip(buckets, hist["buckets"]):
+        lines.append(f'{name}_bucket{{{prefix}le="{_format_bound(bound)}"}} {value}')
+    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {hist["count"]}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {hist['sum']:.6f}")
+    lines.append(f"{name}_count{suffix} {hist['count']}")
+    return lines
+
+
+def render_prometheus_metrics():
+    """
+    The JobMetrics totals of every job (all workers write to the same database, and to
+    its MetricsRollup) in the prometheus text exposition format.
+    """
+    rollup = MetricsRollup.objects.filter(name=ROLLUP_NAME).first()
+    totals = rollup.totals if rollup else empty_totals()
+    stages = totals["stages"]
+    faces = totals["faces_per_frame"]
+    peak_rss = totals["peak_rss_mb"]
+    frames_total = totals["frames_processed"]
+    frame_paths = totals["frame_paths"]
+
+    lines = [
+        "# HELP magic_roll_job_stage_seconds Time spent per job stage, per frame for frame stages.",
+        "# TYPE magic_roll_job_stage_seconds histogram",
+    ]
+    for stage in sorted(stages):
+        lines += _histogram_lines(
+            "magic_roll_job_stage_seconds", stages[stage], STAGE_BUCKETS, f'stage="{stage}"'
+        )
+
+    lines += [
+        "# HELP magic_roll_job_faces_per_frame Faces detected per processed frame.",
+        "# TYPE magic_roll_job_faces_per_frame histogram",
+    ]
+    lines += _histogram_lines("magic_roll_job_faces_per_frame", faces, COUNT_BUCKETS)
+
+    lines += [
+        "# HELP magic_roll_job_peak_rss_megabytes Peak worker RSS per job.",
+        "# TYPE magic_roll_job_peak_rss_megabytes histogram",
+    ]
+    lines += _histogram_lines("magic_roll_job_peak_rss_megabytes", peak_rss, PEAK_RSS_BUCKETS)
+
+    lines += [
+        "# HELP magic_roll_frames_processed_total Frames rendered across all jobs.",
+        "# TYPE magic_roll_frames_processed_total counter",
+        f"magic_roll_frames_processed_total {frames_total}",
+        "# HELP magic_roll_frames_by_path_total Frames by engine path (static, no_faces, swapped).",
+        "# TYPE magic_roll_frames_by_path_total counter",
+    ]
+    for path in sorted(frame_paths):
+        lines.append(f'magic_roll_frames_by_path_total{{path="{path}"}} {frame_paths[path]}')
+
+    lines += [
+        "# HELP magic_roll_jobs Jobs by status.",
+        "# TYPE magic_roll_jobs gauge",
+    ]
+    counts = dict(
+        OutputVideo.objects.values_list("status").annotate(total=Count("id")).order_by()
+    )
+    for status, _ in OutputVideo.STATUS_CHOICES:
+        lines.append(f'magic_roll_jobs{{status="{status}"}} {counts.get(status, 0)}')
+
+    lines += [
+        "# HELP magic_roll_workers Live workers by state, warming workers aren't taking jobs yet.",
+        "# TYPE magic_roll_workers gauge",
+    ]
+    workers = dict(live_workers().values_list("state").annotate(total=Count("id")).order_by())
+    for state, _ in WorkerStatus.STATE_CHOICES:
+        if state != "stopped":
+            lines.append(f'magic_roll_workers{{state="{state}"}} {workers.get(state, 0)}')
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.db import connections
+
+
+class QueryCounter:
+    """
+    execute_wrapper counting the queries (and their seconds) run through a connection.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class QueryCountMiddleware:
+    """
+    With QUERY_COUNT_HEADER set, every response carries the number of database queries
+    its request ran (X-DB-Queries) and their time (X-DB-Time-Ms). `load_test_api`
+    reports them per endpoint.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, "QUERY_COUNT_HEADER", False):
+            return self.get_response(request)
+
+        counter = QueryCounter()
+        with connections["default"].execute_wrapper(counter):
+            response = self.get_response(request)
+        response["X-DB-Queries"] = str(counter.count)
+        response["X-DB-Time-Ms"] = f"{counter.seconds * 1000:.2f}"
+        return response
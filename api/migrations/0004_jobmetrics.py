@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_remove_outputvideo_background_changed_video_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobMetrics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage_timings', models.JSONField(default=dict)),
+                ('stage_histograms', models.JSONField(default=dict)),
+                ('frames_processed', models.IntegerField(default=0)),
+                ('faces_per_frame', models.JSONField(default=dict)),
+                ('peak_rss_mb', models.FloatField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('output_video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='metrics', to='api.outputvideo')),
+            ],
+        ),
+    ]
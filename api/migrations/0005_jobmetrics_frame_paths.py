@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_jobmetrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobmetrics',
+            name='frame_paths',
+            field=models.JSONField(default=dict),
+        ),
+    ]
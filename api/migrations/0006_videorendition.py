@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_jobmetrics_frame_paths'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('width', models.IntegerField(blank=True, null=True)),
+                ('height', models.IntegerField(blank=True, null=True)),
+                ('bitrate', models.CharField(blank=True, max_length=20, null=True)),
+                ('video_file', models.FileField(blank=True, null=True, upload_to='renditions/')),
+                ('video_url', models.URLField(blank=True, max_length=500, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('output_video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='api.outputvideo')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_videorendition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outputvideo',
+            name='job_type',
+            field=models.CharField(choices=[('render', 'Render'), ('preview', 'Preview')], default='render', max_length=20),
+        ),
+    ]
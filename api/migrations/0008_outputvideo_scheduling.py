@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_outputvideo_job_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outputvideo',
+            name='client_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='outputvideo',
+            name='estimated_cost',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='outputvideo',
+            name='priority',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='outputvideo',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
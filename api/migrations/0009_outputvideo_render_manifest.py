@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_outputvideo_scheduling'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outputvideo',
+            name='render_manifest',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
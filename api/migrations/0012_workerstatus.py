@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_jobbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkerStatus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('worker_id', models.CharField(max_length=100, unique=True)),
+                ('hostname', models.CharField(max_length=255)),
+                ('state', models.CharField(choices=[('warming', 'Warming up'), ('ready', 'Ready'), ('busy', 'Busy'), ('stopped', 'Stopped')], default='warming', max_length=20)),
+                ('load_seconds', models.FloatField(blank=True, null=True)),
+                ('warmup_seconds', models.FloatField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('ready_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
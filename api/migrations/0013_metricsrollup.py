@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:50
+
+from django.db import migrations, models
+
+
+# the histogram bounds and totals layout of api.metrics when the rollup was introduced,
+# frozen here so later changes to that module don't change what this migration writes
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 12, 20)
+PEAK_RSS_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+def empty_histogram(buckets):
+    return {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+
+
+def merge_histogram(total, hist, bucket_count):
+    if not hist or len(hist.get('buckets', ())) != bucket_count:
+        return
+    for index, value in enumerate(hist['buckets']):
+        total['buckets'][index] += value
+    total['sum'] += hist['sum']
+    total['count'] += hist['count']
+
+
+def backfill_rollup(apps, schema_editor):
+    JobMetrics = apps.get_model('api', 'JobMetrics')
+    MetricsRollup = apps.get_model('api', 'MetricsRollup')
+    totals = {
+        'stages': {},
+        'faces_per_frame': empty_histogram(COUNT_BUCKETS),
+        'peak_rss_mb': empty_histogram(PEAK_RSS_BUCKETS),
+        'frames_processed': 0,
+        'frame_paths': {},
+    }
+    fields = ('stage_histograms', 'faces_per_frame', 'frames_processed', 'frame_paths', 'peak_rss_mb')
+    for metrics in JobMetrics.objects.values(*fields).iterator():
+        for stage, hist in (metrics['stage_histograms'] or {}).items():
+            total = totals['stages'].setdefault(stage, empty_histogram(STAGE_BUCKETS))
+            merge_histogram(total, hist, len(STAGE_BUCKETS))
+        merge_histogram(totals['faces_per_frame'], metrics['faces_per_frame'], len(COUNT_BUCKETS))
+        totals['frames_processed'] += metrics['frames_processed'] or 0
+        for path, count in (metrics['frame_paths'] or {}).items():
+            totals['frame_paths'][path] = totals['frame_paths'].get(path, 0) + count
+        rss = metrics['peak_rss_mb']
+        if rss is not None:
+            peak_rss = totals['peak_rss_mb']
+            for index, bound in enumerate(PEAK_RSS_BUCKETS):
+                if rss <= bound:
+                    peak_rss['buckets'][index] += 1
+            peak_rss['sum'] += rss
+            peak_rss['count'] += 1
+    MetricsRollup.objects.create(name='jobs', totals=totals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_workerstatus'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('totals', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_rollup, migrations.RunPython.noop),
+    ]
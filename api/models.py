@@ -15,6 +15,15 @@ class VideoData(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
 
+class JobBatch(models.Model):
+    """
+    Jobs submitted together: one input video rendered against many face sets.
+    """
+
+    client_id = models.CharField(max_length=100, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
 class OutputVideo(models.Model):
     STATUS_CHOICES = [
         ("queued", "Queued"),
@@ -23,14 +32,99 @@ class OutputVideo(models.Model):
         ("completed", "Completed"),
         ("failed", "Failed"),
     ]
+    JOB_TYPE_CHOICES = [
+        ("render", "Render"),
+        ("preview", "Preview"),
+    ]
     video_data = models.ForeignKey(
         VideoData, on_delete=models.CASCADE, related_name="output_videos"
     )
+    batch = models.ForeignKey(
+        JobBatch, null=True, blank=True, on_delete=models.SET_NULL, related_name="jobs"
+    )
     audio_extracted = models.FileField(
         upload_to="extracted_audios/", null=True, blank=True
     )
     final_video = models.FileField(upload_to="output_videos/", null=True, blank=True)
     final_video_url = models.URLField(max_length=500, null=True, blank=True)
     status = models.CharField(max_length=50, default="queued", choices=STATUS_CHOICES)
+    job_type = models.CharField(max_length=20, default="render", choices=JOB_TYPE_CHOICES)
     progress = models.IntegerField(default=0)
+    priority = models.IntegerField(default=0)
+    # estimated render seconds from a probe of the input, see api.scheduler
+    estimated_cost = models.FloatField(null=True, blank=True)
+    client_id = models.CharField(max_length=100, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # lease of the worker rendering the job, renewed by its heartbeat (see api.leases)
+    worker_id = models.CharField(max_length=100, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    # times the job was claimed, and when a requeued job may run again
+    attempts = models.IntegerField(default=0)
+    retry_at = models.DateTimeField(null=True, blank=True)
+    # segments of a checkpointed render committed so far: {settings, segments: [...]}
+    render_manifest = models.JSONField(null=True, blank=True)
+
+
+class VideoRendition(models.Model):
+    output_video = models.ForeignKey(
+        OutputVideo, on_delete=models.CASCADE, related_name="renditions"
+    )
+    name = models.CharField(max_length=50)
+    width = models.IntegerField(null=True, blank=True)
+    height = models.IntegerField(null=True, blank=True)
+    bitrate = models.CharField(max_length=20, null=True, blank=True)
+    video_file = models.FileField(upload_to="renditions/", null=True, blank=True)
+    video_url = models.URLField(max_length=500, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+
+class JobMetrics(models.Model):
+    output_video = models.OneToOneField(
+        OutputVideo, on_delete=models.CASCADE, related_name="metrics"
+    )
+    # {stage: {count, total_s, mean_ms, p95_ms}}
+    stage_timings = models.JSONField(default=dict)
+    # {stage: {buckets, sum, count}} cumulative counts over STAGE_BUCKETS
+    stage_histograms = models.JSONField(default=dict)
+    frames_processed = models.IntegerField(default=0)
+    faces_per_frame = models.JSONField(default=dict)
+    # frames per path through the engine: {"static": n, "no_faces": n, "swapped": n}
+    frame_paths = models.JSONField(default=dict)
+    peak_rss_mb = models.FloatField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class MetricsRollup(models.Model):
+    """
+    Running totals of every job's JobMetrics (api.metrics.add_job_metrics), updated with
+    each row store_job_metrics writes, so /metrics reads one row however long the history.
+    """
+
+    name = models.CharField(max_length=50, unique=True)
+    # {stages: {stage: histogram}, faces_per_frame, peak_rss_mb, frames_processed, frame_paths}
+    totals = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class WorkerStatus(models.Model):
+    """
+    One row per background_queue process: its state and last heartbeat, so the scheduler
+    and orchestration can tell which workers are up and ready to take jobs.
+    """
+
+    STATE_CHOICES = [
+        ("warming", "Warming up"),
+        ("ready", "Ready"),
+        ("busy", "Busy"),
+        ("stopped", "Stopped"),
+    ]
+    worker_id = models.CharField(max_length=100, unique=True)
+    hostname = models.CharField(max_length=255)
+    state = models.CharField(max_length=20, default="warming", choices=STATE_CHOICES)
+    # model load and warm-up seconds at start
+    load_seconds = models.FloatField(null=True, blank=True)
+    warmup_seconds = models.FloatField(null=True, blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    ready_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
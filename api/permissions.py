@@ -0,0 +1,21 @@
+import hmac
+
+from django.conf import settings
+from rest_framework.permissions import BasePermission
+
+
+class WorkerTokenPermission(BasePermission):
+    """
+    Remote workers authenticate with "Authorization: Bearer <token>", one of WORKER_API_TOKENS.
+    """
+
+    message = "A valid worker token is required"
+
+    def has_permission(self, request, view):
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return False
+        return any(
+            hmac.compare_digest(token.encode(), allowed.encode())
+            for allowed in getattr(settings, "WORKER_API_TOKENS", [])
+        )
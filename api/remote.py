@@ -0,0 +1,275 @@
+import os
+import uuid
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .leases import lease_expiry, lease_options, reap_expired_jobs, release_lease
+from .models import OutputVideo, VideoData, VideoRendition, WorkerStatus
+from .scheduler import claim_shared_jobs, pick_next_job
+from .services import store_job_metrics
+from .workers import register_worker, set_worker_state
+
+log = logging.getLogger("RemoteWorkers")
+
+DEFAULT_REMOTE_OPTIONS = {
+    # lifetime of the presigned input and output urls handed to remote workers
+    "presign_seconds": 6 * 3600,
+    # object key prefix of the inputs (videos, faces, backgrounds) staged for them
+    "input_prefix": "inputs/",
+    # upload new inputs to the bucket right after the upload instead of in the claim
+    "stage_on_upload": True,
+}
+
+
+def remote_options():
+    options = dict(DEFAULT_REMOTE_OPTIONS)
+    options.update(getattr(settings, "REMOTE_WORKER_OPTIONS", {}))
+    return options
+
+
+def bucket():
+    return os.getenv("CLOUDFLARE_BUCKET_NAME")
+
+
+def upload_input(field_file, options):
+    """
+    Object key of a stored file, uploading it on first use. Keys follow the storage name,
+    so the variants of a batch sharing a file share the object.
+    """
+    from helpers.cloudflare_CRUD import object_exists, upload_file
+
+    key = options["input_prefix"] + field_file.name
+    if not object_exists(bucket(), key):
+        upload_file(field_file.path, bucket(), key)
+    return key
+
+
+def stage_file(field_file, options):
+    """
+    Object key and presigned GET url of a stored file, see upload_input.
+    """
+    from helpers.cloudflare_CRUD import presigned_url
+
+    key = upload_input(field_file, options)
+    return {
+        "key": key,
+        "url": presigned_url(bucket(), key, "get_object", options["presign_seconds"]),
+    }
+
+
+def output_target(key, options):
+    from helpers.cloudflare_CRUD import presigned_url
+
+    return {
+        "key": key,
+        "url": presigned_url(bucket(), key, "put_object", options["presign_seconds"]),
+    }
+
+
+def stage_uploads(video_ids, options=None):
+    """
+    Upload the input video, faces and background of new uploads to the bucket, so the
+    claim that hands their jobs to a remote worker only presigns them. A file that fails
+    here is logged and left to the claim, which uploads what is missing.
+    """
+    options = options or remote_options()
+    staged = set()
+    videos = VideoData.objects.filter(pk__in=video_ids).prefetch_related("face_images")
+    for video_data in videos:
+        files = [face.image_file for face in video_data.face_images.all()]
+        for field_file in (video_data.video_file, video_data.background_image):
+            if field_file and os.path.exists(field_file.path):
+                files.append(field_file)
+        for field_file in files:
+            if field_file.name in staged:
+                continue
+            try:
+                upload_input(field_file, options)
+            except Exception:
+                log.exception("Staging %s for remote workers failed", field_file.name)
+            staged.add(field_file.name)
+
+
+def stage_uploads_later(video_ids):
+    """
+    Run stage_uploads in a thread once the upload's transaction commits, when remote
+    workers are configured (WORKER_API_TOKENS) and stage_on_upload is set. The upload
+    request doesn't wait for the bucket.
+    """
+    options = remote_options()
+    if not (getattr(settings, "WORKER_API_TOKENS", None) and options["stage_on_upload"]):
+        return None
+
+    def run():
+        try:
+            stage_uploads(video_ids, options)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=run, name="stage-uploads", daemon=True)
+    transaction.on_commit(thread.start)
+    return thread
+
+
+def job_payload(job, name, options=None):
+    """
+    Everything a remote worker needs to render one claimed job without the database or
+    MEDIA_ROOT: presigned urls of its input (or the url to download), faces and background,
+    presigned upload urls for its outputs (same object layout as local workers), and the
+    render options and renditions of its type.
+    """
+    options = options or remote_options()
+    video_data = job.video_data
+    is_preview = job.job_type == "preview"
+
+    if video_data.video_file and os.path.exists(video_data.video_file.path):
+        source = stage_file(video_data.video_file, options)
+    else:
+        source = {"video_url": video_data.video_url}
+
+    job_uuid = str(uuid.uuid4())
+    renditions = [] if is_preview else getattr(settings, "VIDEO_RENDITIONS", [])
+    return {
+        "id": job.id,
+        "name": name,
+        "job_type": job.job_type,
+        "video_data_id": video_data.id,
+        "input": source,
+        "faces": [stage_file(face.image_file, options) for face in video_data.face_images.all()],
+        "background": (
+            stage_file(video_data.background_image, options)
+            if video_data.background_image
+            and os.path.exists(video_data.background_image.path)
+            else None
+        ),
+        "render_options": (
+            dict(getattr(settings, "PREVIEW_OPTIONS", {})) if is_preview else {}
+        ),
+        "outputs": {
+            "main": output_target(f"{job_uuid}/{job_uuid}.mp4", options),
+            **{
+                spec["name"]: output_target(f"{job_uuid}/{job_uuid}_{spec['name']}.mp4", options)
+                for spec in renditions
+            },
+        },
+        "renditions": renditions,
+    }
+
+
+def claim_remote_jobs(worker_id, limit):
+    """
+    Claim the next job (and up to limit - 1 jobs sharing its input) for a remote worker
+    and build their payloads. Remote-only deployments have no local worker to reap
+    expired leases, so claims do it first. Inputs stage_uploads hasn't staged yet are
+    uploaded here, and the leases restart once the payloads are built.
+    """
+    reap_expired_jobs()
+    touch_worker(worker_id)
+    job = pick_next_job(worker_id)
+    if job is None:
+        return []
+    jobs = claim_shared_jobs(job, worker_id, limit)
+    options = remote_options()
+    try:
+        payloads = [
+            job_payload(claimed, None if len(jobs) == 1 else f"job{claimed.id}", options)
+            for claimed in jobs
+        ]
+    except Exception:
+        # inputs couldn't be staged, give every claimed job back (the worker gets none of
+        # them) instead of holding them until their leases expire
+        OutputVideo.objects.filter(
+            pk__in=[claimed.pk for claimed in jobs], status="processing", worker_id=worker_id
+        ).update(status="queued", worker_id=None, lease_expires_at=None)
+        raise
+
+    # inputs the upload didn't stage yet were uploaded above, the worker's lease starts now
+    OutputVideo.objects.filter(
+        pk__in=[claimed.pk for claimed in jobs], status="processing", worker_id=worker_id
+    ).update(lease_expires_at=lease_expiry())
+    return payloads
+
+
+def touch_worker(worker_id):
+    WorkerStatus.objects.filter(worker_id=worker_id).update(heartbeat_at=timezone.now())
+
+
+def report_progress(job_id, worker_id, progress=None):
+    """
+    Heartbeat of a remote worker for one job: renews the lease and stores the progress.
+    False when the lease is gone (the job was reaped and may belong to another worker).
+    """
+    fields = {"lease_expires_at": lease_expiry()}
+    if progress is not None:
+        fields["progress"] = max(0, min(100, int(progress)))
+    renewed = OutputVideo.objects.filter(
+        pk=job_id, status="processing", worker_id=worker_id
+    ).update(**fields)
+    touch_worker(worker_id)
+    return bool(renewed)
+
+
+def complete_remote_job(job_id, worker_id, final_key, renditions=(), metrics=None):
+    """
+    Mark a job a remote worker rendered and uploaded as completed, with its public urls.
+    False (and no change) when the worker no longer holds the job.
+    """
+    from helpers.cloudflare_CRUD import public_url
+
+    with transaction.atomic():
+        completed = OutputVideo.objects.filter(
+            pk=job_id, status="processing", worker_id=worker_id
+        ).update(status="completed", progress=100, final_video_url=public_url(final_key))
+        if not completed:
+            return False
+        job = OutputVideo.objects.get(pk=job_id)
+        VideoRendition.objects.bulk_create(
+            [
+                VideoRendition(
+                    output_video=job,
+                    name=rendition["name"],
+                    width=rendition.get("width"),
+                    height=rendition.get("height"),
+                    bitrate=rendition.get("bitrate"),
+                    video_url=public_url(rendition["key"]),
+                )
+                for rendition in renditions
+            ]
+        )
+        if metrics:
+            store_job_metrics(job, metrics)
+    release_lease(job_id, worker_id)
+    return True
+
+
+def fail_remote_job(job_id, worker_id, error="", metrics=None):
+    failed = OutputVideo.objects.filter(
+        pk=job_id, status="processing", worker_id=worker_id
+    ).update(status="failed", progress=0)
+    if failed:
+        log.warning("Remote worker %s failed job %s: %s", worker_id, job_id, error)
+    if failed and metrics:
+        store_job_metrics(OutputVideo.objects.get(pk=job_id), metrics)
+    release_lease(job_id, worker_id)
+    return bool(failed)
+
+
+def report_worker_state(worker_id, state, hostname=None, **fields):
+    """
+    WorkerStatus of a remote worker: warming registers it, ready records its load and
+    warm-up times, the rest are state changes like the ones a local worker makes.
+    """
+    if state == "warming":
+        register_worker(worker_id, hostname)
+        return
+    if state == "ready" and fields:
+        fields["ready_at"] = timezone.now()
+    set_worker_state(worker_id, state, **fields)
+
+
+def heartbeat_seconds():
+    return lease_options()["heartbeat_seconds"]
@@ -0,0 +1,304 @@
+import heapq
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from helpers.probe import probe_video
+from .models import OutputVideo
+from .leases import claim_job
+
+DEFAULT_SCHEDULER_OPTIONS = {
+    # megapixel-frames a worker renders per second, turns a probe into estimated seconds
+    "throughput": 2.0,
+    # background replacement (matting + blend) multiplies the per frame cost
+    "background_factor": 2.5,
+    # seconds of estimated work forgiven per second waited: a job of cost C goes before
+    # every job arriving more than C / aging_rate after it, so a 1 h render waits at most
+    # ~2 h for the short jobs that keep arriving (0.1 made that 10 h)
+    "aging_rate": 0.5,
+    # jobs queued longer than this go before everything else, oldest first, a hard bound
+    # on waits that turns into fifo when the queue stays this far behind (None: off)
+    "max_wait_seconds": None,
+    # queued jobs scored per claim: this many oldest plus this many cheapest
+    "candidate_limit": 100,
+    # each priority level divides the effective cost by this
+    "priority_weight": 2.0,
+    # seconds added per second of work a client already ran inside the window
+    "fairness_weight": 0.5,
+    "fairness_window": 3600,
+    # processing jobs a single client may hold at once across all workers
+    "max_active_per_client": 2,
+    # estimated seconds for jobs that can't be probed yet (url jobs before download)
+    "default_cost": 60.0,
+}
+
+
+def scheduler_options():
+    options = dict(DEFAULT_SCHEDULER_OPTIONS)
+    options.update(getattr(settings, "SCHEDULER_OPTIONS", {}))
+    return options
+
+
+def estimate_cost(frame_count, width, height, background=False, options=None):
+    """
+    Estimated render seconds of a job: frames x megapixels, scaled for background replacement.
+    """
+    options = options or scheduler_options()
+    cost = frame_count * (width * height / 1e6) / options["throughput"]
+    if background:
+        cost *= options["background_factor"]
+    return cost
+
+
+def probe_input(video_data):
+    """
+    Probe of the job's local input video, None if there is no readable file yet.
+    """
+    if not video_data.video_file:
+        return None
+    try:
+        info = probe_video(video_data.video_file.path)
+    except Exception:
+        info = None
+    if not info or info["frame_count"] <= 0:
+        return None
+    return info
+
+
+def estimate_probed_cost(info, job_type="render", background=False, options=None):
+    """
+    Estimated render seconds of a job from the probe of its input, None without a probe.
+    Previews only render PREVIEW_OPTIONS' excerpt so their estimate is scaled down.
+    """
+    if info is None:
+        return None
+
+    frame_count, width, height = info["frame_count"], info["width"], info["height"]
+    if job_type == "preview":
+        preview = getattr(settings, "PREVIEW_OPTIONS", {})
+        if preview.get("max_seconds") and info["fps"] > 0:
+            frame_count = min(frame_count, int(preview["max_seconds"] * info["fps"]))
+        frame_count //= max(1, preview.get("frame_step", 1))
+        max_height = preview.get("max_height")
+        if max_height and max_height < height:
+            width, height = width * max_height / height, max_height
+
+    return estimate_cost(frame_count, width, height, background, options)
+
+
+def estimate_job_cost(video_data, job_type="render", options=None):
+    """
+    Probe the job's input and estimate its render seconds, None if there is no local file yet.
+    """
+    return estimate_probed_cost(
+        probe_input(video_data), job_type, bool(video_data.background_image), options
+    )
+
+
+def job_score(cost, priority, wait_seconds, client_usage, options):
+    """
+    Lower runs first: shortest job first, with aging, priority and per client fair share.
+    """
+    if cost is None:
+        cost = options["default_cost"]
+    effective_cost = cost / (options["priority_weight"] ** priority)
+    return (
+        effective_cost
+        + options["fairness_weight"] * client_usage
+        - options["aging_rate"] * wait_seconds
+    )
+
+
+def choose_job(candidates, client_usage, client_active, options):
+    """
+    candidates is a list of (job, wait_seconds) where job has estimated_cost, priority
+    and client_id. Jobs waiting past max_wait_seconds go first, oldest first. Jobs of
+    clients at their active quota go after everyone else's, so they only run when a worker
+    would otherwise sit idle.
+    Returns the candidates ordered best first.
+    """
+    max_wait = options.get("max_wait_seconds")
+
+    def key(pair):
+        job, wait = pair
+        over_quota = client_active.get(job.client_id, 0) >= options["max_active_per_client"]
+        if max_wait is not None and wait >= max_wait:
+            return over_quota, 0, -wait
+        score = job_score(
+            job.estimated_cost,
+            job.priority,
+            wait,
+            client_usage.get(job.client_id, 0.0),
+            options,
+        )
+        return over_quota, 1, score
+
+    return [job for job, wait in sorted(candidates, key=key)]
+
+
+def pick_next_job(worker_id, now=None):
+    """
+    Claim the best queued job for this worker, or return None when nothing is runnable.
+    The claim is a conditional update so two workers never start the same job, and it
+    gives worker_id a lease on the job (see api.leases).
+    Only the candidate_limit oldest and the candidate_limit cheapest (after priority) queued
+    jobs are scored, the best job by job_score is among them unless client usage outweighs
+    both its cost and its wait.
+    """
+    options = scheduler_options()
+    now = now or timezone.now()
+
+    runnable = (
+        OutputVideo.objects.filter(status="queued")
+        .filter(Q(retry_at__isnull=True) | Q(retry_at__lte=now))
+        .only("id", "priority", "estimated_cost", "client_id", "created_at")
+    )
+    limit = options["candidate_limit"]
+    queued = {job.pk: job for job in runnable.order_by("created_at")[:limit]}
+    for job in runnable.order_by(
+        "-priority", F("estimated_cost").asc(nulls_last=True), "created_at"
+    )[:limit]:
+        queued.setdefault(job.pk, job)
+    if not queued:
+        return None
+
+    window_start = now - timedelta(seconds=options["fairness_window"])
+    client_usage = dict(
+        OutputVideo.objects.filter(started_at__gte=window_start)
+        .values_list("client_id")
+        .annotate(total=Sum("estimated_cost"))
+        .order_by()
+    )
+    client_active = dict(
+        OutputVideo.objects.filter(status="processing")
+        .values_list("client_id")
+        .annotate(total=Count("id"))
+        .order_by()
+    )
+
+    candidates = [(job, (now - job.created_at).total_seconds()) for job in queued.values()]
+    for job in choose_job(candidates, client_usage, client_active, options):
+        if claim_job(job.pk, worker_id, now):
+            return OutputVideo.objects.get(pk=job.pk)
+    return None
+
+
+def claim_shared_jobs(job, worker_id, limit, now=None):
+    """
+    Claim up to limit - 1 more queued jobs of job's type that render the same input video
+    (same stored file, or same url), so the worker decodes and analyses it once for all
+    of them. Returns job followed by the claimed jobs.
+    """
+    video_data = job.video_data
+    same_input = Q()
+    if video_data.video_file:
+        same_input |= Q(video_data__video_file=video_data.video_file.name)
+    if video_data.video_url:
+        same_input |= Q(video_data__video_url=video_data.video_url)
+    if limit <= 1 or not same_input:
+        return [job]
+
+    now = now or timezone.now()
+    siblings = (
+        OutputVideo.objects.filter(status="queued", job_type=job.job_type)
+        .filter(Q(retry_at__isnull=True) | Q(retry_at__lte=now))
+        .filter(same_input)
+        .exclude(pk=job.pk)
+        .order_by("-priority", "created_at")
+        .values_list("pk", flat=True)
+    )
+    jobs = [job]
+    for pk in siblings[: limit * 2]:
+        if len(jobs) >= limit:
+            break
+        if claim_job(pk, worker_id, now):
+            jobs.append(OutputVideo.objects.select_related("video_data").get(pk=pk))
+    return jobs
+
+
+class SimulatedJob:
+    def __init__(self, job_id, arrival, cost, client_id, priority=0):
+        self.id = job_id
+        self.arrival = arrival
+        self.estimated_cost = cost
+        self.client_id = client_id
+        self.priority = priority
+        self.started = None
+
+
+def simulate(jobs, workers, policy, options, estimate_noise=0.0, seed=0):
+    """
+    Discrete event simulation of `workers` workers draining `jobs` with policy "fifo" or
+    "scheduler". The scheduler sees the cost estimate (optionally noisy), the workers take
+    the real cost. Returns per job wait times keyed by client.
+    """
+    rng = random.Random(seed)
+    pending = sorted(jobs, key=lambda job: job.arrival)
+    real_cost = {job.id: job.estimated_cost for job in pending}
+    for job in pending:
+        job.estimated_cost = job.estimated_cost * (1 + rng.uniform(-estimate_noise, estimate_noise))
+
+    queue = []
+    running = []  # heap of (finish_time, job_id, job)
+    started = []  # (start_time, client_id, estimated_cost) for the fair share window
+    client_active = {}
+    free_workers = workers
+    now = 0.0
+    index = 0
+    waits = {}
+
+    while index < len(pending) or queue or running:
+        next_arrival = pending[index].arrival if index < len(pending) else float("inf")
+        next_finish = running[0][0] if running else float("inf")
+
+        if free_workers and queue:
+            if policy == "fifo":
+                ordered = sorted(queue, key=lambda job: job.arrival)
+            else:
+                client_usage = {}
+                for start, client_id, cost in started:
+                    if now - start <= options["fairness_window"]:
+                        client_usage[client_id] = client_usage.get(client_id, 0) + cost
+                ordered = choose_job(
+                    [(job, now - job.arrival) for job in queue],
+                    client_usage,
+                    client_active,
+                    options,
+                )
+            job = ordered[0]
+            queue.remove(job)
+            job.started = now
+            waits.setdefault(job.client_id, []).append(now - job.arrival)
+            started.append((now, job.client_id, job.estimated_cost))
+            client_active[job.client_id] = client_active.get(job.client_id, 0) + 1
+            heapq.heappush(running, (now + real_cost[job.id], job.id, job))
+            free_workers -= 1
+            continue
+
+        if next_arrival <= next_finish:
+            now = next_arrival
+            queue.append(pending[index])
+            index += 1
+        else:
+            now, _, job = heapq.heappop(running)
+            client_active[job.client_id] -= 1
+            free_workers += 1
+
+    return waits
+
+
+def wait_summary(waits):
+    import numpy as np
+
+    values = np.array([wait for client_waits in waits.values() for wait in client_waits])
+    if values.size == 0:
+        return {"jobs": 0, "mean_wait_s": None, "p95_wait_s": None}
+    return {
+        "jobs": int(values.size),
+        "mean_wait_s": round(float(values.mean()), 1),
+        "p95_wait_s": round(float(np.percentile(values, 95)), 1),
+        "max_wait_s": round(float(values.max()), 1),
+    }
@@ -1,5 +1,7 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
-from .models import FaceImage, VideoData, OutputVideo
+from .models import FaceImage, VideoData, OutputVideo, VideoRendition, WorkerStatus
 
 from .utils import safe_file_url
 
@@ -10,19 +12,35 @@ class FaceImageSerializer(serializers.ModelSerializer):
         fields = ("id", "image_file")
 
 
+class VideoRenditionSerializer(serializers.ModelSerializer):
+    video_file = serializers.SerializerMethodField()
+
+    class Meta:
+        model = VideoRendition
+        fields = ("name", "width", "height", "bitrate", "video_file", "video_url")
+
+    def get_video_file(self, obj):
+        return safe_file_url(obj.video_file)
+
+
 class OutputVideoSerializer(serializers.ModelSerializer):
     final_video = serializers.SerializerMethodField()
     final_video_url = serializers.URLField(read_only=True)
+    renditions = VideoRenditionSerializer(many=True, read_only=True)
 
     class Meta:
         model = OutputVideo
         fields = (
             "id",
             "status",
+            "job_type",
+            "priority",
+            "attempts",
             "progress",
             "created_at",
             "final_video",
             "final_video_url",
+            "renditions",
         )
 
     def get_final_video(self, obj):
@@ -68,6 +86,143 @@ class VideoDataCreateSerializer(serializers.ModelSerializer):
         return video
 
 
+class JobOptionsSerializer(serializers.Serializer):
+    preview = serializers.BooleanField(required=False, default=False)
+    auto_render = serializers.BooleanField(required=False, default=False)
+    priority = serializers.IntegerField(required=False, default=0, min_value=-5, max_value=5)
+
+
+class JobStatusQuerySerializer(serializers.Serializer):
+    # comma separated job ids: ?ids=1,2,3
+    ids = serializers.CharField()
+
+    def validate_ids(self, value):
+        try:
+            ids = [int(part) for part in value.split(",") if part.strip()]
+        except ValueError:
+            raise serializers.ValidationError("ids must be comma separated integers")
+        if not ids:
+            raise serializers.ValidationError("No ids given")
+        limit = getattr(settings, "STATUS_MAX_IDS", 200)
+        if len(ids) > limit:
+            raise serializers.ValidationError(f"At most {limit} ids per request")
+        return list(dict.fromkeys(ids))
+
+
+class WorkerClaimSerializer(serializers.Serializer):
+    worker_id = serializers.CharField(max_length=100)
+    # most jobs sharing one input to claim together, capped at SHARED_RENDER_MAX_VARIANTS
+    limit = serializers.IntegerField(required=False, default=1, min_value=1)
+
+    def validate_limit(self, value):
+        return min(value, getattr(settings, "SHARED_RENDER_MAX_VARIANTS", 4))
+
+
+class WorkerProgressSerializer(serializers.Serializer):
+    worker_id = serializers.CharField(max_length=100)
+    progress = serializers.IntegerField(required=False, allow_null=True, min_value=0, max_value=100)
+
+
+class RemoteRenditionSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=50)
+    key = serializers.CharField(max_length=400)
+    width = serializers.IntegerField(required=False, allow_null=True)
+    height = serializers.IntegerField(required=False, allow_null=True)
+    bitrate = serializers.CharField(required=False, allow_null=True, max_length=20)
+
+
+class WorkerCompleteSerializer(serializers.Serializer):
+    worker_id = serializers.CharField(max_length=100)
+    # object key the worker uploaded the main output to (the payload's outputs.main.key)
+    output_key = serializers.CharField(max_length=400)
+    renditions = RemoteRenditionSerializer(many=True, required=False, default=list)
+    # helpers.profiling.job_metrics of the render
+    metrics = serializers.JSONField(required=False, default=dict)
+
+
+class WorkerFailSerializer(serializers.Serializer):
+    worker_id = serializers.CharField(max_length=100)
+    error = serializers.CharField(required=False, allow_blank=True, default="")
+    metrics = serializers.JSONField(required=False, default=dict)
+
+
+class WorkerStateSerializer(serializers.Serializer):
+    worker_id = serializers.CharField(max_length=100)
+    state = serializers.ChoiceField(choices=WorkerStatus.STATE_CHOICES)
+    hostname = serializers.CharField(required=False, max_length=255)
+    load_seconds = serializers.FloatField(required=False, allow_null=True)
+    warmup_seconds = serializers.FloatField(required=False, allow_null=True)
+
+
+class BatchVariantSerializer(serializers.Serializer):
+    # names of the multipart file fields holding this variant's images
+    faces = serializers.ListField(child=serializers.CharField(), min_length=1)
+    background = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+
+
+class BatchCreateSerializer(serializers.Serializer):
+    """
+    One input video (an upload, a url, or an existing VideoData via video_id) and a json
+    list of variants, each naming the uploaded files with its faces and optional background:
+    variants=[{"faces": ["face_a"], "background": "beach"}, {"faces": ["face_a", "face_b"]}]
+    A file field can be used by any number of variants.
+    """
+
+    video_id = serializers.PrimaryKeyRelatedField(
+        queryset=VideoData.objects.all(), required=False, allow_null=True
+    )
+    video_file = serializers.FileField(required=False, allow_null=True)
+    video_url = serializers.URLField(required=False, allow_null=True, allow_blank=True)
+    variants = serializers.JSONField(binary=True)
+
+    def validate(self, attrs):
+        sources = [
+            name for name in ("video_id", "video_file", "video_url") if attrs.get(name)
+        ]
+        if len(sources) != 1:
+            raise serializers.ValidationError(
+                "Give exactly one of video_id, video_file or video_url."
+            )
+
+        if not isinstance(attrs["variants"], list):
+            raise serializers.ValidationError({"variants": "Expected a list."})
+        variants = BatchVariantSerializer(data=attrs["variants"], many=True)
+        if not variants.is_valid():
+            raise serializers.ValidationError({"variants": variants.errors})
+        max_variants = getattr(settings, "BATCH_MAX_VARIANTS", 100)
+        if not 1 <= len(variants.validated_data) <= max_variants:
+            raise serializers.ValidationError(
+                {"variants": f"A batch needs between 1 and {max_variants} variants."}
+            )
+
+        files = self.context["request"].FILES
+        images = {}
+
+        def image(name):
+            if name not in images:
+                if name not in files:
+                    raise serializers.ValidationError({"variants": f"No uploaded file '{name}'."})
+                field = serializers.ImageField()
+                try:
+                    images[name] = field.run_validation(files[name])
+                except serializers.ValidationError as e:
+                    raise serializers.ValidationError({name: e.detail})
+                except DjangoValidationError as e:
+                    # the image check itself is Django's ImageField
+                    raise serializers.ValidationError({name: e.messages})
+            return images[name]
+
+        attrs["variants"] = [
+            {
+                "faces": [image(name) for name in variant["faces"]],
+                "background": image(variant["background"]) if variant.get("background") else None,
+            }
+            for variant in variants.validated_data
+        ]
+        attrs["source"] = attrs.pop("video_id", None)
+        return attrs
+
+
 class VideoDataResponseSerializer(serializers.ModelSerializer):
     video_file = serializers.SerializerMethodField()
     background_image = serializers.SerializerMethodField()
@@ -1,15 +1,200 @@
 
+from django.conf import settings
 from django.db import transaction
-from .models import OutputVideo
+from helpers.profiling import job_metrics
+from .metrics import ROLLUP_NAME, add_job_metrics, empty_totals
+from .models import FaceImage, JobBatch, JobMetrics, MetricsRollup, OutputVideo, VideoData
+from .scheduler import estimate_job_cost, estimate_probed_cost, probe_input
 
-def create_output_job(video_data):
+def create_output_job(
+    video_data, job_type="render", status="queued", priority=0, client_id=None
+):
     """
     Create OutputVideo job for the given VideoData instance.
     """
     with transaction.atomic():
         job = OutputVideo.objects.create(
             video_data=video_data,
-            status="queued",
+            status=status,
+            job_type=job_type,
             progress=0,
+            priority=priority,
+            client_id=client_id,
+            estimated_cost=estimate_job_cost(video_data, job_type),
         )
     return job
+
+
+def job_specs(preview=False, auto_render=False, priority=0):
+    """
+    (job_type, status, priority) of the jobs an upload gets. With preview a quick low-res
+    preview job is queued and the full render waits as "pending" until confirmed, unless
+    auto_render is set.
+    """
+    if not preview:
+        return [("render", "queued", priority)]
+    preview_priority = getattr(settings, "PREVIEW_PRIORITY", 10)
+    return [
+        ("preview", "queued", max(priority, preview_priority)),
+        ("render", "queued" if auto_render else "pending", priority),
+    ]
+
+
+def create_jobs(video_data, preview=False, auto_render=False, priority=0, client_id=None):
+    """
+    Create the jobs for a new upload, see job_specs.
+    """
+    with transaction.atomic():
+        return [
+            create_output_job(
+                video_data,
+                job_type=job_type,
+                status=job_status,
+                priority=job_priority,
+                client_id=client_id,
+            )
+            for job_type, job_status, job_priority in job_specs(preview, auto_render, priority)
+        ]
+
+
+def store_upload(model, field_name, upload):
+    """
+    Save an uploaded file where model.field_name would put it and return the stored name,
+    so several rows can point at one copy.
+    """
+    field = model._meta.get_field(field_name)
+    return field.storage.save(field.generate_filename(None, upload.name), upload)
+
+
+def create_batch(
+    variants,
+    video_file=None,
+    video_url=None,
+    source=None,
+    preview=False,
+    auto_render=False,
+    priority=0,
+    client_id=None,
+):
+    """
+    Create the jobs of one input video against many face sets in a single transaction,
+    with bulk inserts. The video is stored once (or taken from the existing VideoData
+    source) and every variant's VideoData points at it. variants is a list of
+    {"faces": [uploaded images], "background": uploaded image or None}; an upload used by
+    several variants is stored once too.
+    Returns (batch, jobs).
+    """
+    through = VideoData.face_images.through
+
+    with transaction.atomic():
+        batch = JobBatch.objects.create(client_id=client_id)
+
+        if source is not None:
+            video_name = source.video_file.name or None
+            video_url = source.video_url
+        else:
+            video_name = store_upload(VideoData, "video_file", video_file) if video_file else None
+
+        faces = {}
+        backgrounds = {}
+        for variant in variants:
+            for upload in variant["faces"]:
+                if id(upload) not in faces:
+                    faces[id(upload)] = FaceImage(image_file=upload)
+            upload = variant.get("background")
+            if upload is not None and id(upload) not in backgrounds:
+                backgrounds[id(upload)] = store_upload(VideoData, "background_image", upload)
+        FaceImage.objects.bulk_create(faces.values())
+
+        video_rows = VideoData.objects.bulk_create(
+            [
+                VideoData(
+                    video_file=video_name,
+                    video_url=video_url,
+                    background_image=(
+                        backgrounds[id(variant["background"])]
+                        if variant.get("background") is not None
+                        else None
+                    ),
+                )
+                for variant in variants
+            ]
+        )
+        through.objects.bulk_create(
+            [
+                through(videodata_id=row.pk, faceimage_id=faces[id(upload)].pk)
+                for row, variant in zip(video_rows, variants)
+                for upload in variant["faces"]
+            ]
+        )
+
+        # every variant renders the same video, one probe prices all of them
+        info = probe_input(video_rows[0]) if video_name else None
+        jobs = OutputVideo.objects.bulk_create(
+            [
+                OutputVideo(
+                    video_data=row,
+                    batch=batch,
+                    job_type=job_type,
+                    status=job_status,
+                    priority=job_priority,
+                    client_id=client_id,
+                    estimated_cost=estimate_probed_cost(
+                        info, job_type, bool(row.background_image)
+                    ),
+                )
+                for row in video_rows
+                for job_type, job_status, job_priority in job_specs(
+                    preview, auto_render, priority
+                )
+            ]
+        )
+    return batch, jobs
+
+
+def confirm_render_job(job):
+    """
+    Queue a full render that was waiting for its preview to be approved.
+    Returns False if the job is not a pending render.
+    """
+    updated = OutputVideo.objects.filter(
+        pk=job.pk, job_type="render", status="pending"
+    ).update(status="queued")
+    return bool(updated)
+
+
+def record_job_metrics(job, timer):
+    """
+    Store the StageTimer of a finished (or failed) job on its JobMetrics row.
+    """
+    return store_job_metrics(job, job_metrics(timer))
+
+
+def store_job_metrics(job, metrics):
+    """
+    Store JobMetrics fields (helpers.profiling.job_metrics) of a job, unknown keys are dropped,
+    and move the MetricsRollup totals by the difference.
+    """
+    fields = {
+        name: metrics[name]
+        for name in (
+            "stage_timings",
+            "stage_histograms",
+            "frames_processed",
+            "faces_per_frame",
+            "frame_paths",
+            "peak_rss_mb",
+        )
+        if name in metrics
+    }
+    with transaction.atomic():
+        rollup, _ = MetricsRollup.objects.select_for_update().get_or_create(
+            name=ROLLUP_NAME, defaults={"totals": empty_totals()}
+        )
+        previous = JobMetrics.objects.filter(output_video=job).values(*fields).first()
+        if previous:
+            add_job_metrics(rollup.totals, previous, sign=-1)
+        row = JobMetrics.objects.update_or_create(output_video=job, defaults=fields)[0]
+        add_job_metrics(rollup.totals, fields)
+        rollup.save(update_fields=["totals", "updated_at"])
+    return row
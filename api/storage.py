@@ -0,0 +1,315 @@
+import os
+import shutil
+import time
+
+from django.conf import settings
+from django.db.models import Count, Max, Q
+
+from helpers.face_index import evict_indexes
+from helpers.memory import MB
+from .models import OutputVideo, VideoData, VideoRendition
+
+DEFAULT_STORAGE_OPTIONS = {
+    # files and checkpoint dirs under media/processing untouched this long belong to
+    # renders that crashed or were abandoned; checkpoints of queued/processing jobs stay
+    "processing_ttl_hours": 24,
+    # raw yt downloads, the worker copies them into videos/ and deletes them right away
+    "downloads_ttl_hours": 1,
+    # local final_video / rendition copies are deleted this long after they were uploaded
+    # (final_video_url / video_url set), None keeps them
+    "local_copy_retention_hours": 24,
+    # input videos (videos/) beyond this are evicted least recently used first, inputs of
+    # queued, pending or processing jobs never are. None disables the budget.
+    "inputs_budget_mb": 20 * 1024,
+    # evict inputs (same order) until the media disk has this much free space, None ignores it
+    "min_free_mb": None,
+    # seconds between the collections an idle worker runs
+    "gc_interval_seconds": 600,
+}
+
+ACTIVE_STATUSES = ("queued", "pending", "processing")
+
+
+def storage_options():
+    options = dict(DEFAULT_STORAGE_OPTIONS)
+    options.update(getattr(settings, "STORAGE_OPTIONS", {}))
+    return options
+
+
+def path_usage(path):
+    """
+    (files, bytes) of a file or everything under a directory.
+    """
+    if os.path.isfile(path):
+        return 1, os.path.getsize(path)
+    files = size = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+                files += 1
+            except OSError:
+                pass
+    return files, size
+
+
+def path_size(path):
+    return path_usage(path)[1]
+
+
+def remove_path(path, dry_run=False):
+    """
+    Delete a file or directory, returns the bytes it held (0 if it was already gone).
+    """
+    if not os.path.exists(path):
+        return 0
+    size = path_size(path)
+    if not dry_run:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return 0
+    return size
+
+
+def remove_files(paths):
+    """
+    Delete a finished render's working files (outputs already copied to their FileFields,
+    .noaudio intermediates, rendition encodes). Returns the bytes freed.
+    """
+    return sum(remove_path(path) for path in paths if path)
+
+
+def storage_report():
+    """
+    {directory: {"files", "mb"}} of every top level directory under MEDIA_ROOT, and the
+    free space of the disk it is on.
+    """
+    root = str(settings.MEDIA_ROOT)
+    usage = {}
+    if os.path.isdir(root):
+        for name in sorted(os.listdir(root)):
+            files, size = path_usage(os.path.join(root, name))
+            usage[name] = {"files": files, "mb": round(size / MB, 1)}
+    disk = shutil.disk_usage(root if os.path.isdir(root) else settings.BASE_DIR)
+    return {
+        "directories": usage,
+        "total_mb": round(sum(entry["mb"] for entry in usage.values()), 1),
+        "disk_free_mb": round(disk.free / MB, 1),
+    }
+
+
+def checkpoint_path(job_id):
+    """
+    Directory of a job's render checkpoint (manifest and segments), the same whichever jobs
+    it is rendered with.
+    """
+    return os.path.join(settings.MEDIA_ROOT, "processing", f"job_{job_id}")
+
+
+def live_checkpoint_dirs():
+    """
+    Names of the processing/job_<id> checkpoint dirs a queued or processing job resumes
+    from (and the job_<ids> dirs older workers kept per group).
+    """
+    active = set(
+        OutputVideo.objects.filter(status__in=("queued", "processing")).values_list(
+            "id", flat=True
+        )
+    )
+    processing = os.path.join(settings.MEDIA_ROOT, "processing")
+    names = set()
+    if os.path.isdir(processing):
+        for name in os.listdir(processing):
+            if not name.startswith("job_"):
+                continue
+            ids = name[len("job_"):].split("_")
+            if any(part.isdigit() and int(part) in active for part in ids):
+                names.add(name)
+    return names
+
+
+def sweep_directory(directory, ttl_hours, keep=(), now=None, dry_run=False):
+    """
+    Delete the entries of directory not modified for ttl_hours, except the names in keep.
+    Returns (entries, bytes) removed.
+    """
+    if ttl_hours is None or not os.path.isdir(directory):
+        return 0, 0
+    cutoff = (now or time.time()) - ttl_hours * 3600
+    removed = freed = 0
+    for name in os.listdir(directory):
+        if name in keep:
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) > cutoff:
+                continue
+        except OSError:
+            continue
+        freed += remove_path(path, dry_run)
+        removed += 1
+    return removed, freed
+
+
+def expire_local_copies(retention_hours, now=None, dry_run=False):
+    """
+    Delete the local final_video and rendition files of jobs retention_hours after they
+    were uploaded, and clear the fields; the uploaded url is what clients use from then on.
+    Returns (files, bytes) removed.
+    """
+    if retention_hours is None:
+        return 0, 0
+    cutoff = (now or time.time()) - retention_hours * 3600
+    removed = freed = 0
+
+    jobs = (
+        OutputVideo.objects.exclude(final_video_url__isnull=True)
+        .exclude(final_video_url="")
+        .exclude(final_video="")
+        .exclude(final_video__isnull=True)
+        .only("id", "final_video")
+    )
+    for job in jobs.iterator():
+        path = job.final_video.path
+        # the copy was written when the job finished, right before the upload
+        if os.path.exists(path) and os.path.getmtime(path) > cutoff:
+            continue
+        freed += remove_path(path, dry_run)
+        removed += 1
+        if not dry_run:
+            OutputVideo.objects.filter(pk=job.pk).update(final_video="")
+
+    renditions = (
+        VideoRendition.objects.exclude(video_url__isnull=True)
+        .exclude(video_url="")
+        .exclude(video_file="")
+        .exclude(video_file__isnull=True)
+        .only("id", "video_file")
+    )
+    for rendition in renditions.iterator():
+        path = rendition.video_file.path
+        if os.path.exists(path) and os.path.getmtime(path) > cutoff:
+            continue
+        freed += remove_path(path, dry_run)
+        removed += 1
+        if not dry_run:
+            VideoRendition.objects.filter(pk=rendition.pk).update(video_file="")
+    return removed, freed
+
+
+def input_usage():
+    """
+    [(last used timestamp, name, bytes, active)] of every stored input video. Variants of a
+    batch share one file across VideoData rows, so rows are grouped by file name; a file
+    is active while any of its rows has a queued, pending or processing job.
+    """
+    rows = (
+        VideoData.objects.exclude(video_file="")
+        .exclude(video_file__isnull=True)
+        .values("video_file")
+        .annotate(
+            created=Max("created_at"),
+            started=Max("output_videos__started_at"),
+            active=Count("output_videos", filter=Q(output_videos__status__in=ACTIVE_STATUSES)),
+        )
+    )
+    files = {}
+    for row in rows:
+        last_used = max(stamp for stamp in (row["created"], row["started"]) if stamp)
+        entry = files.setdefault(row["video_file"], [last_used, False])
+        entry[0] = max(entry[0], last_used)
+        entry[1] = entry[1] or row["active"] > 0
+
+    root = str(settings.MEDIA_ROOT)
+    usage = []
+    for name, (last_used, active) in files.items():
+        path = os.path.join(root, name)
+        if os.path.exists(path):
+            usage.append((last_used.timestamp(), name, os.path.getsize(path), active))
+    return sorted(usage)
+
+
+def evict_inputs(budget_mb=None, min_free_mb=None, dry_run=False):
+    """
+    Delete input videos least recently used first until they fit in budget_mb and the disk
+    has min_free_mb free, skipping inputs of active jobs. Rows of an evicted input lose
+    their video_file; ones with a video_url are downloaded again if re-rendered.
+    Returns (files, bytes) removed.
+    """
+    if budget_mb is None and min_free_mb is None:
+        return 0, 0
+    usage = input_usage()
+    total = sum(size for _, _, size, _ in usage)
+    free = shutil.disk_usage(settings.MEDIA_ROOT).free if min_free_mb is not None else None
+
+    removed = freed = 0
+    for _, name, size, active in usage:
+        over_budget = budget_mb is not None and total > budget_mb * MB
+        low_disk = min_free_mb is not None and free < min_free_mb * MB
+        if not over_budget and not low_disk:
+            break
+        if active:
+            continue
+        # a job may have been queued on it since input_usage() looked
+        if OutputVideo.objects.filter(
+            video_data__video_file=name, status__in=ACTIVE_STATUSES
+        ).exists():
+            continue
+        freed_now = remove_path(os.path.join(settings.MEDIA_ROOT, name), dry_run)
+        if not dry_run:
+            VideoData.objects.filter(video_file=name).update(video_file="")
+        total -= size
+        if free is not None:
+            free += freed_now
+        freed += freed_now
+        removed += 1
+    return removed, freed
+
+
+def collect_garbage(options=None, dry_run=False):
+    """
+    One pass of every lifecycle rule. Returns {rule: {"removed", "mb"}}.
+    """
+    options = options or storage_options()
+    root = str(settings.MEDIA_ROOT)
+    results = {}
+
+    def record(rule, outcome):
+        removed, freed = outcome
+        results[rule] = {"removed": removed, "mb": round(freed / MB, 1)}
+
+    record(
+        "processing",
+        sweep_directory(
+            os.path.join(root, "processing"),
+            options["processing_ttl_hours"],
+            keep=live_checkpoint_dirs(),
+            dry_run=dry_run,
+        ),
+    )
+    record(
+        "downloads",
+        sweep_directory(
+            os.path.join(root, "downloads"), options["downloads_ttl_hours"], dry_run=dry_run
+        ),
+    )
+    record(
+        "local_copies",
+        expire_local_copies(options["local_copy_retention_hours"], dry_run=dry_run),
+    )
+    record(
+        "inputs",
+        evict_inputs(options["inputs_budget_mb"], options["min_free_mb"], dry_run=dry_run),
+    )
+
+    face_index_dir = getattr(settings, "FACE_INDEX_DIR", None)
+    face_index_max_mb = getattr(settings, "FACE_INDEX_MAX_MB", None)
+    if face_index_dir and face_index_max_mb and os.path.isdir(face_index_dir) and not dry_run:
+        before = path_size(str(face_index_dir))
+        evicted = evict_indexes(str(face_index_dir), face_index_max_mb * MB)
+        record("face_index", (len(evicted), before - path_size(str(face_index_dir))))
+    return results
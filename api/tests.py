@@ -1,3 +1,1176 @@
-from django.test import TestCase
+import os
+import json
+import queue
+import shutil
+import signal
+import tempfile
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import LiveServerTestCase, RequestFactory, SimpleTestCase, TestCase
+from django.utils import timezone
+from django.utils.http import http_date
+
+from helpers.api_client import ApiError, MagicRollClient
+from helpers.checkpoint import MANIFEST_NAME, RenderManifest
+from helpers.composite import frame_signature
+from helpers.face_index import video_key
+from helpers.frame_transport import SharedFrameRing
+from helpers.matting import choose_matting_tier
+from helpers.memory import MemoryBudgetExceeded, estimate_render_mb, plan_render
+
+from .leases import claim_job, lease_options, reap_expired_jobs, renew_lease
+from .management.commands.benchmark_transport import run_transport_case
+from .management.commands.check_startup import measure_startup, startup_problems
+from .media import parse_range, range_applies
+from .metrics import render_prometheus_metrics
+from .models import FaceImage, JobBatch, OutputVideo, VideoData, VideoRendition
+from .remote import claim_remote_jobs, stage_uploads
+from .scheduler import choose_job, job_score, pick_next_job, scheduler_options
+from .services import create_batch, store_job_metrics
+from .storage import (
+    collect_garbage,
+    evict_inputs,
+    expire_local_copies,
+    live_checkpoint_dirs,
+    storage_options,
+)
+from .workers import ProgressWriter
+
+
+def make_job(**fields):
+    video = VideoData.objects.create(video_url="https://example.com/watch?v=test")
+    return OutputVideo.objects.create(video_data=video, **fields)
+
+
+class MetricsRollupTests(TestCase):
+    def metrics(self, frames, rss):
+        return {
+            "stage_histograms": {"decode": {"buckets": [1] * 16, "sum": 0.01, "count": 1}},
+            "frames_processed": frames,
+            "frame_paths": {"swapped": frames},
+            "peak_rss_mb": rss,
+        }
+
+    def test_scrape_reports_totals_of_every_job(self):
+        store_job_metrics(make_job(), self.metrics(10, 300.0))
+        store_job_metrics(make_job(), self.metrics(5, 3000.0))
+
+        text = render_prometheus_metrics()
+        self.assertIn("magic_roll_frames_processed_total 15", text)
+        self.assertIn('magic_roll_frames_by_path_total{path="swapped"} 15', text)
+        self.assertIn('magic_roll_job_stage_seconds_bucket{stage="decode",le="+Inf"} 2', text)
+        self.assertIn('magic_roll_job_peak_rss_megabytes_bucket{le="512"} 1', text)
+        self.assertIn("magic_roll_job_peak_rss_megabytes_count 2", text)
+
+    def test_rewritten_job_metrics_replace_their_share(self):
+        job = make_job()
+        store_job_metrics(job, self.metrics(10, 300.0))
+        store_job_metrics(job, self.metrics(40, 300.0))
+
+        text = render_prometheus_metrics()
+        self.assertIn("magic_roll_frames_processed_total 40", text)
+        self.assertIn("magic_roll_job_peak_rss_megabytes_count 1", text)
+
+    def test_jobs_rendered_together_count_their_frames_once(self):
+        from helpers.benchmark import build_engine, make_stub_face_image, make_synthetic_video
+
+        from .management.commands.background_queue import Command as QueueCommand
+
+        with tempfile.TemporaryDirectory() as workdir, self.settings(MEDIA_ROOT=workdir):
+            video = make_synthetic_video(os.path.join(workdir, "input.mp4"), 160, 120, 2)
+            face = make_stub_face_image(os.path.join(workdir, "face.png"))
+            with open(video, "rb") as f:
+                video_file = SimpleUploadedFile("input.mp4", f.read())
+            with open(face, "rb") as f:
+                face_file = SimpleUploadedFile("face.png", f.read())
+            _, jobs = create_batch([{"faces": [face_file]}] * 2, video_file=video_file)
+
+            command = QueueCommand()
+            command.load_settings()
+            command.face_index_dir = None
+            command.rendition_specs = []
+            command.segment_frames = 20
+            command.worker_id = "worker-1"
+            command.engine = build_engine({"models": "stub"}, workdir, None)
+            if not shutil.which("ffmpeg"):
+                command.engine.join_segments = lambda input_video, variant: None
+            for job in jobs:
+                claim_job(job.pk, "worker-1")
+            with mock.patch(
+                "api.management.commands.background_queue.upload_file",
+                return_value="https://cdn.example.com/output.mp4",
+            ):
+                command.run_jobs(list(OutputVideo.objects.order_by("id")))
+
+        rows = [job.metrics for job in OutputVideo.objects.order_by("id")]
+        self.assertEqual([row.frames_processed for row in rows], [50, 0])
+        self.assertIn("decode", rows[0].stage_timings)
+        self.assertNotIn("decode", rows[1].stage_timings)
+        self.assertIn("upload", rows[1].stage_timings)
+        text = render_prometheus_metrics()
+        self.assertIn("magic_roll_frames_processed_total 50", text)
+        self.assertIn('magic_roll_frames_by_path_total{path="swapped"} 50', text)
+
+
+class MediaRangeTests(SimpleTestCase):
+    def test_parse_range(self):
+        self.assertEqual(parse_range("bytes=0-99", 1000), (0, 99))
+        self.assertEqual(parse_range("bytes=900-", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=900-5000", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=-100", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=-5000", 1000), (0, 999))
+        self.assertEqual(parse_range("bytes=1000-", 1000), "unsatisfiable")
+        self.assertEqual(parse_range("bytes=-0", 1000), "unsatisfiable")
+        for ignored in ("bytes=10-5", "bytes=-", "bytes=0-1,5-9", "items=0-9"):
+            self.assertIsNone(parse_range(ignored, 1000))
+
+    def test_range_applies_only_to_a_current_copy(self):
+        factory = RequestFactory()
+        etag, modified = '"abc-10"', 1_700_000_000
+        self.assertTrue(range_applies(factory.get("/"), etag, modified))
+        self.assertTrue(range_applies(factory.get("/", HTTP_IF_RANGE=etag), etag, modified))
+        self.assertFalse(range_applies(factory.get("/", HTTP_IF_RANGE='"old-10"'), etag, modified))
+        self.assertFalse(range_applies(factory.get("/", HTTP_IF_RANGE=f"W/{etag}"), etag, modified))
+        current = factory.get("/", HTTP_IF_RANGE=http_date(modified))
+        self.assertTrue(range_applies(current, etag, modified))
+        stale = factory.get("/", HTTP_IF_RANGE=http_date(modified - 60))
+        self.assertFalse(range_applies(stale, etag, modified))
+
+    def test_serves_ranges_of_public_media(self):
+        with tempfile.TemporaryDirectory() as media_root:
+            data = bytes(range(256)) * 4
+            for directory in ("output_videos", "processing", "face_images"):
+                os.makedirs(os.path.join(media_root, directory))
+                with open(os.path.join(media_root, directory, "clip.mp4"), "wb") as f:
+                    f.write(data)
+
+            with self.settings(MEDIA_ROOT=media_root, MEDIA_SENDFILE=None):
+                url = f"{settings.MEDIA_URL}output_videos/clip.mp4"
+                response = self.client.get(url, HTTP_RANGE="bytes=100-199")
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response["Content-Range"], "bytes 100-199/1024")
+                self.assertEqual(b"".join(response.streaming_content), data[100:200])
+
+                response = self.client.get(url, HTTP_RANGE="bytes=2000-")
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response["Content-Range"], "bytes */1024")
+
+                response = self.client.get(url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"old"')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(b"".join(response.streaming_content), data)
+
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+                self.assertEqual(response.status_code, 304)
+
+                for private in ("processing", "face_images"):
+                    response = self.client.get(f"{settings.MEDIA_URL}{private}/clip.mp4")
+                    self.assertEqual(response.status_code, 404)
+
+    def test_accel_redirect_path_is_quoted(self):
+        with tempfile.TemporaryDirectory() as media_root:
+            os.makedirs(os.path.join(media_root, "output_videos"))
+            open(os.path.join(media_root, "output_videos", "my clip?é.mp4"), "wb").close()
+            with self.settings(
+                MEDIA_ROOT=media_root,
+                MEDIA_SENDFILE="x-accel-redirect",
+                MEDIA_ACCEL_PREFIX="/protected-media/",
+            ):
+                response = self.client.get(
+                    f"{settings.MEDIA_URL}output_videos/my%20clip%3F%C3%A9.mp4"
+                )
+        self.assertEqual(
+            response["X-Accel-Redirect"], "/protected-media/output_videos/my%20clip%3F%C3%A9.mp4"
+        )
+
+
+class JobStatusTests(TestCase):
+    url = "/api/videos/status/"
+
+    def test_statuses_of_many_jobs_in_one_query(self):
+        first = make_job(status="processing", progress=40)
+        second = make_job(status="completed", progress=100)
+        missing = second.pk + 1000
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                self.url, {"ids": f"{second.pk}, {first.pk},{missing},{second.pk},"}
+            )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([job["id"] for job in data["jobs"]], [second.pk, first.pk])
+        self.assertEqual(
+            (data["jobs"][1]["status"], data["jobs"][1]["progress"]), ("processing", 40)
+        )
+        self.assertEqual(data["missing"], [missing])
+
+    def test_malformed_queries_are_rejected(self):
+        for params in ({}, {"ids": ""}, {"ids": ","}, {"ids": "1,two"}, {"ids": "1.5"}):
+            with self.assertNumQueries(0):
+                response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400, params)
+        with self.settings(STATUS_MAX_IDS=2):
+            response = self.client.get(self.url, {"ids": "1,2,3"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("At most 2", response.json()["ids"][0])
+
+
+class BatchUploadTests(TestCase):
+    url = "/api/videos/batch/"
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp(prefix="batch_test_")
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.media_root = media_root
+        override = self.settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def image(self, name):
+        _, data = cv2.imencode(".png", np.zeros((8, 8, 3), dtype=np.uint8))
+        return SimpleUploadedFile(f"{name}.png", data.tobytes(), content_type="image/png")
+
+    def stored(self, directory):
+        return sorted(os.listdir(os.path.join(self.media_root, directory)))
+
+    def post(self, variants, **fields):
+        return self.client.post(self.url, {"variants": json.dumps(variants), **fields})
+
+    def test_batch_stores_each_upload_once(self):
+        variants = [
+            {"faces": ["face_a"], "background": "beach"},
+            {"faces": ["face_a", "face_b"]},
+            {"faces": ["face_b"], "background": "beach"},
+        ]
+        response = self.post(
+            variants,
+            video_file=SimpleUploadedFile("input.mp4", b"not a video"),
+            face_a=self.image("a"),
+            face_b=self.image("b"),
+            beach=self.image("beach"),
+            preview="true",
+        )
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+
+        batch = JobBatch.objects.get(pk=data["batch_id"])
+        rows = list(VideoData.objects.order_by("id"))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(len({row.video_file.name for row in rows}), 1)
+        self.assertEqual(rows[0].background_image.name, rows[2].background_image.name)
+        self.assertFalse(rows[1].background_image)
+        self.assertEqual(FaceImage.objects.count(), 2)
+        faces = [sorted(face.image_file.name for face in row.face_images.all()) for row in rows]
+        self.assertEqual(faces[1], sorted(faces[0] + faces[2]))
+        self.assertEqual(VideoData.face_images.through.objects.count(), 4)
+        self.assertEqual(
+            [len(self.stored(name)) for name in ("videos", "face_images", "backgrounds")],
+            [1, 2, 1],
+        )
+
+        # a preview and a render waiting for it per variant
+        jobs = list(batch.jobs.order_by("id"))
+        self.assertEqual([job["id"] for job in data["jobs"]], [job.id for job in jobs])
+        self.assertEqual([job["variant"] for job in data["jobs"]], [0, 0, 1, 1, 2, 2])
+        self.assertEqual(
+            [(job.job_type, job.status) for job in jobs[:2]],
+            [("preview", "queued"), ("render", "pending")],
+        )
+        self.assertEqual({job.video_data_id for job in jobs}, {row.pk for row in rows})
+
+        # a batch on an existing input points at the same stored video
+        response = self.post([{"faces": ["face"]}], video_id=rows[0].pk, face=self.image("c"))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(VideoData.objects.last().video_file.name, rows[0].video_file.name)
+        self.assertEqual(len(self.stored("videos")), 1)
+
+    def test_invalid_batches_are_rejected(self):
+        url = "https://example.com/watch?v=test"
+        cases = [
+            ({"variants": json.dumps([{"faces": ["face"]}])}, "non_field_errors"),
+            (
+                {
+                    "variants": json.dumps([{"faces": ["face"]}]),
+                    "video_url": url,
+                    "video_file": SimpleUploadedFile("input.mp4", b"video"),
+                },
+                "non_field_errors",
+            ),
+            ({"variants": json.dumps({"faces": ["face"]}), "video_url": url}, "variants"),
+            ({"variants": json.dumps([]), "video_url": url}, "variants"),
+            ({"variants": json.dumps([{"faces": []}]), "video_url": url}, "variants"),
+            ({"variants": json.dumps([{"faces": ["other"]}]), "video_url": url}, "variants"),
+            ({"variants": "[{", "video_url": url}, "variants"),
+            (
+                {
+                    "variants": json.dumps([{"faces": ["face"]}]),
+                    "video_url": url,
+                    "face": SimpleUploadedFile("face.png", b"not an image"),
+                },
+                "face",
+            ),
+        ]
+        for fields, error in cases:
+            response = self.client.post(self.url, {"face": self.image("face"), **fields})
+            self.assertEqual(response.status_code, 400, fields)
+            self.assertIn(error, response.json())
+        with self.settings(BATCH_MAX_VARIANTS=2):
+            response = self.post([{"faces": ["face"]}] * 3, video_url=url, face=self.image("face"))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((JobBatch.objects.count(), VideoData.objects.count()), (0, 0))
+
+    def test_batch_status_reads_every_job_at_once(self):
+        def batch_of(count):
+            face = self.image("face")
+            batch, jobs = create_batch(
+                [{"faces": [face]}] * count, video_url="https://example.com/watch?v=test"
+            )
+            return batch, jobs
+
+        small, _ = batch_of(2)
+        batch, jobs = batch_of(8)
+        OutputVideo.objects.filter(pk=jobs[0].pk).update(status="completed", progress=100)
+        OutputVideo.objects.filter(pk=jobs[1].pk).update(status="processing", progress=60)
+
+        for each in (small, batch):
+            with self.assertNumQueries(2):
+                response = self.client.get(f"{self.url}{each.pk}/")
+        data = response.json()
+        self.assertEqual(data["total"], 8)
+        self.assertEqual([job["id"] for job in data["jobs"]], [job.id for job in jobs])
+        self.assertEqual(data["counts"], {"completed": 1, "processing": 1, "queued": 6})
+        self.assertEqual(data["progress"], 20)
+        self.assertFalse(data["done"])
+        self.assertEqual(self.client.get(f"{self.url}{batch.pk + 100}/").status_code, 404)
+
+
+class ApiClientTests(LiveServerTestCase):
+    def test_job_statuses_are_chunked_and_cached(self):
+        jobs = [make_job(status="queued") for _ in range(3)]
+        ids = [job.pk for job in jobs]
+        client = MagicRollClient(self.live_server_url, cache_ttl=60, status_ids=2)
+        self.addCleanup(client.close)
+
+        # a dashboard polling its jobs, one of them deleted meanwhile
+        polled = ids + [ids[0], ids[-1] + 1000]
+        with mock.patch.object(client.session, "get", wraps=client.session.get) as get:
+            self.assertEqual(sorted(client.job_statuses(polled)), ids)
+            # four distinct ids, two per request
+            self.assertEqual(get.call_count, 2)
+
+            OutputVideo.objects.filter(pk=ids[0]).update(status="processing", progress=30)
+            self.assertEqual(client.job_statuses(polled)[ids[0]]["status"], "queued")
+            self.assertEqual(get.call_count, 2)
+
+            client.clear_cache()
+            self.assertEqual(client.job_statuses(polled)[ids[0]]["progress"], 30)
+            self.assertEqual(get.call_count, 4)
+
+    def test_gets_retry_an_unavailable_server(self):
+        from rest_framework.response import Response
+
+        from .views import JobStatusView
+
+        job = make_job()
+        answers = []
+        status_get = JobStatusView.get
+
+        def flaky_get(view, request):
+            answers.append(request.path)
+            if len(answers) <= failures:
+                return Response({"detail": "busy"}, status=503)
+            return status_get(view, request)
+
+        client = MagicRollClient(self.live_server_url, cache_ttl=0, retries=2)
+        self.addCleanup(client.close)
+        with mock.patch.object(JobStatusView, "get", flaky_get):
+            failures = 2
+            self.assertEqual(list(client.job_statuses([job.pk])), [job.pk])
+            self.assertEqual(len(answers), 3)
+
+            answers.clear()
+            failures = 3
+            with self.assertRaises(ApiError) as error:
+                client.job_statuses([job.pk])
+            self.assertEqual(error.exception.status_code, 503)
+            self.assertEqual(len(answers), 3)
+
+
+class MemoryPlanTests(SimpleTestCase):
+    def test_no_budget_renders_full_size_with_default_threads(self):
+        plan = plan_render(1920, 1080)
+        self.assertEqual(plan.size, (1920, 1080))
+        self.assertIsNone(plan.decode_threads)
+        self.assertIsNone(plan.lookahead)
+
+    def test_threads_and_lookahead_go_before_the_resolution(self):
+        full = estimate_render_mb(1920, 1080, decode_threads=4, lookahead=10)
+        reduced = estimate_render_mb(1920, 1080, decode_threads=2, lookahead=6)
+        self.assertLess(reduced, full)
+
+        plan = plan_render(1920, 1080, available_mb=full, max_decode_threads=4)
+        self.assertEqual((plan.size, plan.decode_threads, plan.lookahead), ((1920, 1080), 4, 10))
+        plan = plan_render(1920, 1080, available_mb=(full + reduced) / 2, max_decode_threads=4)
+        self.assertEqual((plan.size, plan.decode_threads, plan.lookahead), ((1920, 1080), 2, 6))
+        self.assertLessEqual(plan.estimated_mb, plan.available_mb)
+
+    def test_downscales_decoding_at_the_input_size(self):
+        full = estimate_render_mb(3840, 2160, decode_threads=1, lookahead=4)
+        plan = plan_render(3840, 2160, available_mb=full * 0.9, max_decode_threads=4)
+        self.assertEqual(plan.size, (2560, 1440))
+        self.assertLessEqual(plan.estimated_mb, full * 0.9)
+
+    def test_refuses_what_does_not_fit_at_the_smallest_size(self):
+        with self.assertRaises(MemoryBudgetExceeded):
+            plan_render(1920, 1080, available_mb=1)
+        smallest = estimate_render_mb(
+            640, 360, decode_threads=1, lookahead=4, input_size=(1920, 1080)
+        )
+        with self.assertRaises(MemoryBudgetExceeded):
+            plan_render(1920, 1080, available_mb=smallest, allow_downscale=False)
+
+
+class SchedulerTests(TestCase):
+    def setUp(self):
+        self.options = {**scheduler_options(), "max_active_per_client": 2}
+
+    def candidate(self, cost, wait, client_id="a", priority=0):
+        return SimpleNamespace(estimated_cost=cost, priority=priority, client_id=client_id), wait
+
+    def test_shorter_job_scores_lower(self):
+        self.assertLess(
+            job_score(60, 0, 0, 0, self.options), job_score(3600, 0, 0, 0, self.options)
+        )
+
+    def test_unknown_cost_scores_as_default_cost(self):
+        self.assertEqual(
+            job_score(None, 0, 0, 0, self.options),
+            job_score(self.options["default_cost"], 0, 0, 0, self.options),
+        )
+
+    def test_priority_divides_cost(self):
+        self.assertEqual(
+            job_score(100, 1, 0, 0, self.options), 100 / self.options["priority_weight"]
+        )
+
+    def test_long_job_overtakes_later_short_jobs(self):
+        # a fresh short job loses to a long one that waited longer than cost / aging_rate
+        wait = 3600 / self.options["aging_rate"] + 1
+        long_job, short_job = self.candidate(3600, wait), self.candidate(60, 0)
+        ordered = choose_job([short_job, long_job], {}, {}, self.options)
+        self.assertIs(ordered[0], long_job[0])
+
+    def test_client_over_quota_goes_last(self):
+        busy, idle = self.candidate(10, 0, "busy"), self.candidate(1000, 0, "idle")
+        ordered = choose_job([busy, idle], {}, {"busy": 2}, self.options)
+        self.assertEqual([job.client_id for job in ordered], ["idle", "busy"])
+
+    def test_max_wait_serves_overdue_jobs_oldest_first(self):
+        options = {**self.options, "max_wait_seconds": 600}
+        short_job = self.candidate(10, 0)
+        overdue, older = self.candidate(5000, 700), self.candidate(9000, 900)
+        ordered = choose_job([short_job, overdue, older], {}, {}, options)
+        self.assertEqual(ordered, [older[0], overdue[0], short_job[0]])
+
+    def test_pick_next_job_claims_cheapest_and_leases_it(self):
+        make_job(estimated_cost=500)
+        cheap = make_job(estimated_cost=20)
+        job = pick_next_job("worker-1")
+        self.assertEqual(job.pk, cheap.pk)
+        self.assertEqual(job.status, "processing")
+        self.assertEqual(job.worker_id, "worker-1")
+        self.assertIsNotNone(job.lease_expires_at)
+
+    def test_pick_next_job_scores_the_oldest_beyond_the_cheapest(self):
+        oldest = make_job(estimated_cost=4000)
+        OutputVideo.objects.filter(pk=oldest.pk).update(
+            created_at=timezone.now() - timedelta(hours=10)
+        )
+        for _ in range(3):
+            make_job(estimated_cost=30)
+        with self.settings(SCHEDULER_OPTIONS={"candidate_limit": 2}):
+            job = pick_next_job("worker-1")
+        self.assertEqual(job.pk, oldest.pk)
+
+    def test_pick_next_job_skips_jobs_backing_off(self):
+        make_job(retry_at=timezone.now() + timedelta(minutes=5))
+        self.assertIsNone(pick_next_job("worker-1"))
+
+
+class LeaseReaperTests(TestCase):
+    def expired_job(self, attempts, **fields):
+        return make_job(
+            status="processing",
+            worker_id="dead-worker",
+            attempts=attempts,
+            lease_expires_at=timezone.now() - timedelta(seconds=1),
+            **fields,
+        )
+
+    def test_expired_jobs_are_requeued_with_doubling_backoff(self):
+        now = timezone.now()
+        backoff = lease_options()["retry_backoff_seconds"]
+        first, second = self.expired_job(1), self.expired_job(2)
+
+        self.assertEqual(reap_expired_jobs(now), (2, 0))
+        for job, expected in ((first, backoff), (second, backoff * 2)):
+            job.refresh_from_db()
+            self.assertEqual(job.status, "queued")
+            self.assertIsNone(job.worker_id)
+            self.assertIsNone(job.lease_expires_at)
+            self.assertEqual((job.retry_at - now).total_seconds(), expected)
+
+    def test_job_out_of_attempts_fails(self):
+        job = self.expired_job(lease_options()["max_attempts"])
+        self.assertEqual(reap_expired_jobs(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+
+    def test_live_lease_is_left_alone(self):
+        job = make_job()
+        claim_job(job.pk, "worker-1")
+        self.assertEqual(reap_expired_jobs(), (0, 0))
+        self.assertTrue(renew_lease(job.pk, "worker-1"))
+
+    def test_processing_job_without_lease_is_reaped(self):
+        job = make_job(status="processing", attempts=1)
+        self.assertEqual(reap_expired_jobs(), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual(job.status, "queued")
+
+    def test_reaped_job_loses_its_lease(self):
+        job = self.expired_job(1)
+        reap_expired_jobs()
+        self.assertFalse(renew_lease(job.pk, "dead-worker"))
+
+
+class RemoteClaimTests(TestCase):
+    def test_failed_payload_gives_every_claimed_job_back(self):
+        video = VideoData.objects.create(video_url="https://example.com/watch?v=test")
+        jobs = [OutputVideo.objects.create(video_data=video) for _ in range(3)]
+        calls = []
+
+        def payload(job, name, options):
+            calls.append(job.pk)
+            if len(calls) == 2:
+                raise OSError("upload failed")
+            return {"id": job.pk}
+
+        with mock.patch("api.remote.job_payload", side_effect=payload):
+            with self.assertRaises(OSError):
+                claim_remote_jobs("remote-1", limit=3)
+
+        self.assertEqual(len(calls), 2)
+        for job in jobs:
+            job.refresh_from_db()
+            self.assertEqual(job.status, "queued")
+            self.assertIsNone(job.worker_id)
+            self.assertIsNone(job.lease_expires_at)
+
+    def test_lease_starts_after_the_inputs_are_staged(self):
+        job = make_job()
+
+        def slow_payload(job, name, options):
+            # staging took longer than the lease
+            OutputVideo.objects.filter(pk=job.pk).update(
+                lease_expires_at=timezone.now() - timedelta(seconds=1)
+            )
+            return {"id": job.pk}
+
+        with mock.patch("api.remote.job_payload", side_effect=slow_payload):
+            self.assertEqual(claim_remote_jobs("remote-1", limit=1), [{"id": job.pk}])
+        job.refresh_from_db()
+        self.assertEqual(job.status, "processing")
+        self.assertGreater(job.lease_expires_at, timezone.now())
+
+    def test_uploads_stage_every_shared_file_once(self):
+        with tempfile.TemporaryDirectory() as media_root:
+            for name in ("videos/input.mp4", "face_images/a.png", "face_images/b.png"):
+                os.makedirs(os.path.join(media_root, os.path.dirname(name)), exist_ok=True)
+                open(os.path.join(media_root, name), "wb").close()
+            face_a = FaceImage.objects.create(image_file="face_images/a.png")
+            face_b = FaceImage.objects.create(image_file="face_images/b.png")
+            videos = []
+            for faces in ([face_a], [face_a, face_b]):
+                video = VideoData.objects.create(video_file="videos/input.mp4")
+                video.face_images.set(faces)
+                videos.append(video.pk)
+
+            with self.settings(MEDIA_ROOT=media_root), mock.patch(
+                "helpers.cloudflare_CRUD.object_exists", return_value=False
+            ), mock.patch("helpers.cloudflare_CRUD.upload_file") as upload:
+                stage_uploads(videos)
+
+        self.assertEqual(
+            sorted(call.args[2] for call in upload.call_args_list),
+            ["inputs/face_images/a.png", "inputs/face_images/b.png", "inputs/videos/input.mp4"],
+        )
+
+
+class ProgressWriterTests(TestCase):
+    def test_flush_writes_the_update_the_interval_held_back(self):
+        job = make_job(status="processing")
+        progress = ProgressWriter(interval_seconds=3600)
+        self.assertTrue(progress.update([job.id], 10))
+        self.assertFalse(progress.update([job.id], 42))
+        job.refresh_from_db()
+        self.assertEqual(job.progress, 10)
+
+        self.assertTrue(progress.flush())
+        job.refresh_from_db()
+        self.assertEqual(job.progress, 42)
+        self.assertFalse(progress.flush())
+
+    def test_flush_only_touches_the_jobs_given(self):
+        kept, lost = make_job(status="processing"), make_job(status="processing")
+        progress = ProgressWriter(interval_seconds=3600)
+        progress.update([kept.id, lost.id], 10)
+        progress.update([kept.id, lost.id], 50)
+
+        progress.flush([kept.id])
+        kept.refresh_from_db()
+        lost.refresh_from_db()
+        self.assertEqual((kept.progress, lost.progress), (50, 10))
+
+
+class StorageLifecycleTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp(prefix="storage_test_")
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = self.settings(MEDIA_ROOT=self.media_root, FACE_INDEX_DIR=None)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def write(self, name, hours_old=0, size=1000):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"\0" * size)
+        stamp = time.time() - hours_old * 3600
+        os.utime(path, (stamp, stamp))
+        return path
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.media_root, name))
+
+    def input_job(self, name, status, days_ago):
+        self.write(name)
+        video = VideoData.objects.create(video_file=name)
+        VideoData.objects.filter(pk=video.pk).update(
+            created_at=timezone.now() - timedelta(days=days_ago)
+        )
+        return OutputVideo.objects.create(video_data=video, status=status)
+
+    def test_inputs_of_active_jobs_are_never_evicted(self):
+        self.input_job("videos/queued.mp4", "queued", days_ago=30)
+        self.input_job("videos/pending.mp4", "pending", days_ago=30)
+        self.input_job("videos/done.mp4", "completed", days_ago=20)
+        # a batch input, one of its variants still rendering
+        shared = self.input_job("videos/shared.mp4", "completed", days_ago=40)
+        rendering = VideoData.objects.create(video_file="videos/shared.mp4")
+        OutputVideo.objects.create(video_data=rendering, status="processing")
+
+        self.assertEqual(evict_inputs(budget_mb=0), (1, 1000))
+        self.assertFalse(self.exists("videos/done.mp4"))
+        self.assertEqual(VideoData.objects.filter(video_file="videos/done.mp4").count(), 0)
+        for name in ("queued", "pending", "shared"):
+            self.assertTrue(self.exists(f"videos/{name}.mp4"))
+        shared.video_data.refresh_from_db()
+        self.assertEqual(shared.video_data.video_file.name, "videos/shared.mp4")
+
+    def test_local_copies_are_kept_for_the_retention_window(self):
+        def finished(name, hours_old, url="https://cdn.example.com/out.mp4"):
+            self.write(name, hours_old)
+            return make_job(status="completed", final_video=name, final_video_url=url)
+
+        recent = finished("output_videos/recent.mp4", hours_old=2)
+        old = finished("output_videos/old.mp4", hours_old=48)
+        not_uploaded = finished("output_videos/local.mp4", hours_old=48, url=None)
+        self.write("renditions/old_360p.mp4", hours_old=48)
+        rendition = VideoRendition.objects.create(
+            output_video=recent,
+            name="360p",
+            video_file="renditions/old_360p.mp4",
+            video_url="https://cdn.example.com/old_360p.mp4",
+        )
+
+        self.assertEqual(expire_local_copies(24), (2, 2000))
+        for job in (recent, old, not_uploaded):
+            job.refresh_from_db()
+        rendition.refresh_from_db()
+        self.assertEqual(recent.final_video.name, "output_videos/recent.mp4")
+        self.assertTrue(self.exists("output_videos/recent.mp4"))
+        self.assertFalse(old.final_video)
+        self.assertFalse(self.exists("output_videos/old.mp4"))
+        self.assertTrue(self.exists("output_videos/local.mp4"))
+        self.assertFalse(rendition.video_file)
+        self.assertEqual(expire_local_copies(None), (0, 0))
+
+    def test_live_checkpoints_survive_a_sweep(self):
+        queued = make_job(status="queued")
+        processing = make_job(status="processing")
+        completed = make_job(status="completed")
+        stale = [
+            f"processing/job_{queued.pk}/manifest.json",
+            # the per group dir of an older worker, one of its jobs still running
+            f"processing/job_{completed.pk}_{processing.pk}/manifest.json",
+            f"processing/job_{completed.pk}/manifest.json",
+            "processing/stray.mp4",
+        ]
+        for name in stale:
+            self.write(name, hours_old=48)
+            directory = os.path.join(self.media_root, os.path.dirname(name))
+            os.utime(directory, (time.time() - 48 * 3600,) * 2)
+        self.write("processing/fresh.mp4")
+
+        self.assertEqual(
+            live_checkpoint_dirs(),
+            {f"job_{queued.pk}", f"job_{completed.pk}_{processing.pk}"},
+        )
+        results = collect_garbage({**storage_options(), "inputs_budget_mb": None})
+        self.assertEqual(results["processing"]["removed"], 2)
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.media_root, "processing"))),
+            sorted(["fresh.mp4", f"job_{queued.pk}", f"job_{completed.pk}_{processing.pk}"]),
+        )
+
+    def test_dry_run_deletes_nothing(self):
+        self.write("processing/stray.mp4", hours_old=48)
+        self.write("downloads/clip.mp4", hours_old=2)
+        self.write("output_videos/old.mp4", hours_old=48)
+        job = make_job(
+            status="completed",
+            final_video="output_videos/old.mp4",
+            final_video_url="https://cdn.example.com/old.mp4",
+        )
+        self.input_job("videos/done.mp4", "completed", days_ago=20)
+        options = {**storage_options(), "inputs_budget_mb": 0}
+
+        planned = collect_garbage(options, dry_run=True)
+        self.assertEqual(
+            {rule: result["removed"] for rule, result in planned.items()},
+            {"processing": 1, "downloads": 1, "local_copies": 1, "inputs": 1},
+        )
+        for name in (
+            "processing/stray.mp4",
+            "downloads/clip.mp4",
+            "output_videos/old.mp4",
+            "videos/done.mp4",
+        ):
+            self.assertTrue(self.exists(name), name)
+        job.refresh_from_db()
+        self.assertEqual(job.final_video.name, "output_videos/old.mp4")
+        self.assertTrue(VideoData.objects.filter(video_file="videos/done.mp4").exists())
+
+        self.assertEqual(collect_garbage(options), planned)
+        self.assertFalse(self.exists("videos/done.mp4"))
+
+
+class MattingTierTests(SimpleTestCase):
+    def test_without_benchmark_auto_takes_the_cheapest_tier_and_warns(self):
+        with self.assertLogs("Matting", "WARNING"):
+            self.assertEqual(choose_matting_tier(1920, 1080, 300, {}), ("fast", None))
+        options = {"tiers": ["quality", "portrait"]}
+        with self.assertLogs("Matting", "WARNING"):
+            self.assertEqual(choose_matting_tier(1920, 1080, 300, {}, options)[0], "portrait")
+
+    def test_best_tier_that_keeps_up_is_picked(self):
+        pixels = 1280 * 720
+        benchmark = {
+            "quality": [[pixels, 2.0]],
+            "portrait": [[pixels, 8.0]],
+            "fast": [[pixels, 30.0]],
+        }
+        self.assertEqual(choose_matting_tier(1280, 720, 3000, benchmark), ("portrait", 8.0))
+        # short enough for the slow tier to finish within short_job_seconds
+        self.assertEqual(choose_matting_tier(1280, 720, 100, benchmark), ("quality", 2.0))
+
+
+class OnnxSessionTests(SimpleTestCase):
+    def test_optimized_graph_cache_is_keyed_on_the_runtime_version(self):
+        import onnxruntime
+        from helpers.onnx_session import optimized_model_path, resolve_session_config
+
+        config = resolve_session_config({"optimized_model_dir": "/cache"})
+        path = optimized_model_path("/models/det_10g.onnx", config, ["CPUExecutionProvider"])
+        self.assertEqual(
+            os.path.basename(path), f"det_10g.all.cpu.ort{onnxruntime.__version__}.opt.onnx"
+        )
+        config["graph_optimization_level"] = "disable"
+        self.assertIsNone(optimized_model_path("/models/det_10g.onnx", config, []))
+
+    def test_rembg_session_is_built_by_its_class_with_our_options(self):
+        import onnxruntime
+        from rembg.sessions import sessions_class
+        from helpers.benchmark import build_stub_conv_model
+        from helpers.onnx_session import load_rembg_session, resolve_session_config
+
+        session_class = next(cls for cls in sessions_class if cls.name() == "u2netp")
+        with tempfile.TemporaryDirectory() as workdir:
+            model = build_stub_conv_model(os.path.join(workdir, "u2netp.onnx"), 320)
+            cache = os.path.join(workdir, "optimized")
+            config = resolve_session_config({"optimized_model_dir": cache})
+            providers = ["CPUExecutionProvider"]
+            with mock.patch.object(session_class, "download_models", return_value=model):
+                first = load_rembg_session("u2netp", providers, config)
+                second = load_rembg_session("u2netp", providers, config)
+
+            self.assertIsInstance(first, session_class)
+            self.assertEqual(first.model_name, "u2netp")
+            self.assertEqual(len(os.listdir(cache)), 1)
+            # the second load runs the graph the first one optimized and saved
+            self.assertEqual(
+                second.inner_session.get_session_options().graph_optimization_level,
+                onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+            )
+
+
+class StartupBudgetTests(SimpleTestCase):
+    def test_processes_start_within_budget(self):
+        for name, target in settings.STARTUP_BUDGETS.items():
+            with self.subTest(target=name):
+                modules, total = measure_startup(target)
+                self.assertEqual(startup_problems(name, target, modules, total), [])
+
+
+class FaceIndexKeyTests(SimpleTestCase):
+    def test_key_follows_the_file_not_its_bytes(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "input.mp4")
+            with open(path, "wb") as f:
+                f.write(b"frames")
+            key = video_key(path)
+            self.assertEqual(video_key(path), key)
+
+            copy = os.path.join(workdir, "copy.mp4")
+            shutil.copy2(path, copy)
+            self.assertNotEqual(video_key(copy), key)
+
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+            self.assertNotEqual(video_key(path), key)
+
+
+def frame_count(path):
+    capture = cv2.VideoCapture(path)
+    frames = 0
+    while capture.grab():
+        frames += 1
+    capture.release()
+    return frames
+
+
+class RenderManifestTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="manifest_test_")
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def commit_segment(self, manifest, start, end, last=False):
+        path = manifest.segment_path(len(manifest.segments), "main")
+        open(path, "wb").close()
+        manifest.commit(start, end, {"main": path}, {"swapped": end - start}, last=last)
+
+    def test_commit_moves_next_frame_and_finishes_on_last(self):
+        manifest = RenderManifest.open(self.directory, {"input": "a.mp4"})
+        self.assertEqual(manifest.next_frame, 0)
+        self.commit_segment(manifest, 0, 50)
+        self.commit_segment(manifest, 50, 100)
+        self.assertEqual(manifest.next_frame, 100)
+        self.assertFalse(manifest.finished)
+        self.commit_segment(manifest, 100, 120, last=True)
+        self.assertTrue(manifest.finished)
+        self.assertEqual(manifest.frame_stats(), {"swapped": 120})
+
+    def test_reopen_resumes_with_same_settings(self):
+        manifest = RenderManifest.open(self.directory, {"input": "a.mp4"})
+        self.commit_segment(manifest, 0, 50)
+        reopened = RenderManifest.open(self.directory, {"input": "a.mp4"})
+        self.assertEqual(reopened.next_frame, 50)
+
+    def test_reopen_with_other_settings_starts_over(self):
+        manifest = RenderManifest.open(self.directory, {"input": "a.mp4"})
+        self.commit_segment(manifest, 0, 50)
+        reopened = RenderManifest.open(self.directory, {"input": "b.mp4"})
+        self.assertEqual(reopened.next_frame, 0)
+        self.assertEqual(os.listdir(self.directory), [MANIFEST_NAME])
+
+    def test_reopen_with_missing_segment_starts_over(self):
+        manifest = RenderManifest.open(self.directory, {"input": "a.mp4"})
+        self.commit_segment(manifest, 0, 50)
+        os.remove(manifest.segments[0]["files"]["main"])
+        self.assertEqual(RenderManifest.open(self.directory, {"input": "a.mp4"}).next_frame, 0)
+
+
+class CheckpointResumeTests(SimpleTestCase):
+    """
+    Fault injection on stub models: a render killed mid-segment resumes after its last
+    committed segment. Without ffmpeg the segments are checked but not joined.
+    """
+
+    fps = 25
+    seconds = 8
+    segment_frames = 40
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from helpers.benchmark import make_stub_face_image, make_synthetic_video
+
+        cls.workdir = tempfile.mkdtemp(prefix="checkpoint_test_")
+        cls.input = make_synthetic_video(
+            os.path.join(cls.workdir, "input.mp4"), 320, 180, cls.seconds, fps=cls.fps
+        )
+        cls.face_image = make_stub_face_image(os.path.join(cls.workdir, "face.png"))
+        cls.total_frames = cls.seconds * cls.fps
+        cls.ffmpeg = shutil.which("ffmpeg") is not None
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+        super().tearDownClass()
+
+    def read_manifest(self, directory):
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            return json.load(f)
+
+    def test_killed_render_resumes_after_committed_segments(self):
+        from helpers.benchmark import run_spawned
+
+        from .management.commands.fault_inject_render import run_checkpoint_render
+
+        case = {
+            "workdir": self.workdir,
+            "input": self.input,
+            "face_image": self.face_image,
+            "output": os.path.join(self.workdir, "killed.mp4"),
+            "checkpoint_dir": os.path.join(self.workdir, "killed_segments"),
+            "segment_frames": self.segment_frames,
+            "join": self.ffmpeg,
+            "kill_after_segments": 2,
+        }
+        options = {"models": "stub", "workdir": self.workdir}
+        context = multiprocessing.get_context("spawn")
+
+        process = context.Process(target=run_checkpoint_render, args=(case, options))
+        process.start()
+        process.join(timeout=300)
+        self.assertEqual(process.exitcode, -signal.SIGKILL)
+
+        segments = self.read_manifest(case["checkpoint_dir"])["segments"]
+        self.assertEqual([segment["end"] for segment in segments], [40, 80])
+        # the segment being written when the worker died is on disk but not committed
+        self.assertTrue(
+            any(name.endswith(".part.mp4") for name in os.listdir(case["checkpoint_dir"]))
+        )
+        committed = {
+            segment["files"]["main"]: os.path.getmtime(segment["files"]["main"])
+            for segment in segments
+        }
+
+        resumed = run_spawned(
+            run_checkpoint_render, {**case, "kill_after_segments": None}, options
+        )
+
+        frame_stats = resumed["frame_stats"]
+        self.assertEqual(frame_stats["resumed"], 80)
+        rendered = frame_stats["static"] + frame_stats["no_faces"] + frame_stats["swapped"]
+        self.assertEqual(rendered, self.total_frames - 80)
+
+        segments = self.read_manifest(case["checkpoint_dir"])["segments"]
+        self.assertEqual(segments[-1]["end"], self.total_frames)
+        self.assertTrue(segments[-1]["last"])
+        for path, mtime in committed.items():
+            self.assertEqual(os.path.getmtime(path), mtime, f"{path} was rendered again")
+        self.assertEqual(
+            sum(frame_count(segment["files"]["main"]) for segment in segments), self.total_frames
+        )
+        if self.ffmpeg:
+            self.assertEqual(frame_count(case["output"]), self.total_frames)
+
+    def test_job_resumes_its_segments_in_another_group(self):
+        from helpers.benchmark import build_engine
+        from helpers.composite import RenderCancelled
+
+        engine = build_engine({"models": "stub"}, self.workdir, None)
+        if not self.ffmpeg:
+            engine.join_segments = lambda input_video, variant: None
+
+        def variant(name):
+            render = engine.load_variant(
+                name, [self.face_image], os.path.join(self.workdir, f"{name}.mp4")
+            )
+            render.checkpoint_dir = os.path.join(self.workdir, f"group_{name}")
+            return render
+
+        def crash_after_two_segments(variant, manifest):
+            if len(manifest["segments"]) == 2:
+                raise RenderCancelled("worker died")
+
+        with self.assertRaises(RenderCancelled):
+            engine.process_variants(
+                self.input,
+                [variant("a"), variant("b")],
+                checkpoint_dir=self.workdir,
+                segment_frames=self.segment_frames,
+                segment_callback=crash_after_two_segments,
+            )
+        first = self.read_manifest(os.path.join(self.workdir, "group_a"))["segments"]
+        self.assertEqual(first[-1]["end"], 80)
+
+        # job a comes back grouped with a new job c, c renders from the start and a joins
+        # it at frame 80
+        frame_stats = engine.process_variants(
+            self.input,
+            [variant("a"), variant("c")],
+            checkpoint_dir=self.workdir,
+            segment_frames=self.segment_frames,
+        )
+        self.assertEqual(frame_stats["resumed"], 0)
+        segments = self.read_manifest(os.path.join(self.workdir, "group_a"))["segments"]
+        self.assertEqual(segments[:2], first)
+        self.assertEqual(segments[-1]["end"], self.total_frames)
+        for name in ("a", "c"):
+            directory = os.path.join(self.workdir, f"group_{name}")
+            segments = self.read_manifest(directory)["segments"]
+            self.assertEqual(
+                sum(frame_count(segment["files"]["main"]) for segment in segments),
+                self.total_frames,
+            )
+
+    def test_remote_job_resumes_its_checkpoint_in_another_group(self):
+        from helpers.composite import RenderCancelled
+
+        from .management.commands.remote_worker import Command as RemoteWorkerCommand
+
+        workdir = os.path.join(self.workdir, "remote")
+        command = RemoteWorkerCommand()
+        command.load_settings()
+        command.models = "stub"
+        command.workdir = workdir
+        command.cache_dir = os.path.join(workdir, "cache")
+        command.checkpoint_root = os.path.join(workdir, "checkpoints")
+        command.segment_frames = self.segment_frames
+        command.progress_seconds = 3600
+        command.worker_id = "remote-1"
+        command.engine = command.build_engine()
+        if not self.ffmpeg:
+            command.engine.join_segments = (
+                lambda input_video, variant: open(variant.output_video, "wb").close()
+            )
+
+        completed = {}
+
+        def complete(job_id, worker_id, key, renditions, metrics):
+            directory = command.remote_checkpoint_dir({"id": job_id})
+            completed[job_id] = self.read_manifest(directory)["segments"]
+
+        command.client = mock.Mock()
+        command.client.download.side_effect = lambda url, path: shutil.copy(url, path)
+        command.client.complete.side_effect = complete
+
+        def payload(job_id):
+            return {
+                "id": job_id,
+                "name": f"job_{job_id}",
+                "job_type": "full",
+                "input": {"key": "inputs/input.mp4", "url": self.input},
+                "faces": [{"key": "faces/face.png", "url": self.face_image}],
+                "background": None,
+                "render_options": {},
+                "outputs": {"main": {"key": f"outputs/{job_id}.mp4", "url": "https://s3/put"}},
+                "renditions": [],
+            }
+
+        # the worker rendered job 1 alone and died after two segments, without its finally
+        render_dir = os.path.join(workdir, "jobs", "1")
+        os.makedirs(render_dir)
+        variant = command.prepare_remote_variant(command.engine, payload(1), render_dir)
+        variant.checkpoint_dir = command.remote_checkpoint_dir(payload(1))
+
+        def crash_after_two_segments(variant, manifest):
+            if len(manifest["segments"]) == 2:
+                raise RenderCancelled("worker died")
+
+        with self.assertRaises(RenderCancelled):
+            command.engine.process_variants(
+                command.fetch_input(payload(1)["input"]),
+                [variant],
+                checkpoint_dir=command.checkpoint_root,
+                segment_frames=self.segment_frames,
+                segment_callback=crash_after_two_segments,
+            )
+        first = self.read_manifest(variant.checkpoint_dir)["segments"]
+
+        # the requeued job comes back to this worker together with job 2
+        command.run_remote_jobs([payload(1), payload(2)], heartbeat_seconds=3600)
+
+        self.assertEqual(sorted(completed), [1, 2])
+        self.assertEqual(completed[1][:2], first)
+        for segments in completed.values():
+            self.assertEqual(segments[-1]["end"], self.total_frames)
+        # finished jobs drop their checkpoints
+        self.assertEqual(os.listdir(command.checkpoint_root), [])
+
+
+class StaticGateTests(SimpleTestCase):
+    def render(self, threshold):
+        import subprocess
+        from helpers.benchmark import build_engine, make_stub_face_image, make_synthetic_video
+
+        with tempfile.TemporaryDirectory() as workdir:
+            engine = build_engine(
+                {"models": "stub", "static_frame_threshold": threshold}, workdir, None
+            )
+            engine.load_source_faces([make_stub_face_image(os.path.join(workdir, "face.png"))])
+            video = make_synthetic_video(os.path.join(workdir, "input.mp4"), 160, 120, 1)
+            with mock.patch(
+                "helpers.composite.frame_signature", wraps=frame_signature
+            ) as signature:
+                try:
+                    engine.process_video(
+                        video,
+                        os.path.join(workdir, "output.mp4"),
+                        temp_video=os.path.join(workdir, "temp.mp4"),
+                    )
+                except (FileNotFoundError, subprocess.CalledProcessError):
+                    # only the audio merge needs ffmpeg
+                    pass
+            return signature.call_count
+
+    def test_signatures_are_only_computed_with_the_gate_on(self):
+        self.assertEqual(self.render(None), 0)
+        self.assertEqual(self.render(2), 25)
+
+
+class SharedFrameRingTests(SimpleTestCase):
+    def test_slots_are_handed_out_until_released(self):
+        ring = SharedFrameRing((4, 6, 3), slots=2)
+        try:
+            taken = {ring.acquire(timeout=5), ring.acquire(timeout=5)}
+            self.assertEqual(taken, {0, 1})
+            with self.assertRaises(queue.Empty):
+                ring.acquire(timeout=0.1)
+
+            ring.frame(1)[:] = 7
+            ring.release(1)
+            self.assertEqual(ring.acquire(timeout=5), 1)
+            self.assertTrue((ring.frames[1] == 7).all())
+            self.assertFalse(ring.frames[0].any())
+        finally:
+            name = ring.shm.name
+            ring.close()
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+    def test_spawned_stages_share_frames_in_order(self):
+        result = run_transport_case("shared", 64, 48, frames=40, slots=3, timeout=120)
+        self.assertEqual((result["frames"], result["mismatched"]), (40, 0))
 
-# Create your tests here.
@@ -2,11 +2,31 @@ from django.urls import path
 from .views import (
     ListAllVideosView, 
     VideoUploadView, 
-    OutputVideoDetailView
+    OutputVideoDetailView,
+    ConfirmRenderView,
+    BatchUploadView,
+    BatchStatusView,
+    WorkersView,
+    JobStatusView,
+    WorkerClaimView,
+    WorkerProgressView,
+    WorkerCompleteView,
+    WorkerFailView,
+    WorkerStateView,
 )
 
 urlpatterns = [
     path("videos/", VideoUploadView.as_view(), name="video-generation"),
     path("videos/details/<int:pk>/", OutputVideoDetailView.as_view(), name="video-detail"),
+    path("videos/details/<int:pk>/confirm/", ConfirmRenderView.as_view(), name="video-confirm"),
+    path("videos/batch/", BatchUploadView.as_view(), name="video-batch"),
+    path("videos/batch/<int:pk>/", BatchStatusView.as_view(), name="video-batch-status"),
+    path("videos/status/", JobStatusView.as_view(), name="video-status"),
     path("videos/list/", ListAllVideosView.as_view(), name="list-all-videos"),
+    path("workers/", WorkersView.as_view(), name="worker-status"),
+    path("worker/claim/", WorkerClaimView.as_view(), name="worker-claim"),
+    path("worker/jobs/<int:pk>/progress/", WorkerProgressView.as_view(), name="worker-progress"),
+    path("worker/jobs/<int:pk>/complete/", WorkerCompleteView.as_view(), name="worker-complete"),
+    path("worker/jobs/<int:pk>/fail/", WorkerFailView.as_view(), name="worker-fail"),
+    path("worker/state/", WorkerStateView.as_view(), name="worker-state"),
 ]
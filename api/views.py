@@ -1,3 +1,4 @@
+from django.http import HttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -8,9 +9,33 @@ from .serializers import (
     VideoDataCreateSerializer,
     VideoDataResponseSerializer,
     OutputVideoSerializer,
+    JobOptionsSerializer,
+    BatchCreateSerializer,
+    JobStatusQuerySerializer,
+    WorkerClaimSerializer,
+    WorkerProgressSerializer,
+    WorkerCompleteSerializer,
+    WorkerFailSerializer,
+    WorkerStateSerializer,
 )
-from .models import OutputVideo
-from .services import create_output_job
+from .models import JobBatch, OutputVideo
+from .services import create_batch, create_jobs, confirm_render_job
+from .metrics import render_prometheus_metrics
+from .workers import live_workers
+from .permissions import WorkerTokenPermission
+from .remote import (
+    claim_remote_jobs,
+    complete_remote_job,
+    fail_remote_job,
+    heartbeat_seconds,
+    report_progress,
+    report_worker_state,
+    stage_uploads_later,
+)
+
+
+def request_client_id(request):
+    return request.headers.get("X-Client-Id") or request.META.get("REMOTE_ADDR")
 
 
 class VideoUploadView(APIView):
@@ -19,12 +44,102 @@ class VideoUploadView(APIView):
     def post(self, request):
         serializer = VideoDataCreateSerializer(data=request.data, context={"request": request})
         serializer.is_valid(raise_exception=True)
+        options = JobOptionsSerializer(data=request.data)
+        options.is_valid(raise_exception=True)
         video = serializer.save()
-        create_output_job(video)
+        client_id = request_client_id(request)
+        create_jobs(video, client_id=client_id, **options.validated_data)
+        stage_uploads_later([video.id])
         resp = VideoDataResponseSerializer(video, context={"request": request})
         return Response(resp.data, status=status.HTTP_201_CREATED)
 
 
+class BatchUploadView(APIView):
+    parser_classes = [MultiPartParser, FormParser]
+
+    def post(self, request):
+        serializer = BatchCreateSerializer(data=request.data, context={"request": request})
+        serializer.is_valid(raise_exception=True)
+        options = JobOptionsSerializer(data=request.data)
+        options.is_valid(raise_exception=True)
+        batch, jobs = create_batch(
+            client_id=request_client_id(request),
+            **serializer.validated_data,
+            **options.validated_data,
+        )
+        variant_of = {}
+        for job in jobs:
+            variant_of.setdefault(job.video_data_id, len(variant_of))
+        stage_uploads_later(list(variant_of))
+        return Response(
+            {
+                "batch_id": batch.id,
+                "jobs": [
+                    {
+                        "id": job.id,
+                        "video_data_id": job.video_data_id,
+                        "variant": variant_of[job.video_data_id],
+                        "job_type": job.job_type,
+                        "status": job.status,
+                    }
+                    for job in jobs
+                ],
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class BatchStatusView(APIView):
+    def get(self, request, pk):
+        batch = JobBatch.objects.filter(pk=pk).first()
+        if not batch:
+            return Response({"detail": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+        jobs = list(
+            batch.jobs.order_by("id").values(
+                "id", "video_data_id", "job_type", "status", "progress", "final_video_url"
+            )
+        )
+        counts = {}
+        for job in jobs:
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return Response(
+            {
+                "batch_id": batch.id,
+                "created_at": batch.created_at,
+                "total": len(jobs),
+                "counts": counts,
+                "progress": round(sum(job["progress"] for job in jobs) / len(jobs)) if jobs else 0,
+                "done": all(job["status"] in ("completed", "failed") for job in jobs),
+                "jobs": jobs,
+            }
+        )
+
+
+class JobStatusView(APIView):
+    """
+    Status and progress of many jobs in one query, for dashboards polling a set of jobs
+    instead of fetching the whole list or every job's details.
+    """
+
+    def get(self, request):
+        query = JobStatusQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        ids = query.validated_data["ids"]
+
+        jobs = {
+            job["id"]: job
+            for job in OutputVideo.objects.filter(pk__in=ids).values(
+                "id", "status", "progress", "job_type", "final_video_url", "created_at"
+            )
+        }
+        return Response(
+            {
+                "jobs": [jobs[pk] for pk in ids if pk in jobs],
+                "missing": [pk for pk in ids if pk not in jobs],
+            }
+        )
+
+
 class OutputVideoDetailView(APIView):
     def get(self, request, pk):
         obj = OutputVideo.objects.filter(pk=pk).first()
@@ -34,8 +149,129 @@ class OutputVideoDetailView(APIView):
         return Response(serializer.data)
 
 
+class ConfirmRenderView(APIView):
+    def post(self, request, pk):
+        obj = OutputVideo.objects.filter(pk=pk).first()
+        if not obj:
+            return Response({"detail": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+        if not confirm_render_job(obj):
+            return Response(
+                {"detail": "Job is not a render waiting for confirmation"},
+                status=status.HTTP_409_CONFLICT,
+            )
+        obj.refresh_from_db()
+        serializer = OutputVideoSerializer(obj, context={"request": request})
+        return Response(serializer.data)
+
+
 class ListAllVideosView(APIView):
     def get(self, request):
-        videos = OutputVideo.objects.all().order_by("-created_at")
+        videos = (
+            OutputVideo.objects.all()
+            .prefetch_related("renditions")
+            .order_by("-created_at")
+        )
         serializer = OutputVideoSerializer(videos, many=True, context={"request": request})
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+
+class WorkersView(APIView):
+    def get(self, request):
+        workers = list(
+            live_workers().order_by("started_at").values(
+                "worker_id",
+                "hostname",
+                "state",
+                "load_seconds",
+                "warmup_seconds",
+                "started_at",
+                "ready_at",
+                "heartbeat_at",
+            )
+        )
+        return Response(
+            {
+                "live": len(workers),
+                "ready": sum(worker["state"] in ("ready", "busy") for worker in workers),
+                "idle": sum(worker["state"] == "ready" for worker in workers),
+                "workers": workers,
+            }
+        )
+
+
+LEASE_LOST = {"detail": "Job is not held by this worker"}
+
+
+class WorkerAPIView(APIView):
+    """
+    Endpoints remote workers (`remote_worker`) use instead of the database: token
+    authenticated, no session or csrf.
+    """
+
+    authentication_classes = []
+    permission_classes = [WorkerTokenPermission]
+
+
+class WorkerClaimView(WorkerAPIView):
+    def post(self, request):
+        serializer = WorkerClaimSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        jobs = claim_remote_jobs(
+            serializer.validated_data["worker_id"], serializer.validated_data["limit"]
+        )
+        return Response({"jobs": jobs, "heartbeat_seconds": heartbeat_seconds()})
+
+
+class WorkerProgressView(WorkerAPIView):
+    def post(self, request, pk):
+        serializer = WorkerProgressSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not report_progress(
+            pk, serializer.validated_data["worker_id"], serializer.validated_data.get("progress")
+        ):
+            return Response(LEASE_LOST, status=status.HTTP_409_CONFLICT)
+        return Response({"ok": True})
+
+
+class WorkerCompleteView(WorkerAPIView):
+    def post(self, request, pk):
+        serializer = WorkerCompleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        if not complete_remote_job(
+            pk, data["worker_id"], data["output_key"], data["renditions"], data["metrics"]
+        ):
+            return Response(LEASE_LOST, status=status.HTTP_409_CONFLICT)
+        return Response({"ok": True})
+
+
+class WorkerFailView(WorkerAPIView):
+    def post(self, request, pk):
+        serializer = WorkerFailSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        if not fail_remote_job(pk, data["worker_id"], data["error"], data["metrics"]):
+            return Response(LEASE_LOST, status=status.HTTP_409_CONFLICT)
+        return Response({"ok": True})
+
+
+class WorkerStateView(WorkerAPIView):
+    def post(self, request):
+        serializer = WorkerStateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = dict(serializer.validated_data)
+        fields = {
+            name: data[name]
+            for name in ("load_seconds", "warmup_seconds")
+            if data.get(name) is not None
+        }
+        report_worker_state(data["worker_id"], data["state"], data.get("hostname"), **fields)
+        return Response({"ok": True})
+
+
+class MetricsView(APIView):
+    def get(self, request):
+        return HttpResponse(
+            render_prometheus_metrics(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
@@ -0,0 +1,173 @@
+import json
+import os
+import socket
+import time
+import threading
+from datetime import timedelta
+
+from django.db import DatabaseError, close_old_connections, connection
+from django.utils import timezone
+
+from .leases import lease_options
+from .models import OutputVideo, WorkerStatus
+
+
+def register_worker(worker_id, hostname=None):
+    """
+    Create this worker's WorkerStatus row in the warming state, before models load.
+    Remote workers register through the API with their own hostname.
+    """
+    now = timezone.now()
+    status, _ = WorkerStatus.objects.update_or_create(
+        worker_id=worker_id,
+        defaults={
+            "hostname": hostname or socket.gethostname(),
+            "state": "warming",
+            "heartbeat_at": now,
+        },
+    )
+    return status
+
+
+def set_worker_state(worker_id, state, **fields):
+    WorkerStatus.objects.filter(worker_id=worker_id).update(
+        state=state, heartbeat_at=timezone.now(), **fields
+    )
+
+
+def live_workers(now=None, options=None):
+    """
+    Workers that heartbeated within lease_seconds and haven't stopped.
+    """
+    options = options or lease_options()
+    cutoff = (now or timezone.now()) - timedelta(seconds=options["lease_seconds"])
+    return WorkerStatus.objects.filter(heartbeat_at__gte=cutoff).exclude(state="stopped")
+
+
+def ready_workers(now=None, options=None):
+    """
+    Live workers with their models loaded and warmed up (idle or rendering).
+    """
+    return live_workers(now, options).filter(state__in=("ready", "busy"))
+
+
+def reap_stale_workers(now=None, options=None):
+    """
+    Mark workers without a heartbeat for lease_seconds as stopped. Returns the count.
+    """
+    options = options or lease_options()
+    cutoff = (now or timezone.now()) - timedelta(seconds=options["lease_seconds"])
+    return (
+        WorkerStatus.objects.filter(heartbeat_at__lt=cutoff)
+        .exclude(state="stopped")
+        .update(state="stopped")
+    )
+
+
+def write_ready_file(path, worker_id, **details):
+    """
+    Readiness file for probes that can't reach the database (a container exec probe
+    checks it exists). Written to a temp name and renamed so it is never half written.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(
+            {"worker_id": worker_id, "ready_at": timezone.now().isoformat(), **details}, f
+        )
+    os.replace(temp_path, path)
+
+
+def remove_ready_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class WorkerHeartbeat:
+    """
+    Keeps the worker's heartbeat_at fresh from a background thread for the whole life of
+    the process, renders included (the main loop is blocked while one runs).
+    """
+
+    def __init__(self, worker_id, options=None):
+        self.worker_id = worker_id
+        self.options = options or lease_options()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="worker-heartbeat", daemon=True
+        )
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.options["heartbeat_seconds"]):
+                close_old_connections()
+                try:
+                    WorkerStatus.objects.filter(worker_id=self.worker_id).update(
+                        heartbeat_at=timezone.now()
+                    )
+                except Exception:
+                    continue
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+class ProgressWriter:
+    """
+    Coalesces a render's progress callbacks (every 10 frames, several a second) into at
+    most one UPDATE of the jobs rendering together per interval_seconds, and only when the
+    percentage changed. Progress is informational: a write that fails because the
+    database is busy is skipped rather than failing the render, the next one catches up.
+    The last update held back is kept so flush can write it once the render stops.
+    """
+
+    def __init__(self, interval_seconds=2.0):
+        self.interval_seconds = interval_seconds
+        self.written = None
+        self.pending = None
+        self.last_write = float("-inf")
+        self.writes = 0
+        self.errors = 0
+
+    def update(self, job_ids, percent, force=False):
+        percent = max(0, min(100, int(percent)))
+        now = time.monotonic()
+        if percent == self.written:
+            self.pending = None
+            return False
+        if not force and now - self.last_write < self.interval_seconds:
+            self.pending = (list(job_ids), percent)
+            return False
+        try:
+            OutputVideo.objects.filter(pk__in=job_ids).update(progress=percent)
+        except DatabaseError:
+            self.errors += 1
+            self.pending = (list(job_ids), percent)
+            return False
+        self.written = percent
+        self.pending = None
+        self.last_write = now
+        self.writes += 1
+        return True
+
+    def flush(self, job_ids=None):
+        """
+        Write the last update the interval held back, to job_ids if given (the jobs the
+        worker still owns) rather than the ones it was made for.
+        """
+        if self.pending is None:
+            return False
+        pending_ids, percent = self.pending
+        return self.update(pending_ids if job_ids is None else job_ids, percent, force=True)
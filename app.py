@@ -1,15 +1,12 @@
 import streamlit as st
 from dotenv import load_dotenv
 import os
-import requests
+from helpers.api_client import ApiError, MagicRollClient
 load_dotenv()
 
 video_id = None
 
 BACKEND_URL = os.getenv("BACKEND_URL")
-VIDEO_GENERATION_ENDPOINT = f"{BACKEND_URL}/api/videos/"
-LIST_VIDEOS_ENDPOINT = f"{BACKEND_URL}/api/videos/list/"
-DETAIL_VIDEO_ENDPOINT = f"{BACKEND_URL}/api/videos/details/{video_id}/"
 
 if "videos" not in st.session_state:
     st.session_state.videos = []
@@ -18,11 +15,33 @@ if "selected_video_id" not in st.session_state:
     st.session_state.selected_video_id = None
 
 
+@st.cache_resource
+def get_client():
+    # one pooled keep-alive session for every browser session of this server
+    return MagicRollClient(BACKEND_URL)
+
+
+client = get_client()
+
+
 def fetch_videos_list():
-    response = requests.get(LIST_VIDEOS_ENDPOINT)
-    if response.status_code == 200:
-        return response.json()
-    return []
+    try:
+        return client.list_videos()
+    except (ApiError, OSError):
+        return []
+
+
+def fetch_statuses(videos):
+    """
+    Fresh status/progress of the listed jobs in one request instead of a detail request
+    per job, the full list is only fetched again on Refresh.
+    """
+    if not videos:
+        return {}
+    try:
+        return client.job_statuses([v["id"] for v in videos])
+    except (ApiError, OSError):
+        return {}
 
 
 st.title("AI Video Transformation Pipeline")
@@ -34,6 +53,8 @@ with tab1:
     youtube_link = st.text_input("Enter YouTube Video Link:")
     face_images = st.file_uploader("Upload Face Images:", type=["png", "jpg", "jpeg"], accept_multiple_files=True)
     bg_image = st.file_uploader("Upload Background Image:", type=["png", "jpg", "jpeg"])
+    preview_first = st.checkbox("Render a quick preview first")
+    auto_render = st.checkbox("Start the full render right away", value=True, disabled=not preview_first)
 
     if st.button("Process Video"):
         if not youtube_link or not face_images:
@@ -49,14 +70,20 @@ with tab1:
                 )
 
             data = {'video_url': youtube_link}
+            if preview_first:
+                data['preview'] = 'true'
+                data['auto_render'] = 'true' if auto_render else 'false'
             if bg_image:
                 files.append(
                     ('background_image', (bg_image.name, bg_image.read(), bg_image.type))
                 )
-            response = requests.post(VIDEO_GENERATION_ENDPOINT, data=data, files=files)
-            if response.status_code == 201:
+            try:
+                created = client.create_video(data, files)
+            except (ApiError, OSError):
+                created = None
+            if created is not None:
                 st.success("Video processing started successfully!")
-                video_id = response.json().get("id")
+                video_id = created.get("id")
 
                 if video_id != None:
                     st.write(f"Video ID: {video_id}")
@@ -74,7 +101,10 @@ with tab2:
     if st.button("Refresh Video List"):
         st.session_state.videos = fetch_videos_list()
 
+    statuses = fetch_statuses(st.session_state.videos)
     if st.session_state.videos:
+        for v in st.session_state.videos:
+            v.update(statuses.get(v["id"], {}))
         video_map = {
             f"ID: {v['id']} | Status: {v['status']} | Progress: {v['progress']}%": v["id"] 
             for v in st.session_state.videos
@@ -88,13 +118,13 @@ with tab2:
         st.session_state.selected_video_id = video_map[selected_label]
 
     if st.session_state.selected_video_id:
-        detail_url = f"{BACKEND_URL}/api/videos/details/{st.session_state.selected_video_id}/"
-        detail_response = requests.get(detail_url)
+        # the status request above already has everything shown here
+        video = statuses.get(st.session_state.selected_video_id)
 
-        if detail_response.status_code == 200:
-            video = detail_response.json()
+        if video is not None:
 
             st.subheader(f"Video Details (ID: {video['id']})")
+            st.write(f"Type: {video.get('job_type', 'render')}")
             st.write(f"Status: {video['status']}")
             st.write(f"Progress: {video['progress']}%")
             st.write(f"Created At: {video['created_at']}")
@@ -102,6 +132,13 @@ with tab2:
                 st.write(video['final_video_url'])
             elif video['status'] == 'failed':
                 st.error("Video processing failed.")
+            elif video['status'] == 'pending':
+                if st.button("Start full render"):
+                    try:
+                        client.confirm_render(video['id'])
+                        st.success("Full render queued")
+                    except (ApiError, OSError):
+                        st.error("Unable to start the full render.")
 
 
 
@@ -0,0 +1,244 @@
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class ApiError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class MagicRollClient:
+    """
+    Client of the backend API over one pooled requests.Session: connections are kept
+    alive and reused across calls, idempotent GETs retry connection errors, and GET
+    responses are cached for cache_ttl seconds so several widgets (or quick reruns)
+    asking for the same thing cost one request. Any POST clears the cache.
+    Safe to share between threads, like the sessions of a Streamlit server.
+    """
+
+    def __init__(
+        self, base_url, cache_ttl=2.0, timeout=10, pool_size=10, retries=2, status_ids=200
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.cache_ttl = cache_ttl
+        self.timeout = timeout
+        # the server's STATUS_MAX_IDS
+        self.status_ids = status_ids
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=0.2,
+                allowed_methods=("GET",),
+                status_forcelist=(502, 503, 504),
+                raise_on_status=False,
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # sent with every API call (not with the presigned object urls a worker fetches)
+        self.headers = {}
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _url(self, path):
+        return f"{self.base_url}/api/{path.lstrip('/')}"
+
+    def _check(self, response):
+        if response.status_code >= 400:
+            try:
+                detail = response.json()
+            except ValueError:
+                detail = response.text
+            raise ApiError(response.status_code, detail)
+        return response.json()
+
+    def get(self, path, params=None):
+        key = (path, tuple(sorted((params or {}).items())))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None and now - cached[0] < self.cache_ttl:
+            return cached[1]
+
+        data = self._check(
+            self.session.get(
+                self._url(path), params=params, headers=self.headers, timeout=self.timeout
+            )
+        )
+        with self._lock:
+            self._cache[key] = (now, data)
+        return data
+
+    def post(self, path, data=None, files=None, json=None):
+        response = self.session.post(
+            self._url(path),
+            data=data,
+            files=files,
+            json=json,
+            headers=self.headers,
+            timeout=self.timeout,
+        )
+        self.clear_cache()
+        return self._check(response)
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def list_videos(self):
+        return self.get("videos/list/")
+
+    def video_details(self, job_id):
+        return self.get(f"videos/details/{job_id}/")
+
+    def job_statuses(self, ids):
+        """
+        {id: {"id", "status", "progress", "job_type", "final_video_url", "created_at"}}
+        of the jobs in ids that exist, one request per status_ids ids.
+        """
+        ids = list(dict.fromkeys(int(job_id) for job_id in ids))
+        statuses = {}
+        for start in range(0, len(ids), self.status_ids):
+            chunk = ids[start : start + self.status_ids]
+            data = self.get("videos/status/", {"ids": ",".join(str(job_id) for job_id in chunk)})
+            for job in data["jobs"]:
+                statuses[job["id"]] = job
+        return statuses
+
+    def create_video(self, data, files):
+        return self.post("videos/", data=data, files=files)
+
+    def confirm_render(self, job_id):
+        return self.post(f"videos/details/{job_id}/confirm/")
+
+    def close(self):
+        self.session.close()
+
+
+class WorkerApiClient(MagicRollClient):
+    """
+    Client of the worker API (/api/worker/) a remote worker claims, heartbeats and
+    finishes jobs through, and of the presigned object urls its payloads carry.
+    Nothing is cached, every call is a state change or has to be fresh.
+    """
+
+    def __init__(self, base_url, token, timeout=30, transfer_timeout=300, **kwargs):
+        super().__init__(base_url, cache_ttl=0, timeout=timeout, **kwargs)
+        self.transfer_timeout = transfer_timeout
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def claim(self, worker_id, limit=1):
+        return self.post("worker/claim/", json={"worker_id": worker_id, "limit": limit})
+
+    def report_progress(self, job_id, worker_id, progress=None):
+        return self.post(
+            f"worker/jobs/{job_id}/progress/",
+            json={"worker_id": worker_id, "progress": progress},
+        )
+
+    def complete(self, job_id, worker_id, output_key, renditions=(), metrics=None):
+        return self.post(
+            f"worker/jobs/{job_id}/complete/",
+            json={
+                "worker_id": worker_id,
+                "output_key": output_key,
+                "renditions": list(renditions),
+                "metrics": metrics or {},
+            },
+        )
+
+    def fail(self, job_id, worker_id, error="", metrics=None):
+        return self.post(
+            f"worker/jobs/{job_id}/fail/",
+            json={"worker_id": worker_id, "error": error[:1000], "metrics": metrics or {}},
+        )
+
+    def report_state(self, worker_id, state, **fields):
+        return self.post("worker/state/", json={"worker_id": worker_id, "state": state, **fields})
+
+    def download(self, url, path, chunk_size=1024 * 1024):
+        """
+        Stream a presigned GET url to path (through a temp file, a failed transfer never
+        leaves a partial file behind).
+        """
+        temp_path = f"{path}.part"
+        with self.session.get(url, stream=True, timeout=self.transfer_timeout) as response:
+            if response.status_code >= 400:
+                raise ApiError(response.status_code, response.text[:200])
+            with open(temp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+        os.replace(temp_path, path)
+        return path
+
+    def upload(self, url, path):
+        """
+        PUT a file to a presigned url, streamed from disk.
+        """
+        with open(path, "rb") as f:
+            response = self.session.put(url, data=f, timeout=self.transfer_timeout)
+        if response.status_code >= 400:
+            raise ApiError(response.status_code, response.text[:200])
+
+
+class RemoteLeaseHeartbeat:
+    """
+    LeaseHeartbeat of a remote worker. The render callback only stores its progress
+    here; this thread posts the latest value every progress_seconds when it changed and
+    at least every heartbeat_seconds (each post renews the lease), so a render costs a
+    request every few seconds instead of one per progress callback. lost is set once the
+    backend answers 409, the job was reaped and may belong to another worker.
+    """
+
+    def __init__(self, client, job_id, worker_id, heartbeat_seconds, progress_seconds=5):
+        self.client = client
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.heartbeat_seconds = heartbeat_seconds
+        self.progress_seconds = min(progress_seconds, heartbeat_seconds)
+        self.progress = None
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"remote-lease-{job_id}", daemon=True
+        )
+
+    def _run(self):
+        sent = None
+        last_beat = time.monotonic()
+        while not self._stop.wait(self.progress_seconds):
+            progress = self.progress
+            if progress == sent and time.monotonic() - last_beat < self.heartbeat_seconds:
+                continue
+            try:
+                self.client.report_progress(self.job_id, self.worker_id, progress)
+            except ApiError as e:
+                if e.status_code == 409:
+                    self.lost.set()
+                    return
+                continue
+            except requests.RequestException:
+                # the backend being briefly unreachable isn't a lost lease, the next beat retries
+                continue
+            sent = progress
+            last_beat = time.monotonic()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        return False
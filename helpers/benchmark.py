@@ -0,0 +1,315 @@
+import os
+import shutil
+import subprocess
+import multiprocessing
+import cv2
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+import onnxruntime as ort
+from PIL import Image
+from insightface.app.common import Face
+from helpers.composite import FaceSwapBackgroundEngine
+from helpers.onnx_session import load_insightface_model, resolve_session_config
+from helpers.profiling import peak_rss_mb
+
+# BGR colour of the synthetic stub faces, nothing else in the synthetic frames has red > 100
+STUB_FACE_COLOR = (60, 140, 230)
+FRAME_STAGES = ("decode", "gate", "detect", "swap", "matte", "blend", "encode")
+
+
+def _conv_weight(name, out_channels, in_channels, rng):
+    weight = rng.standard_normal((out_channels, in_channels, 3, 3)).astype(np.float32) * 0.1
+    return numpy_helper.from_array(weight, name)
+
+
+def _save_model(graph, path):
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 7
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+    return path
+
+
+def build_stub_conv_model(path, size, out_channels=1, seed=0):
+    """
+    Small two-layer conv net on a 1x3xSIZExSIZE input, used as a stand-in for the detector and
+    matting models so those stages still pay for a real onnxruntime call.
+    """
+    rng = np.random.default_rng(seed)
+    graph = helper.make_graph(
+        [
+            helper.make_node("Conv", ["input", "w1"], ["h1"], pads=[1, 1, 1, 1], strides=[2, 2]),
+            helper.make_node("Relu", ["h1"], ["a1"]),
+            helper.make_node("Conv", ["a1", "w2"], ["h2"], pads=[1, 1, 1, 1]),
+            helper.make_node("Sigmoid", ["h2"], ["output"]),
+        ],
+        "stub_conv",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, [1, 3, size, size])],
+        [
+            helper.make_tensor_value_info(
+                "output", TensorProto.FLOAT, [1, out_channels, size // 2, size // 2]
+            )
+        ],
+        initializer=[_conv_weight("w1", 16, 3, rng), _conv_weight("w2", out_channels, 16, rng)],
+    )
+    return _save_model(graph, path)
+
+
+def build_stub_swapper_model(path, seed=0):
+    """
+    Graph with the inswapper_128 interface (target 1x3x128x128, source 1x512, emap as the last
+    initializer) so the real INSwapper class, including its paste back, runs on top of it.
+    """
+    rng = np.random.default_rng(seed)
+    emap = np.eye(512, dtype=np.float32)
+    graph = helper.make_graph(
+        [
+            helper.make_node("Conv", ["target", "w1"], ["h1"], pads=[1, 1, 1, 1]),
+            helper.make_node("Relu", ["h1"], ["a1"]),
+            helper.make_node("Conv", ["a1", "w2"], ["h2"], pads=[1, 1, 1, 1]),
+            helper.make_node("ReduceMean", ["source"], ["s"], axes=[1], keepdims=1),
+            helper.make_node("Mul", ["s", "zero"], ["s0"]),
+            helper.make_node("Add", ["h2", "s0"], ["h3"]),
+            helper.make_node("Sigmoid", ["h3"], ["output"]),
+        ],
+        "stub_inswapper",
+        [
+            helper.make_tensor_value_info("target", TensorProto.FLOAT, [1, 3, 128, 128]),
+            helper.make_tensor_value_info("source", TensorProto.FLOAT, [1, 512]),
+        ],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, [1, 3, 128, 128])],
+        initializer=[
+            _conv_weight("w1", 16, 3, rng),
+            _conv_weight("w2", 3, 16, rng),
+            numpy_helper.from_array(np.zeros((1, 1), dtype=np.float32), "zero"),
+            numpy_helper.from_array(emap, "emap"),
+        ],
+    )
+    return _save_model(graph, path)
+
+
+def stub_kps(bbox):
+    x1, y1, x2, y2 = bbox
+    w, h = x2 - x1, y2 - y1
+    points = [(0.3, 0.4), (0.7, 0.4), (0.5, 0.6), (0.35, 0.8), (0.65, 0.8)]
+    return np.array([[x1 + px * w, y1 + py * h] for px, py in points], dtype=np.float32)
+
+
+class StubFaceAnalysis:
+    """
+    FaceAnalysis stand-in: runs a stub conv model at det_size and finds the synthetic
+    faces by colour, returning insightface Face objects with bbox/kps/embedding.
+    """
+
+    def __init__(self, model_path, providers, det_size=(640, 640)):
+        self.session = ort.InferenceSession(model_path, providers=list(providers))
+        self.det_size = det_size
+        self.embedding = np.random.default_rng(0).standard_normal(512).astype(np.float32)
+
+    def get(self, img, max_num=0):
+        det_w, det_h = self.det_size
+        scale = min(det_w / img.shape[1], det_h / img.shape[0])
+        resized = cv2.resize(img, (int(img.shape[1] * scale), int(img.shape[0] * scale)))
+        det_img = np.zeros((det_h, det_w, 3), dtype=np.uint8)
+        det_img[: resized.shape[0], : resized.shape[1]] = resized
+
+        blob = cv2.dnn.blobFromImage(det_img, 1.0 / 128, self.det_size, (127.5, 127.5, 127.5), swapRB=True)
+        self.session.run(None, {"input": blob})
+
+        color = np.array(STUB_FACE_COLOR)
+        mask = cv2.inRange(det_img, np.clip(color - 40, 0, 255), np.clip(color + 40, 0, 255))
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+
+        faces = []
+        for x, y, w, h, area in stats[1:count]:
+            if area < 50:
+                continue
+            bbox = np.array([x, y, x + w, y + h], dtype=np.float32) / scale
+            faces.append(
+                Face(bbox=bbox, kps=stub_kps(bbox), det_score=1.0, embedding=self.embedding)
+            )
+        return faces
+
+
+class StubMattingSession:
+    """
+    rembg session stand-in, predict() runs a stub conv model at input_size x input_size
+    and returns a PIL mask.
+    """
+
+    def __init__(self, model_path, providers, input_size=320):
+        self.inner_session = ort.InferenceSession(model_path, providers=list(providers))
+        self.input_size = input_size
+
+    def predict(self, img, *args, **kwargs):
+        size = (self.input_size, self.input_size)
+        small = np.asarray(img.convert("RGB").resize(size), dtype=np.float32) / 255.0
+        blob = small.transpose(2, 0, 1)[None]
+        prediction = self.inner_session.run(None, {"input": blob})[0]
+        mask = (prediction[0, 0] * 255).astype(np.uint8)
+        return [Image.fromarray(mask, mode="L").resize(img.size, Image.LANCZOS)]
+
+
+def draw_face(frame, center, size, face_image=None):
+    x, y = center
+    w, h = size
+    if face_image is None:
+        cv2.ellipse(frame, (x, y), (w // 2, h // 2), 0, 0, 360, STUB_FACE_COLOR, -1)
+        return
+
+    x1, y1 = max(0, x - w // 2), max(0, y - h // 2)
+    x2, y2 = min(frame.shape[1], x1 + w), min(frame.shape[0], y1 + h)
+    frame[y1:y2, x1:x2] = cv2.resize(face_image, (w, h))[: y2 - y1, : x2 - x1]
+
+
+def make_synthetic_video(path, width, height, seconds, fps=25, face_count=1, face_image=None):
+    """
+    Writes a clip with a moving background and face_count moving faces (stub ellipses,
+    or face_image pasted in when benchmarking the real models). Adds a sine audio track
+    when ffmpeg is available so the audio merge stage has work to do.
+    """
+    total_frames = int(seconds * fps)
+    silent_path = path + ".silent.mp4"
+    writer = cv2.VideoWriter(silent_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+
+    xs = np.linspace(0, 255, width, dtype=np.float32)
+    ys = np.linspace(0, 255, height, dtype=np.float32)
+    face_h = max(32, height // 4)
+    face_w = int(face_h * 0.8)
+
+    for index in range(total_frames):
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[:, :, 0] = ((xs[None, :] + index * 4) % 256).astype(np.uint8)
+        frame[:, :, 1] = ((ys[:, None] + index * 2) % 256).astype(np.uint8)
+        frame[:, :, 2] = 40
+
+        for face_index in range(face_count):
+            slot = (face_index + 0.5) / face_count
+            offset = np.sin(index / fps * 2 + face_index) * width * 0.05
+            center = (int(width * slot + offset), int(height * 0.45))
+            draw_face(frame, center, (face_w, face_h), face_image)
+
+        writer.write(frame)
+    writer.release()
+
+    if shutil.which("ffmpeg") is None:
+        os.replace(silent_path, path)
+        return path
+
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-i", silent_path,
+            "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+            "-c:v", "copy", "-c:a", "aac", "-shortest", path,
+        ],
+        check=True,
+    )
+    os.remove(silent_path)
+    return path
+
+
+def make_stub_face_image(path, size=256):
+    image = np.full((size, size, 3), 30, dtype=np.uint8)
+    draw_face(image, (size // 2, size // 2), (int(size * 0.6), int(size * 0.75)))
+    cv2.imwrite(path, image)
+    return path
+
+
+def make_background_image(path, width=1280, height=720):
+    xs = np.linspace(0, 255, width, dtype=np.uint8)
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    image[:, :, 0] = xs[None, :]
+    image[:, :, 1] = 90
+    cv2.imwrite(path, image)
+    return path
+
+
+def real_models_available(swapper_model_path, rembg_model="isnet-general-use"):
+    buffalo_dir = os.path.expanduser(os.path.join("~", ".insightface", "models", "buffalo_l"))
+    rembg_path = os.path.expanduser(os.path.join("~", ".u2net", f"{rembg_model}.onnx"))
+    return all(
+        os.path.exists(path) for path in (str(swapper_model_path), buffalo_dir, rembg_path)
+    )
+
+
+def build_engine(options, workdir, background_path):
+    providers = ("CPUExecutionProvider",)
+
+    if options["models"] == "real":
+        return FaceSwapBackgroundEngine(
+            swapper_model_path=str(options["swapper_model_path"]),
+            bg_image_path=background_path,
+            providers=providers,
+            session_options=options.get("session_options"),
+            static_frame_threshold=options.get("static_frame_threshold"),
+        )
+
+    config = resolve_session_config(None)
+    stub_dir = os.path.join(workdir, "stub_models")
+    os.makedirs(stub_dir, exist_ok=True)
+    swapper_path = build_stub_swapper_model(os.path.join(stub_dir, "inswapper_stub.onnx"))
+    return FaceSwapBackgroundEngine(
+        swapper_model_path=swapper_path,
+        bg_image_path=background_path,
+        providers=providers,
+        static_frame_threshold=options.get("static_frame_threshold"),
+        face_app=StubFaceAnalysis(
+            build_stub_conv_model(os.path.join(stub_dir, "det_stub.onnx"), 640, seed=1),
+            providers,
+        ),
+        face_swapper=load_insightface_model(swapper_path, providers, config),
+        rembg_session=(
+            StubMattingSession(
+                build_stub_conv_model(os.path.join(stub_dir, "matte_stub.onnx"), 320, seed=2),
+                providers,
+            )
+            if background_path
+            else None
+        ),
+    )
+
+
+def compare_videos(path, other):
+    """
+    Frame counts of both videos and the largest per pixel difference between their frames.
+    """
+    first, second = cv2.VideoCapture(path), cv2.VideoCapture(other)
+    frames, other_frames, max_diff = 0, 0, 0
+    try:
+        while True:
+            ok, frame = first.read()
+            other_ok, other_frame = second.read()
+            frames += ok
+            other_frames += other_ok
+            if not (ok and other_ok):
+                break
+            diff = cv2.absdiff(frame, other_frame).max()
+            max_diff = max(max_diff, int(diff))
+        while ok and first.read()[0]:
+            frames += 1
+        while other_ok and second.read()[0]:
+            other_frames += 1
+    finally:
+        first.release()
+        second.release()
+    return {"frames": frames, "other_frames": other_frames, "max_diff": max_diff}
+
+
+def _run_measured(func, args):
+    result = func(*args)
+    if isinstance(result, dict):
+        result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def run_spawned(func, *args):
+    """
+    func(*args) in a fresh spawned process, so no models, ONNX Runtime state or memory of
+    earlier cases carry over, with the process's peak RSS added to a dict result.
+    func has to be importable by name (a module level function).
+    """
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=1) as pool:
+        return pool.apply(_run_measured, (func, args))
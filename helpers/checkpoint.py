@@ -0,0 +1,128 @@
+import os
+import json
+import subprocess
+
+MANIFEST_NAME = "manifest.json"
+
+
+def write_json_atomic(path, data):
+    """
+    Write json next to path and rename it over path, so a crash leaves either the old or
+    the new file, never a truncated one.
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class RenderManifest:
+    """
+    Completed segments of a checkpointed render, kept as json next to the segment files.
+    A segment is only listed once all its outputs are closed and renamed into place, so
+    files on disk that aren't listed are leftovers of an interrupted segment.
+
+    settings describes the render (input, sizes, frame step, segment length, outputs).
+    A manifest written for different settings is thrown away together with its segments.
+    """
+
+    def __init__(self, directory, settings):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self.settings = settings
+        self.segments = []
+
+    @classmethod
+    def open(cls, directory, settings):
+        os.makedirs(directory, exist_ok=True)
+        manifest = cls(directory, settings)
+
+        try:
+            with open(manifest.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+
+        if data and data.get("settings") == settings:
+            segments = data.get("segments", [])
+            if all(
+                os.path.exists(path)
+                for segment in segments
+                for path in segment["files"].values()
+            ):
+                manifest.segments = segments
+                return manifest
+
+        manifest.clear()
+        return manifest
+
+    @property
+    def next_frame(self):
+        return self.segments[-1]["end"] if self.segments else 0
+
+    @property
+    def finished(self):
+        return bool(self.segments) and self.segments[-1].get("last", False)
+
+    def segment_path(self, index, output, partial=False):
+        suffix = ".part.mp4" if partial else ".mp4"
+        return os.path.join(self.directory, f"seg_{index:05d}_{output}{suffix}")
+
+    def commit(self, start, end, files, frame_stats, last=False):
+        self.segments.append(
+            {
+                "index": len(self.segments),
+                "start": start,
+                "end": end,
+                "files": files,
+                "frame_stats": frame_stats,
+                "last": last,
+            }
+        )
+        self.save()
+
+    def frame_stats(self):
+        totals = {}
+        for segment in self.segments:
+            for path, count in segment["frame_stats"].items():
+                totals[path] = totals.get(path, 0) + count
+        return totals
+
+    def files(self, output):
+        return [segment["files"][output] for segment in self.segments]
+
+    def as_dict(self):
+        return {"settings": self.settings, "segments": self.segments}
+
+    def save(self):
+        write_json_atomic(self.path, self.as_dict())
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.startswith("seg_") or name.endswith(".txt"):
+                os.remove(os.path.join(self.directory, name))
+        self.segments = []
+        self.save()
+
+
+def concat_segments(segment_paths, output_path, audio_source=None, list_path=None):
+    """
+    Join encoded segments without re-encoding (ffmpeg concat demuxer, stream copy) and
+    mux the audio of audio_source in the same run.
+    """
+    list_path = list_path or f"{output_path}.segments.txt"
+    with open(list_path, "w") as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    command = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", list_path,
+    ]
+    if audio_source:
+        command += ["-i", audio_source, "-map", "0:v:0", "-map", "1:a?", "-c:a", "aac", "-shortest"]
+    command += ["-c:v", "copy", "-movflags", "+faststart", output_path]
+    subprocess.run(command, check=True)
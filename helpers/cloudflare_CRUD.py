@@ -1,7 +1,5 @@
-import boto3
-from botocore.exceptions import NoCredentialsError
 import os
-from botocore.client import Config
+from functools import lru_cache
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -18,32 +16,66 @@ ClientAccessKey = os.getenv("CLOUDFLARE_CLIENT_ACCESS_KEY")
 # 4. Client secret
 ClientSecret = os.getenv("CLOUDFLARE_CLIENT_SECRET")
 
-# 5. Connection url
-ConnectionUrl = f"https://{AccountID}.r2.cloudflarestorage.com"
+# 5. Connection url, S3_ENDPOINT_URL points it at any S3 compatible store instead
+# (minio, or `manage.py local_object_store` on a dev box)
+ConnectionUrl = os.getenv("S3_ENDPOINT_URL") or f"https://{AccountID}.r2.cloudflarestorage.com"
 
 # 6. Public URL
 PublicUrl = f"{os.getenv('CLOUDFLARE_PUBLIC_URL')}"
 
 
-# Initialize S3 Client
-s3_client = boto3.client(
-    "s3",
-    endpoint_url=ConnectionUrl,
-    aws_access_key_id=ClientAccessKey,
-    aws_secret_access_key=ClientSecret,
-    config=Config(signature_version="s3v4"),
-    region_name="us-east-1",
-)
+# boto3 takes a while to import and build a client, so it happens on the first transfer
+# instead of in every process that imports this module
+@lru_cache(maxsize=None)
+def get_s3_client():
+    import boto3
+    from botocore.client import Config
+
+    return boto3.client(
+        "s3",
+        endpoint_url=ConnectionUrl,
+        aws_access_key_id=ClientAccessKey,
+        aws_secret_access_key=ClientSecret,
+        # path style works with R2 and with local stand-ins that have no bucket dns names
+        config=Config(signature_version="s3v4", s3={"addressing_style": "path"}),
+        region_name="us-east-1",
+    )
+
+
+def public_url(object_name):
+    return f"{PublicUrl}/{object_name}"
+
+
+def presigned_url(bucket, object_name, method="get_object", expires=3600):
+    """
+    Time limited url to GET (get_object) or PUT (put_object) one object without
+    credentials, what remote workers fetch inputs and push outputs with.
+    """
+    return get_s3_client().generate_presigned_url(
+        method, Params={"Bucket": bucket, "Key": object_name}, ExpiresIn=expires
+    )
+
+
+def object_exists(bucket, object_name):
+    from botocore.exceptions import ClientError
+
+    try:
+        get_s3_client().head_object(Bucket=bucket, Key=object_name)
+        return True
+    except ClientError:
+        return False
 
 
 def upload_file(file_name, bucket, object_name=None):
     """Upload a file to an S3 bucket"""
+    from botocore.exceptions import NoCredentialsError
+
     print(file_name)
     if object_name is None:
         object_name = "videos/" + file_name
 
     try:
-        response = s3_client.upload_file(file_name, bucket, object_name)
+        response = get_s3_client().upload_file(file_name, bucket, object_name)
         print(f"File {file_name} uploaded to {bucket}/{object_name}")
         print(response)
         return f"{PublicUrl}" + "/" + object_name
@@ -53,8 +85,10 @@ def upload_file(file_name, bucket, object_name=None):
 
 def download_file(bucket, object_name, file_name):
     """Download a file from an S3 bucket"""
+    from botocore.exceptions import NoCredentialsError
+
     try:
-        s3_client.download_file(bucket, object_name, file_name)
+        get_s3_client().download_file(bucket, object_name, file_name)
         print(f"File {object_name} downloaded as {file_name}")
     except NoCredentialsError:
         print("AWS Credentials not found")
@@ -62,8 +96,10 @@ def download_file(bucket, object_name, file_name):
 
 def list_files(bucket):
     """List files in an S3 bucket"""
+    from botocore.exceptions import NoCredentialsError
+
     try:
-        response = s3_client.list_objects_v2(Bucket=bucket)
+        response = get_s3_client().list_objects_v2(Bucket=bucket)
         if "Contents" in response:
             for obj in response["Contents"]:
                 print(obj["Key"])
@@ -75,8 +111,10 @@ def list_files(bucket):
 
 def delete_file(bucket, object_name):
     """Delete a file from an S3 bucket"""
+    from botocore.exceptions import NoCredentialsError
+
     try:
-        s3_client.delete_object(Bucket=bucket, Key=object_name)
+        get_s3_client().delete_object(Bucket=bucket, Key=object_name)
         print(f"File {object_name} deleted from {bucket}")
     except NoCredentialsError:
         print("AWS Credentials not found")
\ No newline at end of file
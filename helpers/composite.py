@@ -1,17 +1,99 @@
+import os
+import time
 import cv2
 import numpy as np
 import subprocess
 import logging
 from tqdm import tqdm
-from rembg import new_session, remove
-from insightface.app import FaceAnalysis
-from insightface.model_zoo import get_model
-import onnxruntime as ort
+from PIL import Image
+from helpers.profiling import NullTimer, current_rss_mb
+from helpers.memory import MB, FrameBuffers, plan_render, trim_heap
+from helpers.checkpoint import RenderManifest, concat_segments
+from helpers.face_index import FaceIndex, video_key
+from helpers.matting import (
+    DEFAULT_AUTO_OPTIONS,
+    choose_matting_tier,
+    fallback_tier,
+    matting_model,
+)
+from helpers.roi_paste import swap_face_roi
+from helpers.renditions import FfmpegSink, VideoWriterSink, rendition_size
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("FaceSwapBackgroundEngine")
 
 
+class RenderCancelled(Exception):
+    """
+    Raised from a progress or segment callback to stop a render, everything else those
+    callbacks raise is ignored.
+    """
+
+
+def frame_signature(frame, width=160):
+    """
+    Small grayscale copy of the frame used to spot unchanged frames cheaply.
+    INTER_AREA averages codec noise away while local motion (a mouth, a hand) still shows.
+    """
+    height = max(1, int(frame.shape[0] * width / frame.shape[1]))
+    small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+
+def frame_difference(signature, other):
+    return int(np.abs(signature - other).max())
+
+
+def seek_capture(capture, frame_index):
+    """
+    Position capture so the next read returns frame_index. Falls back to grabbing from
+    the start when the backend can't seek exactly.
+    """
+    capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+    if int(capture.get(cv2.CAP_PROP_POS_FRAMES)) == frame_index:
+        return
+    capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    for _ in range(frame_index):
+        if not capture.grab():
+            break
+
+
+class RenderVariant:
+    """
+    One output of a shared render: the faces swapped in, an optional background image and
+    the files it is written to. Variants rendered together share decoding, face detection,
+    matting and the static gate; only the swap, the blend and the encoders are per variant.
+    renditions are {"name", "path", "height", "bitrate"} dicts like process_video's.
+    checkpoint_dir is where a checkpointed render keeps this variant's manifest and
+    segments, whichever variants it is rendered with.
+    """
+
+    def __init__(
+        self,
+        name,
+        source_faces,
+        output_video,
+        background_image=None,
+        temp_video=None,
+        renditions=None,
+        checkpoint_dir=None,
+    ):
+        self.name = name
+        self.source_faces = source_faces
+        self.output_video = output_video
+        self.background_image = background_image
+        self.temp_video = temp_video or f"{output_video}.noaudio.mp4"
+        self.renditions = renditions or []
+        self.checkpoint_dir = checkpoint_dir
+
+        # set up per render by process_variants
+        self.resized_background = None
+        self.buffers = FrameBuffers()
+        self.sinks = []
+        self.previous_output = None
+        self.manifest = None
+
+
 class FaceSwapBackgroundEngine:
     def __init__(
         self,
@@ -19,8 +101,32 @@ class FaceSwapBackgroundEngine:
         bg_image_path=None,
         providers=None,
         det_size=(640, 640),
-        rembg_model="isnet-general-use",
+        rembg_model=None,
+        session_options=None,
+        precision="fp32",
+        quantized_model_dir=None,
+        face_app=None,
+        face_swapper=None,
+        rembg_session=None,
+        static_frame_threshold=None,
+        roi_paste_back=True,
+        memory_budget_mb=None,
+        allow_downscale=True,
+        face_index_dir=None,
+        face_index_max_mb=None,
+        matting_tier="quality",
+        matting_benchmark=None,
+        matting_auto_options=None,
     ):
+        # onnxruntime, insightface and rembg take seconds to import, they're only needed
+        # once an engine is built, not whenever a process imports this module
+        import onnxruntime as ort
+        from helpers.onnx_session import (
+            TunedFaceAnalysis,
+            load_insightface_model,
+            resolve_session_config,
+        )
+
         if providers is None:
             available = ort.get_available_providers()
             if "CUDAExecutionProvider" in available:
@@ -33,42 +139,128 @@ class FaceSwapBackgroundEngine:
             self.providers = list(providers)
             log.info("Using providers: %s", self.providers)
 
+        self.session_options = resolve_session_config(session_options)
+        self.precision = precision
+        # max per pixel change (0-255, on a 160px wide grayscale copy) for a frame to count
+        # as unchanged and reuse the previous output, None renders every frame
+        self.static_frame_threshold = static_frame_threshold
+        # paste swapped faces back inside a padded box around each face instead of the whole frame
+        self.roi_paste_back = roi_paste_back
+        # process RSS (models included) a render may grow to; renders that don't fit are
+        # downscaled when allow_downscale is set, otherwise refused (MemoryBudgetExceeded)
+        self.memory_budget_mb = memory_budget_mb
+        self.allow_downscale = allow_downscale
+        # detected faces per input frame are kept here (see helpers.face_index) and reused
+        # by later renders of the same video, least recently used indexes beyond
+        # face_index_max_mb are deleted
+        self.face_index_dir = face_index_dir
+        self.face_index_max_mb = face_index_max_mb
+        self.det_size = tuple(det_size)
+
         self.background_enabled = bg_image_path is not None
         self.background_image = None
 
         if self.background_enabled:
-            self.background_image = cv2.imread(bg_image_path)
-            if self.background_image is None:
-                raise RuntimeError("Unable to load background image")
+            self.background_image = self.load_background_image(bg_image_path)
             log.info("Background replacement enabled")
         else:
             log.info("Background replacement disabled")
 
         ctx_id = 0 if "CUDAExecutionProvider" in self.providers else -1
 
-        log.info("Loading InsightFace models")
-        self.face_app = FaceAnalysis(name="buffalo_l", providers=self.providers)
-        self.face_app.prepare(ctx_id=ctx_id, det_size=det_size)
+        # prebuilt models can be passed in (benchmarks use stubs), otherwise load them here
+        self.face_app = face_app
+        if self.face_app is None:
+            log.info("Loading InsightFace models (%s)", precision)
+            self.face_app = TunedFaceAnalysis(
+                name="buffalo_l",
+                providers=self.providers,
+                config=self.session_options,
+                precision=precision,
+                quantized_dir=quantized_model_dir,
+            )
+            self.face_app.prepare(ctx_id=ctx_id, det_size=det_size)
 
-        self.face_swapper = get_model(
-            swapper_model_path,
-            providers=self.providers,
-        )
+        self.face_swapper = face_swapper
+        if self.face_swapper is None:
+            self.face_swapper = load_insightface_model(
+                swapper_model_path,
+                providers=self.providers,
+                config=self.session_options,
+                precision=precision,
+                quantized_dir=quantized_model_dir,
+            )
 
-        self.rembg_session = None
-        if self.background_enabled:
-            log.info("Loading background removal model")
-            self.rembg_session = new_session(rembg_model)
+        # rembg_model overrides the tier; "auto" picks a tier per render from the job's
+        # size and length against the benchmark_matting numbers in matting_benchmark
+        self.matting_tier = matting_tier
+        self.matting_benchmark = matting_benchmark or {}
+        self.matting_auto_options = {**DEFAULT_AUTO_OPTIONS, **(matting_auto_options or {})}
+        self.rembg_model = rembg_model
+        if self.rembg_model is None and matting_tier != "auto":
+            self.rembg_model = matting_model(matting_tier)
+        # a session passed in (benchmark stubs) is used whatever the model
+        self.prebuilt_matting = rembg_session is not None
+        self.rembg_session = rembg_session
+        self.matting_sessions = {}
+        self.active_matting_model = None
+        if self.background_enabled and self.rembg_model is not None:
+            self.load_matting()
 
         self.source_faces = []
         log.info("Engine initialized")
 
-    def load_source_faces(self, image_paths):
+    def load_matting(self, model=None):
+        """
+        Make model's rembg session (default: the engine's model) the one matte() runs,
+        loading it the first time. Sessions stay loaded for later renders.
+        """
+        model = model or self.rembg_model or matting_model(fallback_tier(self.matting_auto_options))
+        self.active_matting_model = model
+        if self.prebuilt_matting:
+            return
+        if model not in self.matting_sessions:
+            from helpers.onnx_session import load_rembg_session
+
+            log.info("Loading background removal model %s", model)
+            self.matting_sessions[model] = load_rembg_session(
+                model,
+                providers=self.providers,
+                config=self.session_options,
+            )
+        self.rembg_session = self.matting_sessions[model]
+
+    def choose_matting(self, frame_size, frames):
+        """
+        Load the matting model for a render of frames frames of frame_size: the engine's
+        model, or with matting_tier "auto" the tier choose_matting_tier picks.
+        """
+        if self.matting_tier != "auto" or self.rembg_model is not None:
+            self.load_matting()
+            return
+        tier, fps = choose_matting_tier(
+            frame_size[0], frame_size[1], frames, self.matting_benchmark, self.matting_auto_options
+        )
+        log.info(
+            "Matting tier %s for %d frames at %dx%d (%s fps expected)",
+            tier,
+            frames,
+            *frame_size,
+            "unknown" if fps is None else round(fps, 1),
+        )
+        self.load_matting(matting_model(tier))
+
+    def load_background_image(self, path):
+        image = cv2.imread(path)
+        if image is None:
+            raise RuntimeError("Unable to load background image")
+        return image
+
+    def load_faces(self, image_paths):
         if isinstance(image_paths, str):
             image_paths = [image_paths]
 
-        self.source_faces = []
-
+        faces = []
         for path in image_paths:
             image = cv2.imread(path)
             if image is None:
@@ -78,10 +270,95 @@ class FaceSwapBackgroundEngine:
             if not detected_faces:
                 raise RuntimeError(f"No face found in source image: {path}")
 
-            self.source_faces.append(detected_faces[0])
+            faces.append(detected_faces[0])
+        return faces
 
+    def load_source_faces(self, image_paths):
+        self.source_faces = self.load_faces(image_paths)
         log.info("Loaded %d source faces", len(self.source_faces))
 
+    def load_variant(self, name, face_paths, output_video, background_path=None, renditions=None):
+        """
+        RenderVariant for process_variants from image files.
+        """
+        background_image = None
+        if background_path is not None:
+            background_image = self.load_background_image(background_path)
+        return RenderVariant(
+            name,
+            self.load_faces(face_paths),
+            output_video,
+            background_image=background_image,
+            renditions=renditions,
+        )
+
+    def detect_faces(self, frame):
+        """
+        Detector only faces sorted left to right. The swapper needs just bbox and kps,
+        so the landmark/attribute/recognition models FaceAnalysis.get runs per face are skipped.
+        """
+        det_model = getattr(self.face_app, "det_model", None)
+        if det_model is None:
+            faces = self.face_app.get(frame)
+        else:
+            from insightface.app.common import Face
+
+            bboxes, kpss = det_model.detect(frame, max_num=0, metric="default")
+            faces = [
+                Face(
+                    bbox=bboxes[i, 0:4],
+                    kps=kpss[i] if kpss is not None else None,
+                    det_score=bboxes[i, 4],
+                )
+                for i in range(bboxes.shape[0])
+            ]
+        return sorted(faces, key=lambda f: f.bbox[0])
+
+    def detector_settings(self, frame_size):
+        """
+        What face detection results depend on besides the frame, see FaceIndex.
+        """
+        det_model = getattr(self.face_app, "det_model", None)
+        return {
+            "detector": os.path.basename(
+                getattr(det_model, "model_file", None) or type(self.face_app).__name__
+            ),
+            "det_size": list(self.det_size),
+            "det_thresh": getattr(det_model, "det_thresh", None),
+            "precision": self.precision,
+            "frame_size": list(frame_size),
+        }
+
+    def find_faces(self, frame, timer, face_index=None, frame_index=None):
+        """
+        detect_faces, or the faces face_index already has for frame_index.
+        """
+        if face_index is not None:
+            faces = face_index.get(frame_index)
+            if faces is not None:
+                timer.count("faces_from_index")
+                return faces
+        with timer.stage("detect"):
+            faces = self.detect_faces(frame)
+        if face_index is not None:
+            face_index.put(frame_index, faces)
+        return faces
+
+    def swap_faces(self, frame, detected_faces, source_faces=None):
+        source_faces = source_faces or self.source_faces
+        for idx, detected_face in enumerate(detected_faces):
+            source_face = source_faces[idx % len(source_faces)]
+            if self.roi_paste_back:
+                frame = swap_face_roi(self.face_swapper, frame, detected_face, source_face)
+            else:
+                frame = self.face_swapper.get(
+                    frame,
+                    detected_face,
+                    source_face,
+                    paste_back=True,
+                )
+        return frame
+
     def merge_audio_tracks(self, silent_video, original_video, final_video):
         subprocess.run(
             [
@@ -100,21 +377,502 @@ class FaceSwapBackgroundEngine:
                 "-c:a",
                 "aac",
                 "-shortest",
+                # moov atom first so players can seek before the whole file arrives
+                "-movflags",
+                "+faststart",
                 final_video,
             ],
             check=True,
         )
 
+    def matte(self, frame):
+        """
+        Foreground mask (uint8, frame sized) of the matting model. Same mask rembg.remove()
+        cuts out with, without building the RGBA cutout.
+        """
+        return np.asarray(self.rembg_session.predict(Image.fromarray(frame))[0])
+
+    def warm_up(self, frame_size=(1280, 720), runs=2, matting=True):
+        """
+        Run every model once or twice on a dummy frame_size frame: the detector at det_size,
+        the landmark/attribute/recognition models, the swapper (with the paste back) and,
+        with matting, the engine's matting model (loaded here if it isn't yet). ONNX Runtime
+        allocates its arenas and picks kernels on the first runs, which otherwise land on
+        the first frames of the first job. Returns the seconds it took.
+        """
+        from insightface.app.common import Face
+
+        start = time.perf_counter()
+        width, height = frame_size
+        rng = np.random.default_rng(0)
+        frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+        # a face in the middle of the frame with landmarks at the arcface template spots
+        size = min(width, height) // 3
+        x1, y1 = (width - size) // 2, (height - size) // 2
+        template = np.array(
+            [[0.34, 0.46], [0.66, 0.46], [0.5, 0.64], [0.37, 0.82], [0.63, 0.82]],
+            dtype=np.float32,
+        )
+        kps = template * size + np.array([x1, y1], dtype=np.float32)
+        bbox = np.array([x1, y1, x1 + size, y1 + size], dtype=np.float32)
+        embedding = rng.standard_normal(512).astype(np.float32)
+
+        if matting and self.rembg_session is None:
+            self.load_matting()
+
+        for _ in range(runs):
+            self.detect_faces(frame)
+            target = Face(bbox=bbox, kps=kps, det_score=1.0)
+            for taskname, model in getattr(self.face_app, "models", {}).items():
+                if taskname != "detection":
+                    model.get(frame, target)
+            source = Face(bbox=bbox, kps=kps, det_score=1.0, embedding=embedding)
+            self.swap_faces(frame.copy(), [target], [source])
+            if matting and self.rembg_session is not None:
+                self.matte(frame)
+
+        seconds = time.perf_counter() - start
+        log.info("Warm-up at %dx%d took %.2fs", width, height, seconds)
+        return seconds
+
+    def render_frame(self, frame, variants, timer=None, face_index=None, frame_index=None):
+        """
+        Detect faces in one frame (or read them from face_index) and, when any variant
+        replaces the background, matte it, both once for all variants. Then swap (and
+        blend) each variant's faces.
+        The mask comes from the decoded frame: the swap only changes pixels inside the
+        faces, so the silhouette is the same for every variant.
+        Returns (one output frame per variant, path) where path is "swapped" or "no_faces".
+        Outputs live in the decode slot or the variant's buffers and are reused later on.
+        """
+        if timer is None:
+            timer = NullTimer()
+
+        detected_faces = self.find_faces(frame, timer, face_index, frame_index)
+        timer.observe("faces_per_frame", len(detected_faces))
+
+        mask = None
+        if any(variant.background_image is not None for variant in variants):
+            with timer.stage("matte"):
+                mask = self.matte(frame)
+
+        outputs = []
+        for position, variant in enumerate(variants):
+            output = frame
+            if detected_faces:
+                with timer.stage("swap"):
+                    # the last variant swaps into the decode slot, the others into a copy
+                    if position < len(variants) - 1:
+                        output = variant.buffers.copy(frame)
+                    output = self.swap_faces(output, detected_faces, variant.source_faces)
+            if variant.background_image is not None:
+                with timer.stage("blend"):
+                    output = variant.buffers.blend(output, mask, variant.resized_background)
+            outputs.append(output)
+
+        return outputs, "swapped" if detected_faces else "no_faces"
+
+    def render_frames(
+        self,
+        capture,
+        total_frames,
+        variants,
+        timer,
+        progress_callback,
+        frame_step=1,
+        output_size=None,
+        start_frame=0,
+        end_frame=None,
+        buffers=None,
+        face_index=None,
+    ):
+        """
+        Render frames start_frame..end_frame (default: to total_frames) from capture, which
+        must already be positioned at start_frame, into the sinks of every variant. Frames
+        are decoded into the preallocated arrays of buffers, faces come from face_index
+        when it has them.
+        Returns (frame_stats, index of the first frame not rendered); the index is below
+        end_frame when the input ran out early.
+        """
+        end_frame = total_frames if end_frame is None else min(end_frame, total_frames)
+        if buffers is None:
+            buffers = FrameBuffers()
+        frame_index = start_frame
+        frame_stats = {"static": 0, "no_faces": 0, "swapped": 0}
+        reference_signature = None
+        for variant in variants:
+            variant.previous_output = None
+
+        for _ in tqdm(range(start_frame, end_frame)):
+            if frame_index % frame_step:
+                # frames dropped by a preview are only grabbed, not converted
+                frame_index += 1
+                if not capture.grab():
+                    break
+                continue
+
+            with timer.stage("decode"):
+                success, frame = buffers.read(capture, output_size)
+            if not success:
+                break
+            timer.count("frames")
+
+            # with the gate off (the default) the signature isn't computed at all
+            is_static = False
+            if self.static_frame_threshold is not None:
+                with timer.stage("gate"):
+                    signature = frame_signature(frame)
+                    is_static = (
+                        reference_signature is not None
+                        and frame_difference(signature, reference_signature)
+                        <= self.static_frame_threshold
+                    )
+
+            if is_static:
+                # same input as the last rendered frame, so the outputs would be the same too
+                outputs = [variant.previous_output for variant in variants]
+                frame_stats["static"] += 1
+            else:
+                outputs, path = self.render_frame(
+                    frame, variants, timer, face_index=face_index, frame_index=frame_index
+                )
+                frame_stats[path] += 1
+                # the outputs may be the decode slot itself, keep it out of the next decode
+                buffers.keep()
+
+                # compare against the last rendered frame, not the previous input, so slow
+                # drift below the threshold can't keep an ever older output alive
+                if self.static_frame_threshold is not None:
+                    reference_signature = signature
+                for variant, output in zip(variants, outputs):
+                    variant.previous_output = output
+
+            with timer.stage("encode"):
+                for variant, output in zip(variants, outputs):
+                    for sink in variant.sinks:
+                        sink.write(output)
+
+            frame_index += 1
+            if progress_callback and total_frames > 0 and frame_index % 10 == 0:
+                try:
+                    percent = int((frame_index / total_frames) * 100)
+                    progress_callback(percent, frame_index, total_frames)
+                except RenderCancelled:
+                    raise
+                except Exception:
+                    pass
+
+        return frame_stats, frame_index
+
+    def abort_sinks(self, variants):
+        for variant in variants:
+            for sink in variant.sinks:
+                sink.abort()
+            variant.sinks = []
+
+    def close_sinks(self, variants):
+        for variant in variants:
+            for sink in variant.sinks:
+                sink.close()
+            variant.sinks = []
+
+    def render_single_pass(
+        self,
+        capture,
+        input_video,
+        variants,
+        total_frames,
+        output_fps,
+        frame_size,
+        timer,
+        progress_callback,
+        frame_step,
+        output_size,
+        buffers=None,
+        encoder_options=None,
+        face_index=None,
+    ):
+        try:
+            for variant in variants:
+                variant.sinks = [VideoWriterSink(variant.temp_video, output_fps, frame_size)]
+                for rendition in variant.renditions:
+                    variant.sinks.append(
+                        FfmpegSink(
+                            rendition["path"],
+                            output_fps,
+                            frame_size,
+                            height=rendition.get("height"),
+                            bitrate=rendition.get("bitrate"),
+                            audio_source=input_video,
+                            **(encoder_options or {}),
+                        )
+                    )
+
+            frame_stats, _ = self.render_frames(
+                capture,
+                total_frames,
+                variants,
+                timer,
+                progress_callback,
+                frame_step=frame_step,
+                output_size=output_size,
+                buffers=buffers,
+                face_index=face_index,
+            )
+        except Exception:
+            self.abort_sinks(variants)
+            raise
+
+        with timer.stage("encode"):
+            self.close_sinks(variants)
+
+        return frame_stats
+
+    def render_segments(
+        self,
+        capture,
+        variants,
+        total_frames,
+        output_fps,
+        frame_size,
+        timer,
+        progress_callback,
+        frame_step,
+        output_size,
+        segment_frames,
+        segment_callback=None,
+        buffers=None,
+        encoder_options=None,
+        face_index=None,
+    ):
+        """
+        Render the segments the variants' manifests don't list yet, each into its own
+        silent files (one per output) that are renamed into place and committed to the
+        variant's manifest once closed. Segments start at multiples of segment_frames, so
+        a variant resumed further than the others sits out until the render catches up
+        with it. Returns the frame stats of this run plus the number of frames resumed from
+        earlier runs by every variant.
+        """
+        frame_stats = {"static": 0, "no_faces": 0, "swapped": 0}
+        frame_stats["resumed"] = min(
+            sum(variant.manifest.frame_stats().values()) for variant in variants
+        )
+
+        position = 0
+        while True:
+            pending = [variant for variant in variants if not variant.manifest.finished]
+            if not pending:
+                break
+            start = min(variant.manifest.next_frame for variant in pending)
+            active = [variant for variant in pending if variant.manifest.next_frame == start]
+            if start != position:
+                log.info("Resuming at frame %d", start)
+                with timer.stage("seek"):
+                    seek_capture(capture, start)
+
+            partial = {}
+            try:
+                for variant in active:
+                    manifest = variant.manifest
+                    index = len(manifest.segments)
+                    paths = partial[variant] = {
+                        "main": manifest.segment_path(index, "main", partial=True)
+                    }
+                    variant.sinks = [VideoWriterSink(paths["main"], output_fps, frame_size)]
+                    for rendition in variant.renditions:
+                        name = rendition["name"]
+                        paths[name] = manifest.segment_path(index, name, partial=True)
+                        variant.sinks.append(
+                            FfmpegSink(
+                                paths[name],
+                                output_fps,
+                                frame_size,
+                                height=rendition.get("height"),
+                                bitrate=rendition.get("bitrate"),
+                                **(encoder_options or {}),
+                            )
+                        )
+
+                segment_stats, end = self.render_frames(
+                    capture,
+                    total_frames,
+                    active,
+                    timer,
+                    progress_callback,
+                    frame_step=frame_step,
+                    output_size=output_size,
+                    start_frame=start,
+                    end_frame=start + segment_frames,
+                    buffers=buffers,
+                    face_index=face_index,
+                )
+            except Exception:
+                self.abort_sinks(active)
+                raise
+
+            if not sum(segment_stats.values()):
+                # the frame count overestimated the input, the previous segment was the last
+                self.abort_sinks(active)
+                for variant in active:
+                    for path in partial[variant].values():
+                        if os.path.exists(path):
+                            os.remove(path)
+                    if not variant.manifest.segments:
+                        raise RuntimeError("No frames could be decoded from the input video")
+                    variant.manifest.segments[-1]["last"] = True
+                    variant.manifest.save()
+                position = end
+                continue
+
+            with timer.stage("encode"):
+                self.close_sinks(active)
+
+            for variant in active:
+                manifest = variant.manifest
+                files = {}
+                for output, path in partial[variant].items():
+                    files[output] = manifest.segment_path(len(manifest.segments), output)
+                    os.replace(path, files[output])
+                manifest.commit(
+                    start,
+                    end,
+                    files,
+                    segment_stats,
+                    last=end >= total_frames or end < start + segment_frames,
+                )
+            for path, count in segment_stats.items():
+                frame_stats[path] += count
+
+            if segment_callback:
+                for variant in active:
+                    try:
+                        segment_callback(variant, variant.manifest.as_dict())
+                    except RenderCancelled:
+                        raise
+                    except Exception:
+                        pass
+            position = end
+
+        return frame_stats
+
+    def join_segments(self, input_video, variant):
+        manifest = variant.manifest
+        concat_segments(
+            manifest.files("main"),
+            variant.output_video,
+            audio_source=input_video,
+            list_path=os.path.join(manifest.directory, "main.txt"),
+        )
+        for rendition in variant.renditions:
+            name = rendition["name"]
+            concat_segments(
+                manifest.files(name),
+                rendition["path"],
+                audio_source=input_video,
+                list_path=os.path.join(manifest.directory, f"{name}.txt"),
+            )
+
+    @staticmethod
+    def variant_checkpoint_dir(variant, checkpoint_dir, variant_count):
+        if variant.checkpoint_dir:
+            return variant.checkpoint_dir
+        if variant_count == 1:
+            return checkpoint_dir
+        return os.path.join(checkpoint_dir, variant.name)
+
     def process_video(
         self,
         input_video,
         output_video,
         temp_video="temp_noaudio.mp4",
         progress_callback=None,
+        timer=None,
+        renditions=None,
+        max_seconds=None,
+        frame_step=1,
+        max_height=None,
+        checkpoint_dir=None,
+        segment_frames=250,
+        segment_callback=None,
     ):
+        """
+        Render input_video to output_video. renditions is an optional list of
+        {"name", "path", "height", "bitrate"} dicts for extra outputs encoded from the same
+        processed frames (audio included), so no second decode/inference pass is needed.
+        Each rendition dict gets its actual (width, height) under "size".
+
+        max_seconds, frame_step and max_height make a draft preview: only the first
+        max_seconds are rendered, every frame_step-th frame at most max_height tall.
+
+        With checkpoint_dir the video is rendered in segments of segment_frames input
+        frames that are committed to a manifest in that directory (segment_callback gets
+        the variant and its manifest after each one), and a later call with the same
+        directory resumes after the last committed segment. The segments are joined without
+        re-encoding.
+
+        With a memory_budget_mb on the engine the render is planned to fit it: fewer
+        decoder threads and a shorter x264 lookahead first, then a smaller output size
+        (allow_downscale), otherwise MemoryBudgetExceeded is raised before any frame.
+
+        With a face_index_dir on the engine the faces found in each frame are stored in
+        the video's face index and frames already in it skip detection.
+        """
         if not self.source_faces:
             raise RuntimeError("Source faces not loaded")
 
+        variant = RenderVariant(
+            None,
+            self.source_faces,
+            output_video,
+            background_image=self.background_image,
+            temp_video=temp_video,
+            renditions=renditions,
+        )
+        return self.process_variants(
+            input_video,
+            [variant],
+            progress_callback=progress_callback,
+            timer=timer,
+            max_seconds=max_seconds,
+            frame_step=frame_step,
+            max_height=max_height,
+            checkpoint_dir=checkpoint_dir,
+            segment_frames=segment_frames,
+            segment_callback=segment_callback,
+        )
+
+    def process_variants(
+        self,
+        input_video,
+        variants,
+        progress_callback=None,
+        timer=None,
+        max_seconds=None,
+        frame_step=1,
+        max_height=None,
+        checkpoint_dir=None,
+        segment_frames=250,
+        segment_callback=None,
+    ):
+        """
+        Render input_video once for several RenderVariants (different faces and/or
+        backgrounds): each frame is decoded, gated, detected and matted once and only the
+        swap, blend and encoders run per variant. Options are process_video's; with
+        checkpoint_dir every variant has its own manifest, in its checkpoint_dir if set,
+        else checkpoint_dir itself for a lone variant or checkpoint_dir/<name>, so a
+        variant resumes its segments whichever variants it is rendered with next time.
+        Returns the frame stats, which are the same for every variant.
+        """
+        if timer is None:
+            timer = NullTimer()
+
+        if not variants:
+            raise RuntimeError("No variants to render")
+        for variant in variants:
+            if not variant.source_faces:
+                raise RuntimeError("Source faces not loaded")
+
         capture = cv2.VideoCapture(input_video)
         if not capture.isOpened():
             raise RuntimeError("Unable to open input video")
@@ -123,59 +881,178 @@ class FaceSwapBackgroundEngine:
         frame_width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
         frame_height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
         total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        capture.release()
+        input_size = (frame_width, frame_height)
+        input_frames = total_frames
 
-        if self.background_enabled:
-            resized_background = cv2.resize(
-                self.background_image, (frame_width, frame_height)
-            )
+        if max_seconds and fps > 0:
+            total_frames = min(total_frames, int(max_seconds * fps))
 
-        writer = cv2.VideoWriter(
-            temp_video,
-            cv2.VideoWriter_fourcc(*"mp4v"),
-            fps,
-            (frame_width, frame_height),
+        output_size = None
+        if max_height and max_height < frame_height:
+            frame_width, frame_height = rendition_size(frame_width, frame_height, max_height)
+            output_size = (frame_width, frame_height)
+
+        backgrounds = sum(variant.background_image is not None for variant in variants)
+
+        # admission: the render gets what the budget leaves next to the loaded models
+        available_mb = None
+        if self.memory_budget_mb:
+            # drop what earlier renders left in the heap so RSS is the models and little else
+            trim_heap()
+            available_mb = self.memory_budget_mb - (current_rss_mb() or 0)
+        plan = plan_render(
+            frame_width,
+            frame_height,
+            available_mb,
+            background=backgrounds,
+            rendition_heights=[
+                rendition.get("height")
+                for variant in variants
+                for rendition in variant.renditions
+            ],
+            allow_downscale=self.allow_downscale,
+            input_size=input_size,
+            variants=len(variants),
         )
+        if plan.size != (frame_width, frame_height):
+            log.warning(
+                "Downscaling %dx%d to %dx%d to fit the memory budget",
+                frame_width,
+                frame_height,
+                *plan.size,
+            )
+            frame_width, frame_height = plan.size
+            output_size = plan.size
+        log.info("Memory plan: %s", plan.as_dict())
+        frame_size = (frame_width, frame_height)
 
-        frame_index = 0
+        encoder_options = {}
+        if plan.lookahead is not None:
+            encoder_options = {"lookahead": plan.lookahead, "threads": plan.decode_threads}
 
-        for _ in tqdm(range(total_frames)):
-            success, frame = capture.read()
-            if not success:
-                break
+        # frame threaded decoding keeps a frame per thread in flight, bound it by the plan
+        if plan.decode_threads is not None:
+            capture = cv2.VideoCapture(
+                input_video, cv2.CAP_ANY, [cv2.CAP_PROP_N_THREADS, plan.decode_threads]
+            )
+        else:
+            capture = cv2.VideoCapture(input_video)
+        if not capture.isOpened():
+            raise RuntimeError("Unable to open input video")
 
-            detected_faces = self.face_app.get(frame)
-            detected_faces = sorted(detected_faces, key=lambda f: f.bbox[0])
+        # dropped frames are spread over the same duration so the audio still lines up
+        frame_step = max(1, int(frame_step))
+        output_fps = fps / frame_step
 
-            for idx, detected_face in enumerate(detected_faces):
-                source_face = self.source_faces[idx % len(self.source_faces)]
-                frame = self.face_swapper.get(
-                    frame,
-                    detected_face,
-                    source_face,
-                    paste_back=True,
+        if backgrounds:
+            self.choose_matting(frame_size, total_frames // frame_step)
+
+        for variant in variants:
+            if variant.background_image is not None:
+                variant.resized_background = cv2.resize(variant.background_image, frame_size)
+            for rendition in variant.renditions:
+                rendition["size"] = rendition_size(
+                    frame_width, frame_height, rendition.get("height")
                 )
 
-            if self.background_enabled:
-                rgba_frame = remove(frame, session=self.rembg_session)
-                alpha_mask = rgba_frame[:, :, 3].astype(np.float32) / 255.0
-                alpha_mask = alpha_mask[:, :, None]
-                frame = frame * alpha_mask + resized_background * (1 - alpha_mask)
-                frame = frame.astype(np.uint8)
+        buffers = FrameBuffers()
 
-            writer.write(frame)
+        # previews and full renders at the same size share the index of the whole video
+        face_index = None
+        if self.face_index_dir:
+            with timer.stage("face_index"):
+                face_index = FaceIndex.open(
+                    self.face_index_dir,
+                    video_key(input_video),
+                    self.detector_settings(frame_size),
+                    input_frames,
+                    max_bytes=(self.face_index_max_mb or 0) * MB or None,
+                )
 
-            frame_index += 1
-            if progress_callback and total_frames > 0 and frame_index % 10 == 0:
-                try:
-                    percent = int((frame_index / total_frames) * 100)
-                    progress_callback(percent, frame_index, total_frames)
-                except Exception:
-                    pass
+        try:
+            if checkpoint_dir is None:
+                frame_stats = self.render_single_pass(
+                    capture,
+                    input_video,
+                    variants,
+                    total_frames,
+                    output_fps,
+                    frame_size,
+                    timer,
+                    progress_callback,
+                    frame_step,
+                    output_size,
+                    buffers=buffers,
+                    encoder_options=encoder_options,
+                    face_index=face_index,
+                )
+            else:
+                render_settings = {
+                    "input": os.path.basename(input_video),
+                    "input_bytes": os.path.getsize(input_video),
+                    "total_frames": total_frames,
+                    "fps": output_fps,
+                    "frame_size": list(frame_size),
+                    "frame_step": frame_step,
+                    "segment_frames": segment_frames,
+                    "static_frame_threshold": self.static_frame_threshold,
+                }
+                for variant in variants:
+                    variant.manifest = RenderManifest.open(
+                        self.variant_checkpoint_dir(variant, checkpoint_dir, len(variants)),
+                        {
+                            **render_settings,
+                            "matting": (
+                                self.active_matting_model
+                                if variant.background_image is not None
+                                else None
+                            ),
+                            "background": variant.background_image is not None,
+                            "renditions": [
+                                [rendition["name"], rendition.get("height"), rendition.get("bitrate")]
+                                for rendition in variant.renditions
+                            ],
+                        },
+                    )
+                frame_stats = self.render_segments(
+                    capture,
+                    variants,
+                    total_frames,
+                    output_fps,
+                    frame_size,
+                    timer,
+                    progress_callback,
+                    frame_step,
+                    output_size,
+                    segment_frames,
+                    segment_callback=segment_callback,
+                    buffers=buffers,
+                    encoder_options=encoder_options,
+                    face_index=face_index,
+                )
+        finally:
+            capture.release()
+            if face_index is not None:
+                face_index.close()
 
-        capture.release()
-        writer.release()
+        for path, count in frame_stats.items():
+            timer.count(f"frames_{path}", count)
+        log.info(
+            "Frames: %d static (reused), %d without faces, %d swapped, %d resumed, %d variants",
+            frame_stats["static"],
+            frame_stats["no_faces"],
+            frame_stats["swapped"],
+            frame_stats.get("resumed", 0),
+            len(variants),
+        )
 
-        self.merge_audio_tracks(temp_video, input_video, output_video)
+        with timer.stage("audio_merge"):
+            for variant in variants:
+                if checkpoint_dir is None:
+                    self.merge_audio_tracks(variant.temp_video, input_video, variant.output_video)
+                else:
+                    self.join_segments(input_video, variant)
 
         if progress_callback:
             try:
@@ -183,6 +1060,8 @@ class FaceSwapBackgroundEngine:
             except Exception:
                 pass
 
+        return frame_stats
+
 
 if __name__ == "__main__":
     MODEL_PATH = "models/inswapper_128.onnx"
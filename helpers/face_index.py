@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+from helpers.checkpoint import write_json_atomic
+
+# bumped whenever the layout of the files below changes
+INDEX_FORMAT = 1
+# faces stored per frame; frames with more faces are not indexed and always detected
+MAX_FACES = 8
+# per face: bbox (4), det_score, kps (5 x 2)
+FACE_FIELDS = 15
+META_NAME = "meta.json"
+# a face keeps its track id when it overlaps a face of the previous indexed frame this much
+TRACK_IOU = 0.3
+
+
+def video_key(path):
+    """
+    Index key of a video file from its absolute path, size and mtime, a stat instead of
+    reading the whole file. Inputs are stored once and never rewritten in place, a file
+    replaced or touched gets a new key (and a new index).
+    """
+    stat = os.stat(path)
+    data = f"{os.path.realpath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}"
+    return hashlib.sha256(data.encode()).hexdigest()[:32]
+
+
+def settings_version(settings):
+    """
+    Short hash of the detector settings (model, input size, threshold, frame size...) an
+    index was built with. Indexes of other settings are never reused.
+    """
+    data = json.dumps({"format": INDEX_FORMAT, **settings}, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()[:16]
+
+
+def directory_size(path):
+    total = 0
+    for name in os.listdir(path):
+        try:
+            total += os.path.getsize(os.path.join(path, name))
+        except OSError:
+            pass
+    return total
+
+
+def box_iou(box, other):
+    x0, y0 = max(box[0], other[0]), max(box[1], other[1])
+    x1, y1 = min(box[2], other[2]), min(box[3], other[3])
+    overlap = max(0.0, x1 - x0) * max(0.0, y1 - y0)
+    union = (
+        (box[2] - box[0]) * (box[3] - box[1])
+        + (other[2] - other[0]) * (other[3] - other[1])
+        - overlap
+    )
+    return overlap / union if union > 0 else 0.0
+
+
+class FaceIndex:
+    """
+    Detected faces (bbox, score, kps and a track id) of every frame of one input video,
+    kept in memory mapped .npy files under root/<video key>_<settings version>/ so
+    later renders of the same video with the same detector settings skip detection.
+
+    counts[i] is the number of faces of frame i, -1 while frame i hasn't been detected
+    (static frames, frames a preview skipped, frames with more than MAX_FACES faces).
+    Frames are filled in as renders detect them; a count is written after its faces so a
+    killed render never leaves a frame that looks indexed but isn't.
+    """
+
+    def __init__(self, directory, frame_count):
+        self.directory = directory
+        self.frame_count = frame_count
+        self.faces = np.lib.format.open_memmap(os.path.join(directory, "faces.npy"), mode="r+")
+        self.tracks = np.lib.format.open_memmap(os.path.join(directory, "tracks.npy"), mode="r+")
+        self.counts = np.lib.format.open_memmap(os.path.join(directory, "counts.npy"), mode="r+")
+        self.next_track = int(self.tracks.max(initial=-1)) + 1
+        self.previous = None
+
+    @classmethod
+    def open(cls, root, video_key, settings, frame_count, max_bytes=None):
+        """
+        Open the index of video_key built with settings, creating it for frame_count
+        frames if there is none. Opening marks the index as used for the LRU eviction,
+        which runs (sparing this index) when a new one is created and max_bytes is set.
+        """
+        os.makedirs(root, exist_ok=True)
+        name = f"{video_key}_{settings_version(settings)}"
+        directory = os.path.join(root, name)
+
+        created = False
+        if not os.path.exists(os.path.join(directory, META_NAME)):
+            # built next to the final directory and renamed into place, so a concurrent
+            # worker either sees a complete index or none
+            temp_directory = f"{directory}.{os.getpid()}.tmp"
+            os.makedirs(temp_directory, exist_ok=True)
+            frames = max(frame_count, 1)
+            faces = np.lib.format.open_memmap(
+                os.path.join(temp_directory, "faces.npy"),
+                mode="w+",
+                dtype=np.float32,
+                shape=(frames, MAX_FACES, FACE_FIELDS),
+            )
+            tracks = np.lib.format.open_memmap(
+                os.path.join(temp_directory, "tracks.npy"),
+                mode="w+",
+                dtype=np.int32,
+                shape=(frames, MAX_FACES),
+            )
+            tracks[:] = -1
+            counts = np.lib.format.open_memmap(
+                os.path.join(temp_directory, "counts.npy"),
+                mode="w+",
+                dtype=np.int8,
+                shape=(frames,),
+            )
+            counts[:] = -1
+            for array in (faces, tracks, counts):
+                array.flush()
+            del faces, tracks, counts
+            write_json_atomic(
+                os.path.join(temp_directory, META_NAME),
+                {
+                    "format": INDEX_FORMAT,
+                    "video_key": video_key,
+                    "settings": settings,
+                    "frames": frames,
+                    "created": time.time(),
+                },
+            )
+            try:
+                os.rename(temp_directory, directory)
+                created = True
+            except OSError:
+                # another worker created it first
+                shutil.rmtree(temp_directory, ignore_errors=True)
+
+        with open(os.path.join(directory, META_NAME)) as f:
+            meta = json.load(f)
+        os.utime(os.path.join(directory, META_NAME))
+
+        if created and max_bytes:
+            evict_indexes(root, max_bytes, keep=(name,))
+        return cls(directory, meta["frames"])
+
+    def get(self, frame_index):
+        """
+        Faces of frame_index sorted left to right like detect_faces, None if unknown.
+        """
+        if not 0 <= frame_index < self.frame_count:
+            return None
+        count = int(self.counts[frame_index])
+        if count < 0:
+            return None
+        from insightface.app.common import Face
+
+        faces = []
+        for slot in range(count):
+            values = np.array(self.faces[frame_index, slot])
+            faces.append(
+                Face(
+                    bbox=values[0:4],
+                    det_score=values[4],
+                    kps=values[5:15].reshape(5, 2),
+                    track_id=int(self.tracks[frame_index, slot]),
+                )
+            )
+        self.previous = faces
+        return faces
+
+    def put(self, frame_index, faces):
+        """
+        Store the detected faces of frame_index, giving each a track id: the id of the
+        face it overlaps most in the previously stored or read frame, else a new one.
+        """
+        if not 0 <= frame_index < self.frame_count or len(faces) > MAX_FACES:
+            return
+        if any(face.kps is None for face in faces):
+            return
+
+        previous = self.previous or []
+        taken = set()
+        for slot, face in enumerate(faces):
+            best, best_iou = None, TRACK_IOU
+            for other in previous:
+                iou = box_iou(face.bbox, other.bbox)
+                if other.track_id not in taken and iou >= best_iou:
+                    best, best_iou = other.track_id, iou
+            if best is None:
+                best = self.next_track
+                self.next_track += 1
+            taken.add(best)
+            face["track_id"] = best
+
+            self.faces[frame_index, slot, 0:4] = face.bbox[0:4]
+            self.faces[frame_index, slot, 4] = face.det_score
+            self.faces[frame_index, slot, 5:15] = np.asarray(face.kps).reshape(-1)[:10]
+            self.tracks[frame_index, slot] = best
+        self.counts[frame_index] = len(faces)
+        self.previous = faces
+
+    def close(self):
+        for array in (self.faces, self.tracks, self.counts):
+            array.flush()
+
+
+def evict_indexes(root, max_bytes, keep=()):
+    """
+    Delete the least recently used indexes under root until they fit in max_bytes.
+    Returns the names of the deleted indexes.
+    """
+    entries = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        meta = os.path.join(path, META_NAME)
+        if not os.path.isdir(path) or not os.path.exists(meta):
+            continue
+        entries.append((os.path.getmtime(meta), name, directory_size(path)))
+
+    total = sum(size for _, _, size in entries)
+    evicted = []
+    for _, name, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name in keep:
+            continue
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        total -= size
+        evicted.append(name)
+    return evicted
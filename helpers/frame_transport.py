@@ -0,0 +1,82 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedFrameRing:
+    """
+    `slots` frames of one shape in a single shared memory block, handed between processes
+    by slot index instead of pickling pixels: a stage takes a free slot (acquire), decodes
+    or renders into frame(slot), a view of the shared block, puts (slot, ...) on the next
+    stage's queue, and the last stage gives the slot back (release). Only small tuples go
+    through the queues. With every slot in use acquire blocks, which bounds the frames in
+    flight and throttles a decoder running ahead of inference.
+
+    The ring is handed to the stage processes as a Process argument, they attach to the
+    block by name. The creating process unlinks it once the stages are done.
+    """
+
+    def __init__(self, shape, slots=8, dtype=np.uint8, context=None):
+        context = context or multiprocessing.get_context("spawn")
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        self.frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=self.frame_bytes * slots)
+        self.owner = True
+        self.free = context.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+        self._attach()
+
+    def _attach(self):
+        self.frames = np.ndarray((self.slots, *self.shape), dtype=self.dtype, buffer=self.shm.buf)
+
+    def __getstate__(self):
+        return {
+            "name": self.shm.name,
+            "shape": self.shape,
+            "dtype": self.dtype.str,
+            "slots": self.slots,
+            "free": self.free,
+        }
+
+    def __setstate__(self, state):
+        self.shape = state["shape"]
+        self.dtype = np.dtype(state["dtype"])
+        self.slots = state["slots"]
+        self.frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(name=state["name"])
+        self.owner = False
+        self.free = state["free"]
+        self._attach()
+
+    @property
+    def mb(self):
+        return self.frame_bytes * self.slots / (1024 * 1024)
+
+    def frame(self, slot):
+        """
+        The slot's frame, written and read in place. Valid until the slot is released.
+        """
+        return self.frames[slot]
+
+    def acquire(self, timeout=None):
+        """
+        Index of a free slot, waiting for one to be released (queue.Empty after timeout).
+        """
+        return self.free.get(timeout=timeout)
+
+    def release(self, slot):
+        self.free.put(slot)
+
+    def close(self):
+        """
+        Detach this process from the block (frame views taken from it must be gone), and
+        free it when this is the process that created it.
+        """
+        self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,113 @@
+import json
+import logging
+
+log = logging.getLogger("Matting")
+
+# rembg models by speed/quality tier, fastest first. input_size is the square the model
+# runs at, which (with the model's depth) sets its cost independently of the frame size.
+MATTING_TIERS = {
+    "fast": {"model": "u2netp", "input_size": 320},
+    "balanced": {"model": "silueta", "input_size": 320},
+    # trained on people only, clean edges on talking head footage
+    "portrait": {"model": "u2net_human_seg", "input_size": 320},
+    "quality": {"model": "isnet-general-use", "input_size": 1024},
+}
+
+DEFAULT_AUTO_OPTIONS = {
+    # tiers auto may pick, best quality first
+    "tiers": ["quality", "portrait", "balanced", "fast"],
+    # matting frames per second a tier has to sustain on the job's frames ...
+    "target_fps": 6,
+    # ... unless matting the whole job at that tier takes at most this many seconds
+    "short_job_seconds": 60,
+    # used without benchmark numbers for the job's tiers, None for the cheapest of tiers
+    # (an unmeasured host may be too slow for anything heavier)
+    "fallback": None,
+}
+
+
+def matting_model(tier):
+    """
+    rembg model name of a tier, a model name passes through unchanged.
+    """
+    if tier in MATTING_TIERS:
+        return MATTING_TIERS[tier]["model"]
+    return tier
+
+
+def fallback_tier(options):
+    """
+    The tier auto runs without benchmark numbers: options["fallback"], or the cheapest
+    (last) of options["tiers"].
+    """
+    return options.get("fallback") or options["tiers"][-1]
+
+
+def load_matting_benchmark(path):
+    """
+    {tier: [[pixels, fps], ...]} from a benchmark_matting report, {} if there is none.
+    """
+    if not path:
+        return {}
+    try:
+        with open(path) as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    measured = {}
+    for result in report.get("results", []):
+        measured.setdefault(result["tier"], []).append(
+            [result["width"] * result["height"], result["fps"]]
+        )
+    for points in measured.values():
+        points.sort()
+    return measured
+
+
+def estimate_tier_fps(points, pixels):
+    """
+    Matting fps at a frame of pixels from [pixels, fps] measurements: interpolated
+    between the measured sizes, scaled down by the pixel ratio above the largest one
+    (the frame to model input resize and the mask resize back grow with the frame).
+    """
+    if not points:
+        return None
+    if pixels <= points[0][0]:
+        return points[0][1]
+    for (low_pixels, low_fps), (high_pixels, high_fps) in zip(points, points[1:]):
+        if pixels <= high_pixels:
+            share = (pixels - low_pixels) / (high_pixels - low_pixels)
+            return low_fps + (high_fps - low_fps) * share
+    largest_pixels, largest_fps = points[-1]
+    return largest_fps * largest_pixels / pixels
+
+
+def choose_matting_tier(width, height, frames, benchmark, options=None):
+    """
+    The best quality tier of options["tiers"] that keeps up with the job: its estimated
+    fps at width x height reaches target_fps, or matting all frames takes no longer than
+    short_job_seconds. Falls back to the fastest measured tier, or fallback_tier
+    without any measurement for these tiers.
+    Returns (tier, estimated fps or None).
+    """
+    options = {**DEFAULT_AUTO_OPTIONS, **(options or {})}
+    pixels = width * height
+
+    estimates = [
+        (tier, estimate_tier_fps(benchmark.get(tier), pixels)) for tier in options["tiers"]
+    ]
+    estimates = [(tier, fps) for tier, fps in estimates if fps]
+    if not estimates:
+        fallback = fallback_tier(options)
+        log.warning(
+            "No matting benchmark for tiers %s (run benchmark_matting), using %s",
+            options["tiers"],
+            fallback,
+        )
+        return fallback, None
+
+    for tier, fps in estimates:
+        if fps >= options["target_fps"] or frames / fps <= options["short_job_seconds"]:
+            return tier, fps
+    return max(estimates, key=lambda estimate: estimate[1])
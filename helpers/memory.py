@@ -0,0 +1,233 @@
+import os
+import ctypes
+import ctypes.util
+import cv2
+import numpy as np
+
+from helpers.renditions import rendition_size
+
+# bytes the render loop keeps alive per output pixel on top of the loaded models and the
+# decoder: decode slots, the writer's copy, static gate and swap temporaries. Measured with
+# benchmark_pipeline as the peak RSS difference between 720p and 2160p runs.
+LOOP_BYTES_PER_PIXEL = 19
+# matting input copy, the mask and the float32 alpha/work arrays of the blend
+BACKGROUND_BYTES_PER_PIXEL = 28
+# yuv420 frames held per input pixel by the decoder (one per thread plus references) and by
+# x264 per rendition pixel (lookahead, one per thread, references)
+YUV_BYTES_PER_PIXEL = 1.5
+DECODER_REFERENCE_FRAMES = 5
+ENCODER_REFERENCE_FRAMES = 3
+# resize copy of a rendition before it goes down the pipe
+RENDITION_BYTES_PER_PIXEL = 3
+# every variant after the first of a shared render: its own copy of the frame to swap
+# faces into and the main writer's conversion buffers
+VARIANT_BYTES_PER_PIXEL = 6
+# heights tried, largest first, when a job has to be downscaled into the budget
+DOWNSCALE_HEIGHTS = (2160, 1440, 1080, 720, 540, 480, 360)
+
+MB = 1024 * 1024
+
+
+class MemoryBudgetExceeded(RuntimeError):
+    """
+    The render doesn't fit the memory budget, not even downscaled.
+    """
+
+
+def trim_heap():
+    """
+    Hand memory freed by the last render back to the OS (glibc keeps large freed frame
+    buffers in its heap), so the next job's RSS starts from the models again.
+    Returns False where malloc_trim isn't available.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"))
+        libc.malloc_trim(0)
+        return True
+    except (OSError, AttributeError, TypeError):
+        return False
+
+
+def estimate_render_mb(
+    width,
+    height,
+    background=False,
+    rendition_heights=(),
+    decode_threads=1,
+    lookahead=10,
+    input_size=None,
+    variants=1,
+):
+    """
+    Estimated memory of rendering a width x height output stream decoded from input_size
+    (default: the same size), models excluded. A shared render of several variants counts
+    background as the number of variants with a background and passes the renditions of
+    all of them.
+    """
+    input_width, input_height = input_size or (width, height)
+    input_pixels = input_width * input_height
+    pixels = width * height
+
+    total = input_pixels * YUV_BYTES_PER_PIXEL * (decode_threads + DECODER_REFERENCE_FRAMES)
+    if (input_width, input_height) != (width, height):
+        # full size decode slot the output is resized from
+        total += input_pixels * 3
+    total += pixels * LOOP_BYTES_PER_PIXEL
+    total += pixels * VARIANT_BYTES_PER_PIXEL * (variants - 1)
+    if background:
+        total += pixels * BACKGROUND_BYTES_PER_PIXEL * int(background)
+    for rendition_height in rendition_heights:
+        rendition_width, rendition_height = rendition_size(width, height, rendition_height)
+        rendition_pixels = rendition_width * rendition_height
+        total += rendition_pixels * RENDITION_BYTES_PER_PIXEL
+        # encoder threads follow the decoder threads in the plan
+        encoder_frames = lookahead + decode_threads + ENCODER_REFERENCE_FRAMES
+        total += rendition_pixels * YUV_BYTES_PER_PIXEL * encoder_frames
+    return total / MB
+
+
+class MemoryPlan:
+    def __init__(self, size, estimated_mb, available_mb, decode_threads, lookahead):
+        self.size = size
+        self.estimated_mb = estimated_mb
+        self.available_mb = available_mb
+        self.decode_threads = decode_threads
+        self.lookahead = lookahead
+
+    def as_dict(self):
+        return {
+            "size": list(self.size),
+            "estimated_mb": round(self.estimated_mb, 1),
+            "available_mb": None if self.available_mb is None else round(self.available_mb, 1),
+            "decode_threads": self.decode_threads,
+            "lookahead": self.lookahead,
+        }
+
+
+def plan_render(
+    width,
+    height,
+    available_mb=None,
+    background=False,
+    rendition_heights=(),
+    allow_downscale=True,
+    max_decode_threads=None,
+    input_size=None,
+    variants=1,
+):
+    """
+    Pick the output size, decoder threads and x264 lookahead that fit available_mb, for
+    a width x height output decoded from input_size (default: the same size).
+    The budget goes to the full size first, trading decoder threads and lookahead for
+    memory before downscaling (if allowed, down to DOWNSCALE_HEIGHTS[-1]).
+    available_mb None means no budget: full size, threads and lookahead left at the
+    OpenCV/x264 defaults (None in the plan).
+    """
+    max_decode_threads = max_decode_threads or min(4, os.cpu_count() or 1)
+    input_size = input_size or (width, height)
+
+    def estimate(size, decode_threads, lookahead):
+        return estimate_render_mb(
+            size[0],
+            size[1],
+            background,
+            rendition_heights,
+            decode_threads,
+            lookahead,
+            input_size=input_size,
+            variants=variants,
+        )
+
+    if available_mb is None:
+        estimated = estimate((width, height), max_decode_threads, 10)
+        return MemoryPlan((width, height), estimated, None, None, None)
+
+    sizes = [(width, height)]
+    if allow_downscale:
+        sizes += [
+            rendition_size(width, height, candidate)
+            for candidate in DOWNSCALE_HEIGHTS
+            if candidate < height
+        ]
+
+    # 10 is x264's own lookahead at the veryfast preset the renditions use
+    tiers = ((max_decode_threads, 10), (max(1, max_decode_threads // 2), 6), (1, 4))
+    for size in sizes:
+        for decode_threads, lookahead in tiers:
+            estimated = estimate(size, decode_threads, lookahead)
+            if estimated <= available_mb:
+                return MemoryPlan(size, estimated, available_mb, decode_threads, lookahead)
+
+    smallest = sizes[-1]
+    raise MemoryBudgetExceeded(
+        f"Rendering {width}x{height} needs about {estimate(smallest, 1, 4):.0f} MB even at "
+        f"{smallest[0]}x{smallest[1]}, the budget leaves {available_mb:.0f} MB"
+    )
+
+
+class FrameBuffers:
+    """
+    Arrays the render loop reuses instead of allocating per frame: two alternating decode
+    slots (so decoding never overwrites the frame the static gate keeps as the previous
+    output), a raw slot for frames resized after decoding, and the alpha/work/output
+    arrays of the background blend. Everything is allocated on the first frame.
+    In a shared render every variant has its own instance for its copy and blend arrays.
+    """
+
+    def __init__(self):
+        self.slots = [None, None]
+        self.current = 0
+        self.raw = None
+        self.swapped = None
+        self.alpha = None
+        self.work = None
+        self.blended = None
+
+    def read(self, capture, output_size=None):
+        slot = self.slots[self.current]
+        if output_size is None:
+            success, frame = capture.read(slot)
+        else:
+            success, raw = capture.read(self.raw)
+            if not success:
+                return False, None
+            self.raw = raw
+            frame = cv2.resize(raw, output_size, dst=slot, interpolation=cv2.INTER_AREA)
+        if success:
+            self.slots[self.current] = frame
+        return success, frame
+
+    def keep(self):
+        """
+        The frame in the current slot is now referenced elsewhere, decode into the other one.
+        """
+        self.current ^= 1
+
+    def copy(self, frame):
+        """
+        Copy of frame to swap faces into while other variants still need the decoded one.
+        The returned array is reused by the next call.
+        """
+        if self.swapped is None or self.swapped.shape != frame.shape:
+            self.swapped = np.empty_like(frame)
+        np.copyto(self.swapped, frame)
+        return self.swapped
+
+    def blend(self, frame, mask, background):
+        """
+        frame * alpha + background * (1 - alpha) with alpha = mask / 255, computed as
+        background + (frame - background) * alpha in the preallocated float32 arrays.
+        The returned array is reused by the next call.
+        """
+        shape = frame.shape[:2]
+        if self.alpha is None or self.alpha.shape[:2] != shape:
+            self.alpha = np.empty((*shape, 1), dtype=np.float32)
+            self.work = np.empty((*shape, 3), dtype=np.float32)
+            self.blended = np.empty((*shape, 3), dtype=np.uint8)
+
+        np.multiply(mask[:, :, None], 1 / 255, out=self.alpha, dtype=np.float32)
+        np.subtract(frame, background, out=self.work, dtype=np.float32)
+        self.work *= self.alpha
+        self.work += background
+        np.copyto(self.blended, self.work, casting="unsafe")
+        return self.blended
@@ -0,0 +1,268 @@
+import os
+import glob
+import logging
+import onnxruntime as ort
+from insightface.app import FaceAnalysis
+from insightface.utils.storage import ensure_available
+from insightface.model_zoo.model_zoo import PickableInferenceSession
+from insightface.model_zoo.retinaface import RetinaFace
+from insightface.model_zoo.landmark import Landmark
+from insightface.model_zoo.attribute import Attribute
+from insightface.model_zoo.arcface_onnx import ArcFaceONNX
+from insightface.model_zoo.inswapper import INSwapper
+from rembg import new_session
+from rembg.sessions import sessions_class
+
+log = logging.getLogger("OnnxSession")
+
+OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+DEFAULT_SESSION_CONFIG = {
+    "graph_optimization_level": "all",
+    "execution_mode": "sequential",
+    "enable_mem_arena": True,
+    "enable_mem_pattern": True,
+    "intra_op_num_threads": 0,
+    "inter_op_num_threads": 0,
+    "optimized_model_dir": None,
+    "io_binding": False,
+}
+
+OPTIMIZED_SUFFIX = ".opt.onnx"
+
+PRECISION_TIERS = ("fp32", "fp16", "int8-dynamic", "int8-static")
+
+
+def resolve_session_config(config=None):
+    resolved = dict(DEFAULT_SESSION_CONFIG)
+    if config:
+        unknown = set(config) - set(DEFAULT_SESSION_CONFIG)
+        if unknown:
+            raise ValueError(f"Unknown ONNX session options: {sorted(unknown)}")
+        resolved.update(config)
+    return resolved
+
+
+def precision_variant_path(model_path, precision="fp32", quantized_dir=None):
+    """
+    Path of the model variant for the given precision tier.
+    Variants are named <stem>.<tier>.onnx inside quantized_dir (see the quantize_models
+    command); missing variants fall back to the fp32 source model.
+    """
+    if precision not in PRECISION_TIERS:
+        raise ValueError(f"Unknown precision tier: {precision}")
+
+    model_path = str(model_path)
+    if precision == "fp32" or not quantized_dir:
+        return model_path
+
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    variant = os.path.join(str(quantized_dir), f"{stem}.{precision}.onnx")
+    if not os.path.exists(variant):
+        log.warning("No %s variant for %s, using fp32", precision, model_path)
+        return model_path
+    return variant
+
+
+def optimized_model_path(model_path, config, providers):
+    """
+    Path of the serialized optimized graph for model_path, or None if caching is off.
+    Optimized graphs are hardware/provider and onnxruntime version specific, so all three
+    are part of the name and an upgrade optimizes the graph again.
+    """
+    cache_dir = config.get("optimized_model_dir")
+    level = config["graph_optimization_level"]
+    if not cache_dir or level == "disable":
+        return None
+
+    device = "cuda" if "CUDAExecutionProvider" in providers else "cpu"
+    stem = os.path.splitext(os.path.basename(str(model_path)))[0]
+    name = f"{stem}.{level}.{device}.ort{ort.__version__}{OPTIMIZED_SUFFIX}"
+    return os.path.join(str(cache_dir), name)
+
+
+def build_session_options(model_path, config, providers):
+    """
+    Return (path_to_load, SessionOptions) for model_path.
+    Reuses a previously serialized optimized graph when it is newer than the source model,
+    otherwise asks onnxruntime to write one while it optimizes this load.
+    """
+    options = ort.SessionOptions()
+    options.execution_mode = EXECUTION_MODES[config["execution_mode"]]
+    options.enable_mem_pattern = bool(config["enable_mem_pattern"])
+    options.enable_cpu_mem_arena = bool(config["enable_mem_arena"])
+    if config["intra_op_num_threads"]:
+        options.intra_op_num_threads = int(config["intra_op_num_threads"])
+    if config["inter_op_num_threads"]:
+        options.inter_op_num_threads = int(config["inter_op_num_threads"])
+
+    model_path = str(model_path)
+    cached_path = optimized_model_path(model_path, config, providers)
+
+    if cached_path and os.path.exists(cached_path) and (
+        os.path.getmtime(cached_path) >= os.path.getmtime(model_path)
+    ):
+        options.graph_optimization_level = OPTIMIZATION_LEVELS["disable"]
+        log.info("Loading optimized graph %s", cached_path)
+        return cached_path, options
+
+    options.graph_optimization_level = OPTIMIZATION_LEVELS[
+        config["graph_optimization_level"]
+    ]
+    if cached_path:
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        options.optimized_model_filepath = cached_path
+        log.info("Optimizing %s, saving graph to %s", model_path, cached_path)
+    return model_path, options
+
+
+class IOBindingSession:
+    """
+    Wraps an InferenceSession so run() goes through IO binding, outputs are bound on the
+    session's device and only copied back once instead of per intermediate transfer.
+    """
+
+    def __init__(self, session):
+        self._session = session
+        providers = session.get_providers()
+        self._device = "cuda" if "CUDAExecutionProvider" in providers else "cpu"
+
+    def run(self, output_names, input_feed, run_options=None):
+        binding = self._session.io_binding()
+        for name, value in input_feed.items():
+            binding.bind_cpu_input(name, value)
+
+        if output_names is None:
+            output_names = [output.name for output in self._session.get_outputs()]
+        for name in output_names:
+            binding.bind_output(name, self._device)
+
+        self._session.run_with_iobinding(binding, run_options)
+        return binding.copy_outputs_to_cpu()
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+def create_session(model_path, providers, config):
+    load_path, options = build_session_options(model_path, config, providers)
+    session = PickableInferenceSession(
+        load_path, sess_options=options, providers=list(providers)
+    )
+    if config["io_binding"]:
+        return IOBindingSession(session)
+    return session
+
+
+def route_insightface_model(model_path, session):
+    """
+    Same routing as insightface's ModelRouter, but with a prebuilt session.
+    model_file stays the source model because the model classes read the original graph
+    (input mean/std nodes, the inswapper emap initializer) which optimization may strip.
+    """
+    inputs = session.get_inputs()
+    input_shape = inputs[0].shape
+    outputs = session.get_outputs()
+
+    if len(outputs) >= 5:
+        return RetinaFace(model_file=model_path, session=session)
+    if input_shape[2] == 192 and input_shape[3] == 192:
+        return Landmark(model_file=model_path, session=session)
+    if input_shape[2] == 96 and input_shape[3] == 96:
+        return Attribute(model_file=model_path, session=session)
+    if len(inputs) == 2 and input_shape[2] == 128 and input_shape[3] == 128:
+        return INSwapper(model_file=model_path, session=session)
+    if (
+        input_shape[2] == input_shape[3]
+        and input_shape[2] >= 112
+        and input_shape[2] % 16 == 0
+    ):
+        return ArcFaceONNX(model_file=model_path, session=session)
+    return None
+
+
+def load_insightface_model(
+    model_path, providers, config, precision="fp32", quantized_dir=None
+):
+    model_path = str(model_path)
+    session_path = precision_variant_path(model_path, precision, quantized_dir)
+    session = create_session(session_path, providers, config)
+    return route_insightface_model(model_path, session)
+
+
+class TunedFaceAnalysis(FaceAnalysis):
+    """
+    FaceAnalysis whose model pack sessions are built with our session options.
+    """
+
+    def __init__(
+        self,
+        name="buffalo_l",
+        root="~/.insightface",
+        providers=None,
+        config=None,
+        precision="fp32",
+        quantized_dir=None,
+    ):
+        ort.set_default_logger_severity(3)
+        providers = providers or ["CPUExecutionProvider"]
+        config = resolve_session_config(config)
+
+        self.models = {}
+        self.model_dir = ensure_available("models", name, root=root)
+
+        onnx_files = sorted(glob.glob(os.path.join(self.model_dir, "*.onnx")))
+        for onnx_file in onnx_files:
+            if onnx_file.endswith(OPTIMIZED_SUFFIX):
+                continue
+            model = load_insightface_model(
+                onnx_file, providers, config, precision, quantized_dir
+            )
+            if model is None:
+                log.info("Model not recognized: %s", onnx_file)
+                continue
+            if model.taskname in self.models:
+                continue
+            self.models[model.taskname] = model
+
+        if "detection" not in self.models:
+            raise RuntimeError(f"No detection model found in {self.model_dir}")
+        self.det_model = self.models["detection"]
+
+
+def load_rembg_session(model_name, providers, config):
+    """
+    Build a rembg session with our session options. The model's session class is
+    constructed through its own __init__, subclassed only so it loads the cached optimized
+    graph when there is one. Falls back to rembg's own new_session for models it
+    constructs in a non-standard way.
+    """
+    session_class = next(
+        (cls for cls in sessions_class if cls.name() == model_name), None
+    )
+    if session_class is None:
+        return new_session(model_name, providers=list(providers))
+
+    load_path, options = build_session_options(
+        session_class.download_models(), config, providers
+    )
+
+    class TunedSession(session_class):
+        @classmethod
+        def download_models(cls, *args, **kwargs):
+            return load_path
+
+    session = TunedSession(model_name, options, providers=list(providers))
+    if config["io_binding"]:
+        session.inner_session = IOBindingSession(session.inner_session)
+    return session
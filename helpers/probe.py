@@ -0,0 +1,19 @@
+def probe_video(path):
+    """
+    Frame count, size and fps of a video file from its container headers, None if unreadable.
+    cv2 is imported here so the API process (which probes new uploads) starts without it.
+    """
+    import cv2
+
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        return None
+    try:
+        return {
+            "frame_count": int(capture.get(cv2.CAP_PROP_FRAME_COUNT)),
+            "width": int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": capture.get(cv2.CAP_PROP_FPS),
+        }
+    finally:
+        capture.release()
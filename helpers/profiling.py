@@ -0,0 +1,185 @@
+import time
+import resource
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+# prometheus style upper bounds, seconds for stages and plain counts for observed values
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 12, 20)
+
+
+def histogram(values, buckets):
+    """
+    Cumulative bucket counts (le semantics, +Inf is the count), sum and count of values.
+    """
+    # numpy is imported where it's used, the API process imports this module for the buckets
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        "buckets": [int(np.count_nonzero(values <= bound)) for bound in buckets],
+        "sum": float(values.sum()),
+        "count": int(values.size),
+    }
+
+
+class StageTimer:
+    """
+    Collects wall time samples per named pipeline stage (decode, detect, swap, ...),
+    plus plain counters and observed values such as faces per frame.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.values = defaultdict(list)
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[name].append(time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        self.samples[name].append(seconds)
+
+    def observe(self, name, value):
+        self.values[name].append(value)
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def total(self, name):
+        return float(sum(self.samples.get(name, ())))
+
+    def merge(self, other):
+        """
+        Add the samples, values and counters of another timer to this one.
+        """
+        for name, samples in other.samples.items():
+            self.samples[name].extend(samples)
+        for name, values in other.values.items():
+            self.values[name].extend(values)
+        for name, amount in other.counters.items():
+            self.counters[name] += amount
+        return self
+
+    def summary(self):
+        import numpy as np
+
+        result = {}
+        for name, values in self.samples.items():
+            values_ms = np.array(values) * 1000
+            result[name] = {
+                "count": int(len(values_ms)),
+                "total_s": round(float(values_ms.sum()) / 1000, 4),
+                "mean_ms": round(float(values_ms.mean()), 3),
+                "p95_ms": round(float(np.percentile(values_ms, 95)), 3),
+            }
+        return result
+
+    def histograms(self, buckets=STAGE_BUCKETS):
+        return {name: histogram(values, buckets) for name, values in self.samples.items()}
+
+
+class GroupTimers:
+    """
+    Timers of jobs rendered together. The stages they share (download, decode, detection,
+    matting, encoding, the frame counts) go to group, what each job does alone (its
+    upload) to job(job_id). report(job_id) adds the group's stages to the first job
+    reported only, so totals over the jobs' metrics count every decoded frame once.
+    """
+
+    def __init__(self):
+        self.group = StageTimer()
+        self.jobs = defaultdict(StageTimer)
+        self.reported = False
+
+    def job(self, job_id):
+        return self.jobs[job_id]
+
+    def report(self, job_id):
+        timer = self.jobs[job_id]
+        if self.reported:
+            return timer
+        self.reported = True
+        return StageTimer().merge(self.group).merge(timer)
+
+
+class NullTimer:
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def record(self, name, seconds):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+
+def reset_peak_rss():
+    """
+    Reset the kernel's peak RSS (VmHWM) of this process so the next reading covers one job.
+    Needs Linux >= 4.0, elsewhere the peak stays the process lifetime peak.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB, VmHWM when available (it honours
+    reset_peak_rss), otherwise ru_maxrss which is KB on Linux.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def current_rss_mb():
+    """
+    Resident set size of this process right now in MB (VmRSS), None where /proc is missing.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def job_metrics(timer):
+    """
+    JobMetrics fields of a finished (or failed) job's StageTimer, computed where the job
+    ran: the worker's own database row, or the payload a remote worker reports.
+    """
+    return {
+        "stage_timings": timer.summary(),
+        "stage_histograms": timer.histograms(STAGE_BUCKETS),
+        "frames_processed": timer.counters.get("frames", 0),
+        "faces_per_frame": histogram(timer.values.get("faces_per_frame", []), COUNT_BUCKETS),
+        "frame_paths": {
+            name[len("frames_"):]: count
+            for name, count in timer.counters.items()
+            if name.startswith("frames_")
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
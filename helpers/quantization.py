@@ -0,0 +1,173 @@
+import os
+import time
+import logging
+import cv2
+import numpy as np
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    QuantFormat,
+    QuantType,
+    quantize_dynamic,
+    quantize_static,
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+log = logging.getLogger("Quantization")
+
+
+class RecordingSession:
+    """
+    Wraps an InferenceSession, keeps per-call latency and optionally the first
+    max_samples input feeds so they can be replayed as calibration data.
+    """
+
+    def __init__(self, session, max_samples=0):
+        self._session = session
+        self.max_samples = max_samples
+        self.samples = []
+        self.timings = []
+
+    def run(self, output_names, input_feed, run_options=None):
+        if len(self.samples) < self.max_samples:
+            self.samples.append({k: np.array(v, copy=True) for k, v in input_feed.items()})
+
+        start = time.perf_counter()
+        outputs = self._session.run(output_names, input_feed, run_options)
+        self.timings.append(time.perf_counter() - start)
+        return outputs
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+class FeedCalibrationReader(CalibrationDataReader):
+    def __init__(self, samples):
+        self._samples = iter(samples)
+
+    def get_next(self):
+        return next(self._samples, None)
+
+
+def engine_models(engine):
+    """
+    {name: insightface model} for every onnx model the engine runs per frame.
+    """
+    models = {f"buffalo_l/{task}": model for task, model in engine.face_app.models.items()}
+    models["inswapper"] = engine.face_swapper
+    return models
+
+
+def record_engine_sessions(engine, max_samples=0):
+    """
+    Replace each model session with a RecordingSession, returns {name: recorder}.
+    """
+    recorders = {}
+    for name, model in engine_models(engine).items():
+        recorder = RecordingSession(model.session, max_samples=max_samples)
+        model.session = recorder
+        recorders[name] = recorder
+    return recorders
+
+
+def sample_frames(clip_paths, every_n=15, max_frames=None):
+    for clip_path in clip_paths:
+        capture = cv2.VideoCapture(clip_path)
+        if not capture.isOpened():
+            raise RuntimeError(f"Unable to open clip: {clip_path}")
+
+        frame_index = 0
+        produced = 0
+        while True:
+            success, frame = capture.read()
+            if not success:
+                break
+            if frame_index % every_n == 0:
+                yield clip_path, frame_index, frame
+                produced += 1
+                if max_frames and produced >= max_frames:
+                    break
+            frame_index += 1
+        capture.release()
+
+
+def swap_frame(engine, frame):
+    """
+    Detect and swap a single frame like process_video does, without matting.
+    Returns (output_frame, detected_faces).
+    """
+    detected_faces = engine.face_app.get(frame)
+    detected_faces = sorted(detected_faces, key=lambda f: f.bbox[0])
+
+    output = frame
+    for idx, detected_face in enumerate(detected_faces):
+        source_face = engine.source_faces[idx % len(engine.source_faces)]
+        output = engine.face_swapper.get(output, detected_face, source_face, paste_back=True)
+    return output, detected_faces
+
+
+def quantize_model(model_path, output_path, precision, calibration_samples=None):
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    if precision == "int8-dynamic":
+        quantize_dynamic(model_path, output_path, weight_type=QuantType.QInt8)
+
+    elif precision == "int8-static":
+        if not calibration_samples:
+            raise RuntimeError(f"No calibration samples recorded for {model_path}")
+        preprocessed_path = output_path + ".pre.onnx"
+        quant_pre_process(model_path, preprocessed_path, skip_symbolic_shape=True)
+        try:
+            quantize_static(
+                preprocessed_path,
+                output_path,
+                FeedCalibrationReader(calibration_samples),
+                quant_format=QuantFormat.QDQ,
+                per_channel=True,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+            )
+        finally:
+            os.remove(preprocessed_path)
+
+    elif precision == "fp16":
+        try:
+            import onnx
+            from onnxconverter_common import float16
+        except ImportError:
+            raise RuntimeError("fp16 conversion needs onnxconverter-common installed")
+        model = onnx.load(model_path)
+        model = float16.convert_float_to_float16(model, keep_io_types=True)
+        onnx.save(model, output_path)
+
+    else:
+        raise ValueError(f"Cannot quantize to {precision}")
+
+    log.info("Wrote %s variant %s", precision, output_path)
+    return output_path
+
+
+def cosine_similarity(a, b):
+    a = np.asarray(a, dtype=np.float32).ravel()
+    b = np.asarray(b, dtype=np.float32).ravel()
+    denom = np.linalg.norm(a) * np.linalg.norm(b)
+    if denom == 0:
+        return 0.0
+    return float(np.dot(a, b) / denom)
+
+
+def psnr(reference, candidate):
+    mse = np.mean((reference.astype(np.float32) - candidate.astype(np.float32)) ** 2)
+    if mse == 0:
+        return float("inf")
+    return float(10 * np.log10((255.0**2) / mse))
+
+
+def latency_summary(timings):
+    if not timings:
+        return {"calls": 0, "mean_ms": None, "p95_ms": None}
+    values = np.array(timings) * 1000
+    return {
+        "calls": int(len(values)),
+        "mean_ms": round(float(values.mean()), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+    }
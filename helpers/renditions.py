@@ -0,0 +1,96 @@
+import subprocess
+import cv2
+import numpy as np
+
+
+def rendition_size(frame_width, frame_height, height=None):
+    """
+    Output size for a rendition of the given height, keeping the aspect ratio, never
+    upscaling and rounded to even numbers as libx264 with yuv420p requires.
+    """
+    if not height or height >= frame_height:
+        width, height = frame_width, frame_height
+    else:
+        width = int(round(frame_width * height / frame_height))
+    return max(2, width - width % 2), max(2, height - height % 2)
+
+
+class VideoWriterSink:
+    """
+    Silent full size mp4v output through OpenCV, audio is merged afterwards.
+    """
+
+    def __init__(self, path, fps, size):
+        self.path = path
+        self.size = size
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+
+    def write(self, frame):
+        self.writer.write(frame)
+
+    def close(self):
+        self.writer.release()
+
+    def abort(self):
+        self.writer.release()
+
+
+class FfmpegSink:
+    """
+    Pipes raw frames into ffmpeg, which encodes them with libx264 at the given bitrate and
+    muxes the audio of audio_source in the same run. Frames are resized here so the pipe
+    only carries the rendition's pixels, into a buffer reused for every frame.
+    """
+
+    def __init__(
+        self,
+        path,
+        fps,
+        frame_size,
+        height=None,
+        bitrate=None,
+        audio_source=None,
+        lookahead=None,
+        threads=None,
+    ):
+        self.path = path
+        self.frame_size = frame_size
+        self.size = rendition_size(frame_size[0], frame_size[1], height)
+        self.resized = None
+
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{self.size[0]}x{self.size[1]}", "-r", str(fps),
+            "-i", "-",
+        ]
+        if audio_source:
+            command += ["-i", audio_source, "-map", "0:v:0", "-map", "1:a?", "-c:a", "aac", "-shortest"]
+        command += ["-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p"]
+        if bitrate:
+            command += ["-b:v", bitrate, "-maxrate", bitrate, "-bufsize", bitrate]
+        # both bound how many frames x264 keeps in memory
+        if lookahead is not None:
+            command += ["-rc-lookahead", str(lookahead)]
+        if threads is not None:
+            command += ["-threads", str(threads)]
+        command += ["-movflags", "+faststart", path]
+
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        if self.size != self.frame_size:
+            self.resized = cv2.resize(
+                frame, self.size, dst=self.resized, interpolation=cv2.INTER_AREA
+            )
+            frame = self.resized
+        self.process.stdin.write(np.ascontiguousarray(frame).data)
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed writing rendition {self.path}")
+
+    def abort(self):
+        self.process.kill()
+        self.process.wait()
@@ -0,0 +1,70 @@
+import cv2
+import numpy as np
+
+
+def face_roi(IM, crop_size, frame_shape):
+    """
+    Bounding box (x0, y0, x1, y1) in the frame of the crop_size square mapped back by IM,
+    padded by the mask blur radius and clipped to the frame.
+    """
+    corners = np.array(
+        [[0, 0], [crop_size, 0], [0, crop_size], [crop_size, crop_size]], dtype=np.float32
+    )
+    mapped = corners @ IM[:, :2].T + IM[:, 2]
+    estimated_size = int(np.sqrt(np.ptp(mapped[:, 0]) * np.ptp(mapped[:, 1])))
+    pad = max(estimated_size // 20, 5) + 4
+
+    x0 = max(int(np.floor(mapped[:, 0].min())) - pad, 0)
+    y0 = max(int(np.floor(mapped[:, 1].min())) - pad, 0)
+    x1 = min(int(np.ceil(mapped[:, 0].max())) + pad + 1, frame_shape[1])
+    y1 = min(int(np.ceil(mapped[:, 1].max())) + pad + 1, frame_shape[0])
+    return x0, y0, x1, y1
+
+
+def paste_back_roi(frame, bgr_fake, M):
+    """
+    Same blend as INSwapper.get(paste_back=True), but warps and blends only a padded region
+    around the face and writes it into frame in place, so the cost follows the face size
+    instead of the frame size. The padding covers the mask blur radius, so the ROI edges
+    stay zero like in the full-frame version and the result matches it.
+    """
+    crop_size = bgr_fake.shape[0]
+    IM = cv2.invertAffineTransform(M)
+
+    x0, y0, x1, y1 = face_roi(IM, crop_size, frame.shape)
+    if x1 <= x0 or y1 <= y0:
+        return frame
+
+    roi_IM = IM.copy()
+    roi_IM[0, 2] -= x0
+    roi_IM[1, 2] -= y0
+    roi_size = (x1 - x0, y1 - y0)
+
+    img_white = np.full((crop_size, crop_size), 255, dtype=np.float32)
+    warped_fake = cv2.warpAffine(bgr_fake, roi_IM, roi_size, borderValue=0.0)
+    img_mask = cv2.warpAffine(img_white, roi_IM, roi_size, borderValue=0.0)
+    img_mask[img_mask > 20] = 255
+
+    mask_h_inds, mask_w_inds = np.where(img_mask == 255)
+    if mask_h_inds.size == 0:
+        return frame
+    mask_h = np.max(mask_h_inds) - np.min(mask_h_inds)
+    mask_w = np.max(mask_w_inds) - np.min(mask_w_inds)
+    mask_size = int(np.sqrt(mask_h * mask_w))
+
+    k = max(mask_size // 10, 10)
+    img_mask = cv2.erode(img_mask, np.ones((k, k), np.uint8), iterations=1)
+    k = max(mask_size // 20, 5)
+    img_mask = cv2.GaussianBlur(img_mask, (2 * k + 1, 2 * k + 1), 0)
+    img_mask /= 255
+    img_mask = img_mask[:, :, None]
+
+    target = frame[y0:y1, x0:x1]
+    merged = img_mask * warped_fake + (1 - img_mask) * target.astype(np.float32)
+    target[:] = merged.astype(np.uint8)
+    return frame
+
+
+def swap_face_roi(face_swapper, frame, target_face, source_face):
+    bgr_fake, M = face_swapper.get(frame, target_face, source_face, paste_back=False)
+    return paste_back_roi(frame, bgr_fake, M)
@@ -1,8 +1,10 @@
-import yt_dlp
 import os
 
 
 def download_youtube(url, output_path="downloads"):
+    # imported here, yt_dlp loads all of its extractors on import
+    import yt_dlp
+
     os.makedirs(output_path, exist_ok=True)
 
     ydl_opts = {
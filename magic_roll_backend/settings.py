@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.QueryCountMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -79,12 +81,44 @@ WSGI_APPLICATION = 'magic_roll_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite unless POSTGRES_DB is set. The API and the workers write to the same database
+# concurrently, so SQLite runs in WAL mode (readers don't block the writer and the other
+# way round), waits up to SQLITE_TIMEOUT seconds for a lock instead of failing with
+# "database is locked", and starts write transactions IMMEDIATE so two of them can't
+# deadlock upgrading their read locks. Connections are kept DB_CONN_MAX_AGE seconds.
+# `db_load_test` compares these settings against the defaults under concurrent load.
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '60'))
+
+if os.getenv('POSTGRES_DB'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB'),
+            'USER': os.getenv('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+            'PORT': os.getenv('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {
+                'timeout': int(os.getenv('SQLITE_TIMEOUT', '20')),
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA wal_autocheckpoint=1000;'
+                ),
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -136,4 +170,166 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
-SWAPPER_MODEL_PATH = BASE_DIR / 'helpers' / 'models' / 'inswapper_128.onnx'
\ No newline at end of file
+# media under MEDIA_URL is served by api.media.serve_media with range requests and
+# ETag/Last-Modified when MEDIA_SERVE is on (DEBUG by default, in production the proxy
+# or the bucket serves the outputs), from these top level directories only: rendered
+# outputs, never the uploaded videos, faces and backgrounds, work dirs or face indexes
+MEDIA_SERVE = DEBUG
+MEDIA_PUBLIC_DIRS = ['output_videos', 'renditions']
+MEDIA_MAX_AGE = 3600
+# behind nginx set 'x-accel-redirect' (with an internal location at MEDIA_ACCEL_PREFIX
+# aliased to MEDIA_ROOT), behind apache/lighttpd 'x-sendfile': the proxy then streams the
+# file and handles ranges, and the gunicorn worker is free as soon as the headers are out
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+SWAPPER_MODEL_PATH = BASE_DIR / 'helpers' / 'models' / 'inswapper_128.onnx'
+# onnxruntime session tuning shared by the detector, swapper and rembg sessions.
+# optimized graphs are written to optimized_model_dir on first load and reused afterwards.
+ONNX_SESSION_OPTIONS = {
+    'graph_optimization_level': 'all',  # disable | basic | extended | all
+    'execution_mode': 'sequential',  # sequential | parallel
+    'enable_mem_arena': True,
+    'enable_mem_pattern': True,
+    'intra_op_num_threads': 0,  # 0 lets onnxruntime decide
+    'inter_op_num_threads': 0,
+    'optimized_model_dir': BASE_DIR / 'helpers' / 'models' / 'optimized',
+    'io_binding': False,
+}
+
+# fp32 | fp16 | int8-dynamic | int8-static, variants are produced by `manage.py quantize_models`
+MODEL_PRECISION = 'fp32'
+QUANTIZED_MODEL_DIR = BASE_DIR / 'helpers' / 'models' / 'quantized'
+
+# frames whose 160px grayscale copy changed by at most this much (0-255) since the last
+# rendered frame reuse its output instead of running detection/swap/matting, None disables
+STATIC_FRAME_THRESHOLD = 6
+
+# extra outputs encoded from the same render pass as the full size final_video
+VIDEO_RENDITIONS = [
+    {'name': '720p', 'height': 720, 'bitrate': '2500k'},
+    {'name': 'preview', 'height': 360, 'bitrate': '400k'},
+]
+
+# draft preview jobs (preview=true on upload): first seconds only, every Nth frame, low res
+PREVIEW_OPTIONS = {
+    'max_seconds': 5,
+    'frame_step': 2,
+    'max_height': 360,
+}
+
+# renders are committed in segments of this many input frames, a restarted worker resumes
+# after the last committed one instead of from frame zero
+CHECKPOINT_SEGMENT_FRAMES = 250
+
+# memory one worker process may use (models included) in MB, None for no limit. Renders
+# that don't fit get fewer decoder threads / x264 lookahead, then a smaller output size
+# (unless MEMORY_BUDGET_DOWNSCALE is off), otherwise the job fails before rendering.
+WORKER_MEMORY_BUDGET_MB = None
+MEMORY_BUDGET_DOWNSCALE = True
+
+# queue scheduling: shortest estimated job first with aging and per client fair share,
+# see DEFAULT_SCHEDULER_OPTIONS in api/scheduler.py for the keys
+SCHEDULER_OPTIONS = {
+    'aging_rate': 0.5,
+    'max_active_per_client': 2,
+}
+PREVIEW_PRIORITY = 10
+
+# claimed jobs carry a lease the worker's heartbeat renews, jobs of dead workers are
+# requeued with backoff (or failed after max_attempts), see api/leases.py
+JOB_LEASE_OPTIONS = {
+    'lease_seconds': 90,
+    'heartbeat_seconds': 20,
+    'max_attempts': 3,
+    'retry_backoff_seconds': 30,
+}
+
+# most face-set variants one POST /api/videos/batch/ may create
+BATCH_MAX_VARIANTS = 100
+# most job ids one GET /api/videos/status/?ids= may ask for
+STATUS_MAX_IDS = 200
+
+# queued jobs rendering the same input are claimed together (up to this many) and
+# rendered from one decode, detection and matting pass; 1 renders every job on its own
+SHARED_RENDER_MAX_VARIANTS = 4
+
+# faces detected in each frame are kept per input video (by path, size and mtime, and
+# detector settings) so re-renders of the same video skip detection; least recently used indexes
+# beyond FACE_INDEX_MAX_MB are deleted. None disables the index.
+FACE_INDEX_DIR = MEDIA_ROOT / 'face_index'
+FACE_INDEX_MAX_MB = 512
+
+# matting model tier for jobs with a background (helpers/matting.py): fast (u2netp),
+# balanced (silueta), portrait (u2net_human_seg), quality (isnet-general-use), or auto
+# to pick one per job from its size and length using the fps `benchmark_matting` measured
+# on this host (written to MATTING_BENCHMARK_FILE)
+MATTING_TIER = 'quality'
+MATTING_BENCHMARK_FILE = BASE_DIR / 'helpers' / 'models' / 'matting_benchmark.json'
+MATTING_AUTO_OPTIONS = {
+    'tiers': ['quality', 'portrait', 'balanced', 'fast'],
+    'target_fps': 6,
+    'short_job_seconds': 60,
+    # without a benchmark report: None is the cheapest of tiers
+    'fallback': None,
+}
+
+# the worker loads its models once at start and runs them on a dummy frame_size frame
+# (runs times, matting included) before it reports ready: a WorkerStatus row in the
+# ready state, GET /api/workers/, and WORKER_READY_FILE when set (for exec probes)
+WORKER_WARMUP = {
+    'enabled': True,
+    'frame_size': [1280, 720],
+    'runs': 2,
+    'matting': True,
+}
+WORKER_READY_FILE = None
+
+# a rendering worker writes its jobs' progress at most this often (and only when it
+# changed) instead of on every progress callback; remote workers post it this often
+WORKER_PROGRESS_SECONDS = 2
+
+# media lifecycle (api/storage.py): run by idle workers every gc_interval_seconds and by
+# `storage_gc`. Finished renders delete their processing files right away.
+STORAGE_OPTIONS = {
+    'processing_ttl_hours': 24,
+    'downloads_ttl_hours': 1,
+    'local_copy_retention_hours': 24,
+    'inputs_budget_mb': 20 * 1024,
+    'min_free_mb': None,
+    'gc_interval_seconds': 600,
+}
+
+# import time budgets the tests enforce (`check_startup` reports them): the API process
+# (wsgi app and urls) and the worker command must import within budget_ms and without the
+# heavy modules listed, which are imported where they're first used (engine build, first
+# upload/download)
+STARTUP_BUDGETS = {
+    'api': {
+        'modules': ['magic_roll_backend.wsgi', 'api.urls'],
+        'budget_ms': 1000,
+        'forbidden': ['cv2', 'numpy', 'onnxruntime', 'insightface', 'rembg', 'boto3', 'yt_dlp'],
+    },
+    'worker': {
+        'modules': ['api.management.commands.background_queue'],
+        'budget_ms': 1500,
+        'forbidden': ['onnxruntime', 'insightface', 'rembg', 'boto3', 'yt_dlp'],
+    },
+}
+
+# remote workers (`remote_worker`, on any machine) claim jobs, report progress and submit
+# results over /api/worker/ with "Authorization: Bearer <token>", one of these tokens
+# (comma separated in WORKER_API_TOKENS). Inputs and outputs move through the bucket as
+# presigned urls valid for presign_seconds, inputs are staged under input_prefix, by a
+# thread right after the upload with stage_on_upload, else by the claim.
+WORKER_API_TOKENS = [
+    token.strip() for token in os.getenv('WORKER_API_TOKENS', '').split(',') if token.strip()
+]
+REMOTE_WORKER_OPTIONS = {
+    'presign_seconds': 6 * 3600,
+    'input_prefix': 'inputs/',
+    'stage_on_upload': True,
+}
+
+# responses carry X-DB-Queries / X-DB-Time-Ms (api/middleware.py), `load_test_api` turns
+# it on in the server it starts
+QUERY_COUNT_HEADER = False